@@ -0,0 +1,383 @@
+"""
+TextIQ - HTTP API Server
+Headless chat completions over HTTP, sharing the app's models, pipeline and history
+"""
+
+import os
+import json
+import time
+import uuid
+import argparse
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from typing import List, Dict, Optional
+
+import core
+import metrics
+import exporter
+import tracing
+import search_index
+import history_store
+import retention
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+API_HOST = os.getenv("TEXTIQ_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("TEXTIQ_API_PORT", "8000"))
+
+# Required as "Authorization: Bearer <token>" when set
+API_TOKEN = os.getenv("TEXTIQ_API_TOKEN", "")
+
+# Largest request body accepted
+MAX_BODY_BYTES = 1024 * 1024
+
+# Idle keep-alive connections are closed after this many seconds
+KEEPALIVE_TIMEOUT = 30
+
+# Pending connections the listening socket queues under load
+LISTEN_BACKLOG = 128
+
+# Keep the search index in step with committed history writes
+history_store.add_listener("search_index", search_index.on_commit)
+
+# ============================================================================
+# REQUESTS
+# ============================================================================
+
+class APIError(Exception):
+    """Error reported to the client as a JSON body"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def history_file_for(user_id: str) -> str:
+    """History file of a user, as the app names it"""
+    if history_store.HISTORY_SHARDING == "none":
+        history_file = core.CHAT_HISTORY_FILE
+    else:
+        history_file = history_store.shard_path(core.CHAT_HISTORY_FILE, user_id)
+    retention.start(history_file)
+    return history_file
+
+def new_chat_id() -> str:
+    """Id for a chat started through the API"""
+    return uuid.uuid4().hex
+
+def parse_messages(body: Dict) -> List[Dict]:
+    """Validated conversation from a completion request"""
+    messages = body.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise APIError(400, "'messages' must be a non-empty list")
+    for message in messages:
+        if (not isinstance(message, dict) or message.get("role") not in ("user", "assistant")
+                or not isinstance(message.get("content"), str)):
+            raise APIError(400, "each message needs a role (user/assistant) and string content")
+    if messages[-1]["role"] != "user":
+        raise APIError(400, "the last message must be from the user")
+    return [{"role": m["role"], "content": m["content"]} for m in messages]
+
+def parse_completion(body: Dict) -> Dict:
+    """Generation settings from a completion request, with the app's defaults"""
+    try:
+        model = core.resolve_model(body.get("model") or body.get("mode"))
+    except ValueError as e:
+        raise APIError(400, str(e))
+    try:
+        temperature = float(body.get("temperature", core.DEFAULT_TEMPERATURE))
+    except (TypeError, ValueError):
+        raise APIError(400, "'temperature' must be a number")
+    system_prompt = body.get("system_prompt", core.DEFAULT_SYSTEM_PROMPT)
+    if not isinstance(system_prompt, str):
+        raise APIError(400, "'system_prompt' must be a string")
+    return {
+        "messages": parse_messages(body),
+        "system_prompt": system_prompt,
+        "model_name": model,
+        "temperature": temperature,
+    }
+
+def save_exchange(user_id: str, chat_id: str, messages: List[Dict], reply: str, turn: metrics.Turn):
+    """Queue the conversation plus reply to the user's history (upsert by chat id)"""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    chat_entry = {
+        "id": chat_id,
+        "timestamp": now,
+        "updated": now,
+        "title": messages[0]["content"][:50] + "..."
+    }
+    # The client sends the whole conversation, so it replaces the stored one;
+    # an edited or shortened conversation leaves no old messages behind
+    history_store.upsert_chat(history_file_for(user_id), chat_entry, 0,
+                              messages + [{"role": "assistant", "content": reply, "metrics": turn.as_dict()}],
+                              truncate=True)
+
+# ============================================================================
+# REQUEST HANDLER
+# ============================================================================
+
+class APIHandler(BaseHTTPRequestHandler):
+    """JSON endpoints over persistent HTTP/1.1 connections"""
+    protocol_version = "HTTP/1.1"
+    server_version = "TextIQ/1.0"
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out as separate writes; don't let Nagle hold the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+    # ------------------------------------------------------------------
+    # Routing
+    # ------------------------------------------------------------------
+
+    def do_GET(self):
+        self._dispatch({
+            "/health": self.handle_health,
+            "/v1/models": self.handle_models,
+            "/v1/metrics": self.handle_metrics,
+            "/v1/chats": self.handle_chats,
+        })
+
+    def do_POST(self):
+        self._dispatch({
+            "/v1/chat/completions": self.handle_completion,
+        })
+
+    def _dispatch(self, routes: Dict):
+        self.received = time.perf_counter()
+        self.server.count_request()
+        url = urlsplit(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        route, argument = url.path.rstrip("/") or "/", None
+        self.body_read = self.command != "POST"
+        if route not in routes and route.startswith("/v1/chats/"):
+            route, argument = "/v1/chats", route[len("/v1/chats/"):]
+        span = tracing.start_trace(f"{self.command} {route}", **{"http.method": self.command, "http.route": route})
+        try:
+            if route not in routes:
+                raise APIError(404, f"no route for {self.command} {url.path}")
+            if route != "/health":
+                self.check_token()
+            if argument is None:
+                routes[route]()
+            else:
+                routes[route](argument)
+        except Exception as e:
+            if not self.body_read:
+                # The unread body would be parsed as the next request
+                self.close_connection = True
+            if isinstance(e, APIError):
+                self.send_json(e.status, {"error": e.message})
+            else:
+                span.record_exception(e)
+                self.send_json(500, {"error": str(e)[:200]})
+        finally:
+            span.end()
+
+    # ------------------------------------------------------------------
+    # Helpers
+    # ------------------------------------------------------------------
+
+    def check_token(self):
+        if API_TOKEN and self.headers.get("Authorization", "") != f"Bearer {API_TOKEN}":
+            raise APIError(401, "missing or invalid bearer token")
+
+    def read_json(self) -> Dict:
+        length = self.headers.get("Content-Length", "")
+        if not length.isdigit():
+            raise APIError(411, "Content-Length required")
+        if int(length) > MAX_BODY_BYTES:
+            raise APIError(413, f"body larger than {MAX_BODY_BYTES} bytes")
+        data = self.rfile.read(int(length))
+        self.body_read = True
+        try:
+            body = json.loads(data or b"{}")
+        except ValueError:
+            raise APIError(400, "body is not valid JSON")
+        if not isinstance(body, dict):
+            raise APIError(400, "body must be a JSON object")
+        return body
+
+    def user_id(self, body: Optional[Dict] = None) -> Optional[str]:
+        """History owner: "user" in the body or query, else the X-TextIQ-User header"""
+        return (body or {}).get("user") or self.query.get("user") or self.headers.get("X-TextIQ-User")
+
+    def send_json(self, status: int, payload: Dict):
+        tracing.current_span().set_attribute("http.status_code", status)
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, payload) -> None:
+        """One server-sent event as one HTTP chunk"""
+        text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        data = f"data: {text}\n\n".encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    # ------------------------------------------------------------------
+    # Endpoints
+    # ------------------------------------------------------------------
+
+    def handle_health(self):
+        backend = core.get_backend()
+        self.send_json(200, {
+            "status": "ok" if backend.ready() else "unconfigured",
+            "backend": backend.name,
+            "ready": backend.ready(),
+            "uptime": round(time.time() - self.server.started, 1),
+            "requests": self.server.requests,
+            "history": history_store.stats(),
+        })
+
+    def handle_models(self):
+        self.send_json(200, {
+            "default": core.DEFAULT_MODE,
+            "models": [{"mode": mode, "model": model} for mode, model in core.MODELS.items()],
+        })
+
+    def handle_metrics(self):
+        self.send_json(200, {"models": metrics.summary(), "keys": core.key_stats()})
+
+    def handle_chats(self, chat_id: Optional[str] = None):
+        user_id = self.user_id()
+        if not user_id and history_store.HISTORY_SHARDING != "none":
+            raise APIError(400, "pass the user as ?user= or X-TextIQ-User")
+        chats = history_store.load_chats(history_file_for(user_id))
+        if chat_id is None:
+            self.send_json(200, {"chats": [
+                dict({key: chat.get(key) for key in ("id", "title", "timestamp", "updated")},
+                     messages=len(chat["messages"]))
+                for chat in chats
+            ]})
+            return
+        for chat in chats:
+            if chat["id"] == chat_id:
+                self.send_json(200, chat)
+                return
+        raise APIError(404, f"no chat '{chat_id}'")
+
+    def handle_completion(self):
+        body = self.read_json()
+        request = parse_completion(body)
+        user_id = self.user_id(body)
+        chat_id = body.get("chat_id") or (new_chat_id() if user_id else None)
+
+        backend = core.get_backend()
+        problem = backend.setup_error()
+        if problem:
+            raise APIError(503, problem)
+
+        turn = metrics.Turn(request["model_name"], submitted=self.received)
+        if body.get("stream"):
+            self.stream_completion(request, turn, user_id, chat_id)
+            return
+
+        try:
+            reply = core.generate_reply(**request, turn=turn)
+        except Exception as e:
+            raise APIError(502, core.error_message(e))
+        if user_id:
+            save_exchange(user_id, chat_id, request["messages"], reply, turn)
+        self.send_json(200, {
+            "chat_id": chat_id,
+            "model": request["model_name"],
+            "message": {"role": "assistant", "content": reply},
+            "metrics": turn.as_dict(),
+        })
+
+    def stream_completion(self, request: Dict, turn: metrics.Turn, user_id: Optional[str], chat_id: Optional[str]):
+        """Reply as server-sent events over a chunked response"""
+        tracing.current_span().set_attribute("http.status_code", 200)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        parts = []
+        try:
+            for text in core.stream_reply(**request, turn=turn):
+                parts.append(text)
+                self.send_event({"delta": text})
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            return
+        except Exception as e:
+            # Headers are already sent; report the failure in the stream
+            self.send_event({"error": core.error_message(e)})
+        else:
+            reply = "".join(parts)
+            if user_id:
+                save_exchange(user_id, chat_id, request["messages"], reply, turn)
+            self.send_event({"chat_id": chat_id, "model": request["model_name"], "done": True,
+                             "metrics": turn.as_dict()})
+        self.send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+# ============================================================================
+# SERVER
+# ============================================================================
+
+class APIServer(ThreadingHTTPServer):
+    """Thread-per-connection server with request counters"""
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+    def __init__(self, address, access_log: bool = False):
+        super().__init__(address, APIHandler)
+        self.access_log = access_log
+        self.started = time.time()
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+def create_server(host: str = API_HOST, port: int = API_PORT, access_log: bool = False) -> APIServer:
+    """Bound server (port 0 picks a free port); call serve_forever() to run it"""
+    return APIServer((host, port), access_log=access_log)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="TextIQ HTTP API server")
+    parser.add_argument("--host", default=API_HOST, help=f"interface to listen on (default: {API_HOST})")
+    parser.add_argument("--port", type=int, default=API_PORT, help=f"port to listen on (default: {API_PORT})")
+    parser.add_argument("--backend", choices=core.BACKEND_NAMES, help="response backend (default: TEXTIQ_LLM_BACKEND)")
+    parser.add_argument("--access-log", action="store_true", help="log every request to stderr")
+    args = parser.parse_args(argv)
+
+    if args.backend:
+        core.set_backend(core.create_backend(args.backend))
+    backend = core.get_backend()
+    if not backend.ready():
+        print(f"⚠️ {backend.setup_error() or 'API key looks invalid'} - completions will fail")
+
+    server = create_server(args.host, args.port, access_log=args.access_log)
+    host, port = server.server_address[:2]
+    print(f"TextIQ API ({backend.name}) listening on http://{host}:{port}")
+    if exporter.start():
+        print(f"Prometheus metrics on http://{exporter.METRICS_HOST}:{exporter.METRICS_PORT}/metrics")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        history_store.flush(10)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
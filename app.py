@@ -5,841 +5,752 @@ Clean Design with Dark/Light Mode & Chat History
 
 import streamlit as st
 import time
-import os
-import json
+import uuid
 from datetime import datetime
-from typing import List, Dict
-from dotenv import load_dotenv
 
-# Import Google Gemini
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-
-# Load environment variables
-load_dotenv()
+# Start of this rerun; a reply's queue time counts from here
+RUN_STARTED = time.perf_counter()
+
+import core
+import metrics
+import exporter
+import tracing
+import profiling
+import memory
+import model_catalog
+import key_pool
+import search_index
+import history_store
+import retention
+import session_store
+import theme
+from core import MODELS, DEFAULT_SYSTEM_PROMPT, CHAT_HISTORY_FILE, generate_response
+from message_window import MessageWindow
+import message_window
 
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
-# Support both Streamlit Cloud secrets and local .env
-try:
-    GEMINI_API_KEY = st.secrets.get("GEMINI_API_KEY", "")
-except:
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+# Models, system prompt and the response pipeline live in core.py
+
+@st.cache_resource(show_spinner=False)
+def configure_backend():
+    """Resolve the API key once per process, not on every rerun"""
+    # Support both Streamlit Cloud secrets and local .env (checking for a
+    # secrets file quietly; a missing one would otherwise print an error
+    # before set_page_config)
+    try:
+        has_secrets = st.secrets.load_if_toml_exists()
+    except:
+        has_secrets = False
+    api_key = st.secrets.get("GEMINI_API_KEY", "") if has_secrets else core.GEMINI_API_KEY
+    # More keys to rotate through: a list or a comma separated string
+    api_keys = st.secrets.get("GEMINI_API_KEYS", []) if has_secrets else core.GEMINI_API_KEYS
+    core.configure(api_key=api_key, api_keys=key_pool.parse_keys(api_keys))
+    return core.get_backend()
+
+configure_backend()
+
+# Serve /metrics to Prometheus on TEXTIQ_METRICS_PORT (once per process; off by default)
+exporter.start()
+
+# Memory snapshots for the debug view (once per process; only with TEXTIQ_MEMORY_DEBUG=1)
+memory.start()
 
-# AI Models (internal use only)
-MODELS = {
-    "Fast Mode": "gemini-2.5-flash",
-    "Powerful Mode": "gemini-2.5-pro",
-    "Balanced Mode": "gemini-1.5-flash"
-}
+# Check which models respond, in the background; until then every mode is offered
+MODEL_CATALOG = model_catalog.get_catalog()
+MODEL_CATALOG.refresh_async()
 
-DEFAULT_SYSTEM_PROMPT = """You are TextIQ, an intelligent AI assistant. You provide clear, 
-accurate, and helpful responses. You are professional, friendly, and always aim to assist users 
-in the best way possible."""
+RUN_FINISHED = False
 
-# Chat history file
-CHAT_HISTORY_FILE = "chat_history.json"
+def finish_run():
+    """Record how long this run took (metrics, trace and profile) and what the session holds (once per run)"""
+    global RUN_FINISHED
+    if RUN_FINISHED:
+        return
+    RUN_FINISHED = True
+    metrics.RERUN_SECONDS.observe(time.perf_counter() - RUN_STARTED)
+    RUN_SPAN.end()
+    RUN_PROFILE.stop()
+    memory.record_session(st.session_state.get("session_id") or st.session_state.get("chat_id"), st.session_state)
+
+def rerun():
+    """st.rerun(), recording this run first"""
+    finish_run()
+    st.rerun()
+
+# Placeholder identity st.experimental_user reports outside Streamlit Cloud
+LOCAL_USER_EMAIL = "test@example.com"
+
+# Keep the search index in step with committed history writes
+history_store.add_listener("search_index", search_index.on_commit)
+
+# ============================================================================
+# USER IDENTITY
+# ============================================================================
+
+def resolve_user_id():
+    """Identity whose history this session sees: login email, else a per-browser id"""
+    try:
+        email = st.experimental_user.get("email")
+    except Exception:
+        email = None
+    if email and email != LOCAL_USER_EMAIL:
+        return f"email:{email.lower()}"
+    
+    # Anonymous: a random id kept in the URL so reloads and bookmarks
+    # return to the same history
+    uid = st.query_params.get("uid")
+    if not uid:
+        uid = uuid.uuid4().hex
+        st.query_params["uid"] = uid
+    return f"uid:{uid}"
+
+def get_history_file():
+    """History file for this session's user"""
+    if "history_file" not in st.session_state:
+        if history_store.HISTORY_SHARDING == "none":
+            history_file = CHAT_HISTORY_FILE
+        else:
+            history_file = history_store.shard_path(CHAT_HISTORY_FILE, resolve_user_id())
+        st.session_state.history_file = history_file
+        # Evict old chats in the background when TEXTIQ_RETENTION_* limits are set
+        retention.start(history_file)
+    return st.session_state.history_file
 
 # ============================================================================
 # CHAT HISTORY FUNCTIONS
 # ============================================================================
 
+def new_chat_id():
+    """Stable, collision-free id for a chat"""
+    return uuid.uuid4().hex
+
+def start_new_chat():
+    """Reset the session to an empty, unsaved chat"""
+    st.session_state.messages = MessageWindow()
+    st.session_state.show_earlier = False
+    st.session_state.chat_id = new_chat_id()
+    st.session_state.saved_count = 0
+
+@tracing.traced()
 def save_chat_history():
-    """Save current chat to history"""
-    if not st.session_state.messages:
-        return
+    """Save current chat to history (upsert by chat id)"""
+    messages = st.session_state.messages
+    saved_count = st.session_state.saved_count
     
-    # Load existing history
-    history = load_all_chats()
+    # Dirty tracking - nothing new since the last save
+    if not messages or len(messages) == saved_count:
+        return
     
-    # Create new chat entry
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     chat_entry = {
-        "id": datetime.now().strftime("%Y%m%d_%H%M%S"),
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "title": st.session_state.messages[0]["content"][:50] + "..." if st.session_state.messages else "New Chat",
-        "messages": st.session_state.messages.copy()
+        "id": st.session_state.chat_id,
+        "timestamp": now,
+        "updated": now,
+        "title": messages[0]["content"][:50] + "..."
     }
     
-    # Add to history
-    history.append(chat_entry)
-    
-    # Save to file
-    try:
-        with open(CHAT_HISTORY_FILE, 'w') as f:
-            json.dump(history, f, indent=2)
-    except Exception as e:
-        st.error(f"Failed to save chat: {str(e)}")
+    # Queue only the messages added since the last save; the writer
+    # thread commits them in the background
+    history_store.upsert_chat(get_history_file(), chat_entry, saved_count, messages[saved_count:])
+    st.session_state.saved_count = len(messages)
 
+@tracing.traced()
 def load_all_chats():
     """Load all chat history"""
-    try:
-        if os.path.exists(CHAT_HISTORY_FILE):
-            with open(CHAT_HISTORY_FILE, 'r') as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return []
+    return history_store.load_chats(get_history_file())
 
 def load_chat(chat_id):
     """Load a specific chat"""
     history = load_all_chats()
     for chat in history:
         if chat["id"] == chat_id:
-            st.session_state.messages = chat["messages"]
-            st.rerun()
+            st.session_state.messages = MessageWindow(chat["messages"])
+            st.session_state.show_earlier = False
+            st.session_state.chat_id = chat_id
+            st.session_state.saved_count = len(chat["messages"])
+            rerun()
 
 def delete_chat(chat_id):
     """Delete a specific chat"""
-    history = load_all_chats()
-    history = [chat for chat in history if chat["id"] != chat_id]
+    history_store.delete_chat(get_history_file(), chat_id)
+    # Don't resurrect the deleted chat on the next autosave
+    if chat_id == st.session_state.chat_id:
+        st.session_state.chat_id = new_chat_id()
+        st.session_state.saved_count = 0
+    rerun()
+
+def get_search_index():
+    """Get the search index kept next to this user's history file"""
+    return search_index.get_index(get_history_file(), loader=load_all_chats)
+
+@tracing.traced()
+def search_chats(query: str, limit: int = 50):
+    """Search saved chats by title and content, best match first (id, title and timestamp)"""
+    return get_search_index().search_chats(query, limit)
+
+# ============================================================================
+# SESSION PERSISTENCE
+# ============================================================================
+
+@tracing.traced()
+def restore_session():
+    """Rehydrate a reconnecting session (?sid=) from the shared session store
+
+    Only the user who saved a session gets it back: a ?sid= link opened by
+    someone else starts a new session instead of showing their transcript.
+    """
+    store = session_store.get_store()
+    if store is None or "session_id" in st.session_state:
+        return
+    session_id = st.query_params.get("sid")
+    restored = store.load(session_id, owner=resolve_user_id()) if session_id else None
+    if restored:
+        for key, value in restored.items():
+            st.session_state[key] = value
+    else:
+        session_id = uuid.uuid4().hex
+        st.query_params["sid"] = session_id
+    st.session_state.session_id = session_id
+
+@tracing.traced()
+def persist_session():
+    """Write this turn's session state changes to the shared session store"""
+    store = session_store.get_store()
+    if store is None or "session_id" not in st.session_state:
+        return
     try:
-        with open(CHAT_HISTORY_FILE, 'w') as f:
-            json.dump(history, f, indent=2)
-        st.rerun()
-    except Exception as e:
-        st.error(f"Failed to delete chat: {str(e)}")
+        store.save(st.session_state.session_id, st.session_state, owner=resolve_user_id())
+    except Exception:
+        pass  # Best effort: the live session does not depend on it
 
 # ============================================================================
-# MODERN CSS WITH DARK/LIGHT MODE
+# RESPONSE METRICS
 # ============================================================================
 
-def load_custom_css(dark_mode: bool = False):
-    """Load modern CSS with dark/light mode support"""
-    
-    if dark_mode:
-        # DARK MODE COLORS
-        bg_color = "#0f0f0f"
-        card_bg = "#1a1a1a"
-        text_color = "#ffffff"
-        text_secondary = "#b0b0b0"
-        border_color = "#333333"
-        user_msg_bg = "#000000"
-        user_msg_text = "#ffffff"
-        ai_msg_bg = "#2a2a2a"  # Light gray for AI messages
-        ai_msg_border = "#3a3a3a"
-        sidebar_bg = "#1a1a1a"
-        button_bg = "#ffffff"
-        button_text = "#000000"
-        button_hover_bg = "#e0e0e0"
-        input_bg = "#1a1a1a"
-        input_border = "#333333"
+def show_response_metrics():
+    """Latency percentiles and token rate per mode over recent replies in this process"""
+    summary = metrics.summary()
+    rows = []
+    for mode, model in MODELS.items():
+        stats = summary.get(model)
+        if stats:
+            rows.append(
+                f"| {mode} | {stats['turns']} | {stats['p50_ms'] / 1000:.1f} s | {stats['p95_ms'] / 1000:.1f} s "
+                f"| {stats['ttft_p50_ms'] / 1000:.1f} s | {stats['tokens_per_s']:.0f} | {stats['errors']} |"
+            )
+    if rows:
+        st.markdown("\n".join([
+            "| Mode | Replies | p50 | p95 | First token p50 | Tokens/s | Errors |",
+            "|------|---------|-----|-----|-----------------|----------|--------|",
+        ] + rows))
     else:
-        # LIGHT MODE COLORS
-        bg_color = "#ffffff"
-        card_bg = "#ffffff"
-        text_color = "#000000"
-        text_secondary = "#6b7280"
-        border_color = "#e5e7eb"
-        user_msg_bg = "#000000"  # Black for user
-        user_msg_text = "#ffffff"
-        ai_msg_bg = "#e5e7eb"  # Light gray for AI
-        ai_msg_border = "#d1d5db"
-        sidebar_bg = "#f9fafb"
-        button_bg = "#000000"
-        button_text = "#ffffff"
-        button_hover_bg = "#1f2937"
-        input_bg = "#ffffff"
-        input_border = "#e5e7eb"
-    
-    st.markdown(f"""
-        <style>
-        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap');
-        
-        * {{
-            font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
-        }}
-        
-        /* Main background */
-        .stApp {{
-            background: {bg_color};
-            transition: background 0.3s ease;
-        }}
-        
-        /* Hide Streamlit branding */
-        #MainMenu {{visibility: hidden;}}
-        footer {{visibility: hidden;}}
-        header {{visibility: hidden;}}
-        
-        /* Main title */
-        h1 {{
-            font-size: 3rem !important;
-            font-weight: 800 !important;
-            color: {text_color};
-            text-align: center;
-            margin-bottom: 0.5rem !important;
-            letter-spacing: -0.02em;
-        }}
-        
-        /* Chat message container */
-        .stChatMessage {{
-            border-radius: 18px !important;
-            padding: 1rem 1.2rem !important;
-            margin: 0.5rem 0 !important;
-            max-width: 70% !important;
-            animation: slideUp 0.3s ease-out;
-            box-shadow: 0 1px 2px rgba(0, 0, 0, 0.1);
-            width: fit-content !important;
-        }}
-        
-        @keyframes slideUp {{
-            from {{
-                opacity: 0;
-                transform: translateY(10px);
-            }}
-            to {{
-                opacity: 1;
-                transform: translateY(0);
-            }}
-        }}
-        
-        /* Force user messages to RIGHT */
-        div[data-testid="stChatMessageContainer"]:has([data-testid*="user"]) {{
-            display: flex !important;
-            justify-content: flex-end !important;
-        }}
-        
-        /* Force AI messages to LEFT */
-        div[data-testid="stChatMessageContainer"]:has([data-testid*="assistant"]) {{
-            display: flex !important;
-            justify-content: flex-start !important;
-        }}
-        
-        /* User messages - RIGHT side, BLACK like iMessage */
-        .stChatMessage[data-testid*="user"] {{
-            background: #000000 !important;
-            color: #ffffff !important;
-            border: none !important;
-            border-radius: 18px 18px 4px 18px !important;
-            float: right !important;
-            clear: both !important;
-        }}
-        
-        .stChatMessage[data-testid*="user"] p {{
-            color: #ffffff !important;
-            margin: 0 !important;
-        }}
-        
-        .stChatMessage[data-testid*="user"] .stMarkdown {{
-            color: #ffffff !important;
-        }}
-        
-        .stChatMessage[data-testid*="user"] div {{
-            color: #ffffff !important;
-        }}
-        
-        /* AI messages - LEFT side, LIGHT GRAY like WhatsApp */
-        .stChatMessage[data-testid*="assistant"] {{
-            background: {ai_msg_bg} !important;
-            border: 1px solid {ai_msg_border} !important;
-            color: {text_color} !important;
-            border-radius: 18px 18px 18px 4px !important;
-            float: left !important;
-            clear: both !important;
-        }}
-        
-        .stChatMessage[data-testid*="assistant"] p {{
-            color: {text_color} !important;
-            margin: 0 !important;
-        }}
-        
-        .stChatMessage[data-testid*="assistant"] div {{
-            color: {text_color} !important;
-        }}
-        
-        /* Chat message content wrapper */
-        .stChatMessage > div {{
-            max-width: 100% !important;
-        }}
-        
-        /* Clear floats after each message */
-        .stChatMessage::after {{
-            content: "";
-            display: table;
-            clear: both;
-        }}
-        
-        /* Main chat container */
-        section[data-testid="stVerticalBlock"] > div {{
-            display: block !important;
-        }}
-        
-        /* Override Streamlit's flex container */
-        .element-container {{
-            width: 100% !important;
-        }}
-        
-        /* Sidebar */
-        section[data-testid="stSidebar"] {{
-            background: {sidebar_bg} !important;
-            border-right: 1px solid {border_color};
-        }}
-        
-        section[data-testid="stSidebar"] > div {{
-            padding-top: 1rem;
-        }}
-        
-        /* Make sidebar toggle button more visible */
-        button[kind="header"] {{
-            background: {button_bg} !important;
-            color: {button_text} !important;
-            border-radius: 8px !important;
-            padding: 0.5rem !important;
-        }}
-        
-        /* Sidebar collapse button styling */
-        section[data-testid="stSidebar"] button[kind="header"] {{
-            display: block !important;
-            visibility: visible !important;
-        }}
-        
-        /* Buttons */
-        .stButton > button {{
-            background: {button_bg};
-            color: {button_text};
-            border: 2px solid {button_bg};
-            border-radius: 12px;
-            padding: 0.75rem 1.5rem;
-            font-weight: 600;
-            font-size: 0.95rem;
-            transition: all 0.2s ease;
-            width: 100%;
-        }}
-        
-        .stButton > button:hover {{
-            background: {button_hover_bg};
-            border-color: {button_hover_bg};
-            transform: translateY(-1px);
-        }}
-        
-        /* Small buttons */
-        .small-button {{
-            background: {button_bg};
-            color: {button_text};
-            border: 1px solid {button_bg};
-            border-radius: 8px;
-            padding: 0.5rem 1rem;
-            font-weight: 600;
-            font-size: 0.85rem;
-            cursor: pointer;
-            transition: all 0.2s ease;
-            display: inline-block;
-        }}
-        
-        .small-button:hover {{
-            transform: translateY(-1px);
-        }}
-        
-        /* Chat input */
-        .stChatInputContainer {{
-            background: {input_bg} !important;
-            border: 2px solid {input_border} !important;
-            border-radius: 16px !important;
-            padding: 0.5rem !important;
-        }}
-        
-        /* Text area */
-        .stTextArea textarea {{
-            background: {input_bg} !important;
-            border: 2px solid {input_border} !important;
-            border-radius: 12px;
-            padding: 0.75rem;
-            font-size: 0.95rem;
-            color: {text_color};
-        }}
-        
-        /* Select box */
-        .stSelectbox > div > div {{
-            background: {input_bg} !important;
-            border: 2px solid {input_border} !important;
-            border-radius: 12px;
-            color: {text_color};
-        }}
-        
-        /* Slider */
-        .stSlider > div > div > div {{
-            background: {button_bg};
-        }}
-        
-        /* Labels */
-        label {{
-            color: {text_color} !important;
-            font-weight: 600 !important;
-            font-size: 0.9rem !important;
-        }}
-        
-        /* Captions */
-        .stCaption {{
-            color: {text_secondary} !important;
-        }}
-        
-        /* Expander */
-        .streamlit-expanderHeader {{
-            background: {card_bg} !important;
-            border: 2px solid {border_color} !important;
-            border-radius: 12px;
-            color: {text_color} !important;
-            font-weight: 600 !important;
-        }}
-        
-        /* Chat history item */
-        .chat-history-item {{
-            background: {card_bg};
-            border: 2px solid {border_color};
-            border-radius: 12px;
-            padding: 0.75rem;
-            margin-bottom: 0.5rem;
-            cursor: pointer;
-            transition: all 0.2s ease;
-        }}
-        
-        .chat-history-item:hover {{
-            border-color: {button_bg};
-            transform: translateX(4px);
-        }}
-        
-        .chat-history-title {{
-            color: {text_color};
-            font-weight: 600;
-            font-size: 0.9rem;
-            margin-bottom: 0.25rem;
-        }}
-        
-        .chat-history-time {{
-            color: {text_secondary};
-            font-size: 0.75rem;
-        }}
-        
-        /* Divider */
-        hr {{
-            border: none;
-            height: 1px;
-            background: {border_color};
-            margin: 1rem 0;
-        }}
-        
-        /* Scrollbar */
-        ::-webkit-scrollbar {{
-            width: 10px;
-        }}
-        
-        ::-webkit-scrollbar-track {{
-            background: {sidebar_bg};
-        }}
-        
-        ::-webkit-scrollbar-thumb {{
-            background: {border_color};
-            border-radius: 5px;
-        }}
-        
-        /* Input text */
-        input {{
-            color: {text_color} !important;
-        }}
-        
-        /* Markdown */
-        .stMarkdown {{
-            color: {text_color};
-        }}
-        </style>
-    """, unsafe_allow_html=True)
+        st.caption("No replies yet")
+
+def show_key_usage():
+    """Requests, rate limits and remaining headroom per API key (only with more than one key)"""
+    keys = core.key_stats()
+    if len(keys) < 2:
+        return
+    st.markdown("**🔑 API Keys**")
+    st.markdown("\n".join(["| Key | Requests | Rate limited | Headroom |", "|-----|----------|--------------|----------|"] + [
+        f"| {key['key']} | {key['requests']} | {key['rate_limited']} | "
+        + (f"resting {key['cooldown_s']:.0f}s" if key["cooldown_s"] else f"{key['headroom']:.0%}") + " |"
+        for key in keys
+    ]))
 
 # ============================================================================
-# RESPONSE GENERATOR
+# MEMORY DEBUG VIEW
 # ============================================================================
 
-def generate_response(messages: List[Dict], system_prompt: str, model_name: str, temperature: float) -> str:
-    """Generate AI response"""
+def _kb(size: int) -> str:
+    return f"{size / 1024:,.1f} KB"
+
+def show_memory_debug():
+    """Largest sessions, state keys, caches and growing allocations (TEXTIQ_MEMORY_DEBUG=1)"""
+    session_id = st.session_state.get("session_id") or st.session_state.chat_id
+    memory.record_session(session_id, st.session_state, force=True)
+    latest = (memory.snapshots() or [memory.process_memory()])[-1]
+    parts = [f"Process RSS {latest['rss_mb']:.0f} MB, peak {latest['peak_rss_mb']:.0f} MB"] if "rss_mb" in latest else []
+    if "traced_bytes" in latest:
+        parts.append(f"traced {latest['traced_bytes'] / 1024 / 1024:.0f} MB")
+    st.caption(", ".join(parts) or "Process memory unavailable (pip install psutil)")
     
-    if not GEMINI_AVAILABLE:
-        return "❌ Please install: pip install google-generativeai"
+    sessions = memory.session_usage()
+    this_session = next((session for session in sessions if session["session"] == session_id), None)
+    if this_session:
+        st.markdown("\n".join(["| This session's state | Size |", "|------|------|"] + [
+            f"| `{key}` | {_kb(size)} |" for key, size in this_session["keys"][:10]
+        ]))
+    st.markdown("\n".join(["| Session | Size | Largest key |", "|---------|------|-------------|"] + [
+        f"| {session['session'][:12]} | {_kb(session['bytes'])} | `{session['keys'][0][0]}` |"
+        for session in sessions if session["keys"]
+    ]))
+    st.markdown("\n".join(["| Cache | Size |", "|-------|------|"] + [
+        f"| {cache['cache']} | {_kb(cache['bytes'])} |" for cache in memory.cache_usage()
+    ]))
     
-    if not GEMINI_API_KEY:
-        return "❌ API key not configured"
-    
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        
-        model = genai.GenerativeModel(
-            model_name=model_name,
-            generation_config={
-                "temperature": temperature,
-                "max_output_tokens": 2048,
-            }
-        )
-        
-        history = []
-        
-        # Add system prompt as first exchange
-        if system_prompt:
-            history.append({
-                "role": "user",
-                "parts": [system_prompt]
-            })
-            history.append({
-                "role": "model",
-                "parts": ["Understood. I'll follow these instructions."]
-            })
-        
-        # Add conversation history
-        for msg in messages[:-1]:
-            history.append({
-                "role": "user" if msg["role"] == "user" else "model",
-                "parts": [msg["content"]]
-            })
-        
-        chat = model.start_chat(history=history)
-        response = chat.send_message(messages[-1]["content"])
-        
-        return response.text
-        
-    except Exception as e:
-        error_msg = str(e).lower()
-        
-        if "quota" in error_msg or "429" in error_msg or "limit" in error_msg:
-            return "⏳ Usage limit reached. Please wait a moment or get a new API key."
-        else:
-            return f"❌ Error: {str(e)[:100]}"
+    growth = memory.diff()
+    suspects = {suspect["location"] for suspect in memory.leak_suspects()}
+    if growth:
+        st.markdown("\n".join([
+            f"| Allocated at (over {len(memory.snapshots())} snapshots) | Now | Growth |",
+            "|------------------------------|-----|--------|",
+        ] + [
+            f"| `{change['location']}`{' ⚠️' if change['location'] in suspects else ''} "
+            f"| {_kb(change['size'])} | {_kb(change['size_diff'])} |"
+            for change in growth
+        ]))
+        st.caption("⚠️ grew in every snapshot: a likely leak")
+    else:
+        st.caption("Allocation growth shows after the next snapshot")
+    if st.button("📸 Take snapshot", key="memory_snapshot"):
+        memory.take_snapshot()
+        rerun()
 
 # ============================================================================
-# STREAMLIT APP
+# MODERN CSS WITH DARK/LIGHT MODE
 # ============================================================================
 
-st.set_page_config(
-    page_title="TextIQ",
-    page_icon="🧠",
-    layout="wide",
-    initial_sidebar_state="expanded"  # Keep sidebar open by default
-)
+@tracing.traced()
+def load_custom_css(dark_mode: bool = False):
+    """Load modern CSS with dark/light mode support"""
+    st.markdown(theme.build_css(dark_mode), unsafe_allow_html=True)
 
 # ============================================================================
-# SESSION STATE
+# STREAMLIT APP
 # ============================================================================
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# Root span of this run's trace (a no-op unless TEXTIQ_TRACE=1)
+RUN_SPAN = tracing.start_trace("rerun")
 
-if "system_prompt" not in st.session_state:
-    st.session_state.system_prompt = DEFAULT_SYSTEM_PROMPT
+# CPU profile of this run (TEXTIQ_PROFILE=rerun, or ?profile=rerun with TEXTIQ_PROFILE_QUERY=1)
+RUN_PROFILE = profiling.start("rerun", requested=st.query_params.get("profile"))
 
-if "selected_model" not in st.session_state:
-    st.session_state.selected_model = "Fast Mode"
+# Every run ends in finish_run(): at the end of the script, or on rerun(),
+# st.stop() or an exception
+try:
+    st.set_page_config(
+        page_title="TextIQ",
+        page_icon="🧠",
+        layout="wide",
+        initial_sidebar_state="expanded"  # Keep sidebar open by default
+    )
 
-if "temperature" not in st.session_state:
-    st.session_state.temperature = 0.7
+    # ============================================================================
+    # SESSION STATE
+    # ============================================================================
 
-if "dark_mode" not in st.session_state:
-    st.session_state.dark_mode = False
+    # Restore first so the defaults below only fill what was not saved
+    restore_session()
 
-if "show_settings" not in st.session_state:
-    st.session_state.show_settings = False
+    # Messages live in a bounded window; older ones spill to disk
+    if "messages" not in st.session_state:
+        st.session_state.messages = MessageWindow()
+    elif not isinstance(st.session_state.messages, MessageWindow):
+        st.session_state.messages = MessageWindow(st.session_state.messages)
 
-if "show_history" not in st.session_state:
-    st.session_state.show_history = False
+    if "show_earlier" not in st.session_state:
+        st.session_state.show_earlier = False
 
-# Apply theme
-load_custom_css(st.session_state.dark_mode)
+    if "chat_id" not in st.session_state:
+        st.session_state.chat_id = new_chat_id()
 
-# ============================================================================
-# SIDEBAR
-# ============================================================================
+    if "saved_count" not in st.session_state:
+        st.session_state.saved_count = 0
 
-with st.sidebar:
-    # Header buttons
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        if st.button("⚙️", help="Settings", use_container_width=True):
-            st.session_state.show_settings = not st.session_state.show_settings
-            st.session_state.show_history = False
-            st.rerun()
-    
-    with col2:
-        if st.button("📝", help="New Chat", use_container_width=True):
-            if st.session_state.messages:
-                save_chat_history()
-            st.session_state.messages = []
-            st.rerun()
-    
-    with col3:
-        if st.button("📚", help="Chat History", use_container_width=True):
-            st.session_state.show_history = not st.session_state.show_history
-            st.session_state.show_settings = False
-            st.rerun()
-    
-    st.markdown("---")
-    
-    # Settings Panel
-    if st.session_state.show_settings:
-        st.markdown("### ⚙️ Settings")
-        
-        # Dark mode toggle
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            st.markdown("**🌙 Dark Mode**")
-        with col2:
-            if st.button("🔄", key="dark_mode_toggle"):
-                st.session_state.dark_mode = not st.session_state.dark_mode
-                st.rerun()
-        
-        st.markdown("---")
-        
-        # AI Personality
-        st.markdown("**💭 AI Personality**")
-        st.session_state.system_prompt = st.text_area(
-            "Customize",
-            value=st.session_state.system_prompt,
-            height=100,
-            label_visibility="collapsed"
-        )
-        
-        # Mode Selection
-        st.markdown("**🚀 Mode**")
-        st.session_state.selected_model = st.selectbox(
-            "Mode",
-            options=list(MODELS.keys()),
-            label_visibility="collapsed"
-        )
-        
-        # Creativity Level
-        st.markdown("**🎨 Creativity**")
-        st.session_state.temperature = st.slider(
-            "Creativity",
-            0.0, 1.5,
-            st.session_state.temperature,
-            0.1,
-            label_visibility="collapsed"
-        )
-    
-    # Chat History Panel
-    elif st.session_state.show_history:
-        st.markdown("### 📚 Chat History")
-        
-        chat_history = load_all_chats()
-        
-        if chat_history:
-            # Reverse to show newest first
-            for chat in reversed(chat_history):
-                col1, col2 = st.columns([4, 1])
-                
-                with col1:
-                    if st.button(
-                        f"💬 {chat['title'][:30]}...",
-                        key=f"load_{chat['id']}",
-                        help=chat['timestamp'],
-                        use_container_width=True
-                    ):
-                        load_chat(chat['id'])
-                
-                with col2:
-                    if st.button("🗑️", key=f"del_{chat['id']}", help="Delete"):
-                        delete_chat(chat['id'])
-        else:
-            st.info("No chat history yet")
-    
-    # Default view - Quick actions
-    else:
-        st.markdown("### 🚀 Quick Actions")
-        st.info("Use the buttons above to:\n\n⚙️ Open Settings\n\n📝 Start New Chat\n\n📚 View History")
-    
-    st.markdown("---")
-    
-    # Clear current chat
-    if st.button("🗑️ Clear Current Chat", use_container_width=True):
-        st.session_state.messages = []
-        st.rerun()
+    # Resolve whose history this session uses (sets ?uid= for anonymous users)
+    get_history_file()
 
-# ============================================================================
-# MAIN CHAT AREA
-# ============================================================================
+    if "system_prompt" not in st.session_state:
+        st.session_state.system_prompt = DEFAULT_SYSTEM_PROMPT
 
-# Header with quick actions
-header_col1, header_col2, header_col3, header_col4 = st.columns([1, 1, 1, 1])
+    if st.session_state.get("selected_model") not in MODELS:
+        st.session_state.selected_model = MODEL_CATALOG.default_mode()
 
-with header_col1:
-    if st.button("⚙️ Settings", use_container_width=True, key="main_settings"):
-        st.session_state.show_settings = not st.session_state.show_settings
-        st.session_state.show_history = False
+    if "temperature" not in st.session_state:
+        st.session_state.temperature = 0.7
 
-with header_col2:
-    if st.button("📝 New Chat", use_container_width=True, key="main_new_chat"):
-        if st.session_state.messages:
-            save_chat_history()
-        st.session_state.messages = []
-        st.rerun()
+    if "dark_mode" not in st.session_state:
+        st.session_state.dark_mode = False
 
-with header_col3:
-    if st.button("📚 History", use_container_width=True, key="main_history"):
-        st.session_state.show_history = not st.session_state.show_history
+    if "show_settings" not in st.session_state:
         st.session_state.show_settings = False
 
-with header_col4:
-    if st.button("🌓 Theme", use_container_width=True, key="main_dark_mode"):
-        st.session_state.dark_mode = not st.session_state.dark_mode
-        st.rerun()
+    if "show_history" not in st.session_state:
+        st.session_state.show_history = False
+
+    RUN_SPAN.set_attribute("session.id", st.session_state.get("session_id", ""))
+    RUN_PROFILE.tag(session=st.session_state.get("session_id") or st.session_state.chat_id,
+                    turn=len(st.session_state.messages) // 2)
+
+    # Modes whose model responded to the catalog's probe come first
+    mode_options = MODEL_CATALOG.ordered_modes()
+
+    # Apply theme
+    load_custom_css(st.session_state.dark_mode)
 
-# Show settings panel in main area if toggled
-if st.session_state.show_settings:
-    with st.expander("⚙️ Settings", expanded=True):
-        col1, col2 = st.columns(2)
+    # ============================================================================
+    # SIDEBAR
+    # ============================================================================
+
+    with st.sidebar:
+        # Header buttons
+        col1, col2, col3 = st.columns(3)
         
         with col1:
+            if st.button("⚙️", help="Settings", use_container_width=True):
+                st.session_state.show_settings = not st.session_state.show_settings
+                st.session_state.show_history = False
+                rerun()
+        
+        with col2:
+            if st.button("📝", help="New Chat", use_container_width=True):
+                save_chat_history()
+                start_new_chat()
+                rerun()
+        
+        with col3:
+            if st.button("📚", help="Chat History", use_container_width=True):
+                st.session_state.show_history = not st.session_state.show_history
+                st.session_state.show_settings = False
+                rerun()
+        
+        st.markdown("---")
+        
+        # Settings Panel
+        if st.session_state.show_settings:
+            st.markdown("### ⚙️ Settings")
+            
+            # Dark mode toggle
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.markdown("**🌙 Dark Mode**")
+            with col2:
+                if st.button("🔄", key="dark_mode_toggle"):
+                    st.session_state.dark_mode = not st.session_state.dark_mode
+                    rerun()
+            
+            st.markdown("---")
+            
+            # AI Personality
             st.markdown("**💭 AI Personality**")
             st.session_state.system_prompt = st.text_area(
-                "Customize AI behavior",
+                "Customize",
                 value=st.session_state.system_prompt,
                 height=100,
-                key="main_system_prompt"
+                label_visibility="collapsed"
             )
             
-            st.markdown("**🚀 Response Mode**")
+            # Mode Selection
+            st.markdown("**🚀 Mode**")
             st.session_state.selected_model = st.selectbox(
-                "Select mode",
-                options=list(MODELS.keys()),
-                key="main_model_select"
+                "Mode",
+                options=mode_options,
+                index=mode_options.index(st.session_state.selected_model),
+                format_func=MODEL_CATALOG.mode_label,
+                label_visibility="collapsed"
             )
-        
-        with col2:
-            st.markdown("**🎨 Creativity Level**")
+            
+            # Creativity Level
+            st.markdown("**🎨 Creativity**")
             st.session_state.temperature = st.slider(
-                "Adjust creativity",
+                "Creativity",
                 0.0, 1.5,
                 st.session_state.temperature,
                 0.1,
-                key="main_temp_slider"
+                label_visibility="collapsed"
+            )
+        
+        # Chat History Panel
+        elif st.session_state.show_history:
+            st.markdown("### 📚 Chat History")
+            
+            query = st.text_input(
+                "Search chats",
+                key="history_search",
+                placeholder="🔍 Search chats",
+                label_visibility="collapsed"
             )
             
-            if st.session_state.temperature < 0.5:
-                st.caption("🎯 Focused & Precise")
-            elif st.session_state.temperature < 1.0:
-                st.caption("⚖️ Balanced")
+            # Ranked search results, or everything newest first
+            chat_history = search_chats(query) if query else list(reversed(load_all_chats()))
+            
+            if chat_history:
+                for chat in chat_history:
+                    col1, col2 = st.columns([4, 1])
+                    
+                    with col1:
+                        if st.button(
+                            f"💬 {chat['title'][:30]}...",
+                            key=f"load_{chat['id']}",
+                            help=chat['timestamp'],
+                            use_container_width=True
+                        ):
+                            load_chat(chat['id'])
+                    
+                    with col2:
+                        if st.button("🗑️", key=f"del_{chat['id']}", help="Delete"):
+                            delete_chat(chat['id'])
+            elif query:
+                st.info("No chats match your search")
             else:
-                st.caption("🎨 Creative & Diverse")
-
-# Show history panel in main area if toggled
-if st.session_state.show_history:
-    with st.expander("📚 Chat History", expanded=True):
-        chat_history = load_all_chats()
+                st.info("No chat history yet")
         
-        if chat_history:
-            st.markdown("**Recent Conversations:**")
-            
-            # Show in columns for better layout
-            for i, chat in enumerate(reversed(chat_history)):
-                col1, col2 = st.columns([5, 1])
-                
-                with col1:
-                    if st.button(
-                        f"💬 {chat['title'][:40]}..." if len(chat['title']) > 40 else f"💬 {chat['title']}",
-                        key=f"main_load_{chat['id']}",
-                        help=f"Created: {chat['timestamp']}",
-                        use_container_width=True
-                    ):
-                        load_chat(chat['id'])
-                
-                with col2:
-                    if st.button("🗑️", key=f"main_del_{chat['id']}", help="Delete"):
-                        delete_chat(chat['id'])
-                
-                if i < len(chat_history) - 1:
-                    st.markdown("---")
+        # Default view - Quick actions
         else:
-            st.info("No chat history yet. Start a conversation and click 'New Chat' to save it!")
+            st.markdown("### 🚀 Quick Actions")
+            st.info("Use the buttons above to:\n\n⚙️ Open Settings\n\n📝 Start New Chat\n\n📚 View History")
+        
+        st.markdown("---")
+        
+        # Clear current chat
+        if st.button("🗑️ Clear Current Chat", use_container_width=True):
+            start_new_chat()
+            rerun()
 
-st.markdown("---")
+    # ============================================================================
+    # MAIN CHAT AREA
+    # ============================================================================
 
-# Check setup
-if not GEMINI_AVAILABLE or not GEMINI_API_KEY or len(GEMINI_API_KEY) < 20:
-    st.error("⚠️ Please configure your API key in .env file")
-    st.stop()
+    # Header with quick actions
+    header_col1, header_col2, header_col3, header_col4 = st.columns([1, 1, 1, 1])
 
-# Display chat messages
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.write(message["content"])
+    with header_col1:
+        if st.button("⚙️ Settings", use_container_width=True, key="main_settings"):
+            st.session_state.show_settings = not st.session_state.show_settings
+            st.session_state.show_history = False
 
-# Chat input
-if prompt := st.chat_input("💬 Type your message here..."):
-    # Add user message
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    
-    with st.chat_message("user"):
-        st.write(prompt)
-    
-    # Generate AI response
-    with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            model_name = MODELS[st.session_state.selected_model]
-            response = generate_response(
-                st.session_state.messages,
-                st.session_state.system_prompt,
-                model_name,
-                st.session_state.temperature
+    with header_col2:
+        if st.button("📝 New Chat", use_container_width=True, key="main_new_chat"):
+            save_chat_history()
+            start_new_chat()
+            rerun()
+
+    with header_col3:
+        if st.button("📚 History", use_container_width=True, key="main_history"):
+            st.session_state.show_history = not st.session_state.show_history
+            st.session_state.show_settings = False
+
+    with header_col4:
+        if st.button("🌓 Theme", use_container_width=True, key="main_dark_mode"):
+            st.session_state.dark_mode = not st.session_state.dark_mode
+            rerun()
+
+    # Show settings panel in main area if toggled
+    if st.session_state.show_settings:
+        with st.expander("⚙️ Settings", expanded=True):
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                st.markdown("**💭 AI Personality**")
+                st.session_state.system_prompt = st.text_area(
+                    "Customize AI behavior",
+                    value=st.session_state.system_prompt,
+                    height=100,
+                    key="main_system_prompt"
+                )
+                
+                st.markdown("**🚀 Response Mode**")
+                st.session_state.selected_model = st.selectbox(
+                    "Select mode",
+                    options=mode_options,
+                    index=mode_options.index(st.session_state.selected_model),
+                    format_func=MODEL_CATALOG.mode_label,
+                    key="main_model_select"
+                )
+            
+            with col2:
+                st.markdown("**🎨 Creativity Level**")
+                st.session_state.temperature = st.slider(
+                    "Adjust creativity",
+                    0.0, 1.5,
+                    st.session_state.temperature,
+                    0.1,
+                    key="main_temp_slider"
+                )
+                
+                if st.session_state.temperature < 0.5:
+                    st.caption("🎯 Focused & Precise")
+                elif st.session_state.temperature < 1.0:
+                    st.caption("⚖️ Balanced")
+                else:
+                    st.caption("🎨 Creative & Diverse")
+                
+                window = st.session_state.messages
+                on_disk = f", {window.spilled_count} older messages on disk" if window.spilled_count else ""
+                st.caption(f"🧠 Session memory: {window.memory_bytes() / 1024:.0f} KB{on_disk}")
+            
+            st.markdown("**📊 Response Metrics**")
+            show_response_metrics()
+            show_key_usage()
+            
+            if memory.MEMORY_DEBUG:
+                st.markdown("**🧪 Memory**")
+                show_memory_debug()
+
+    # Show history panel in main area if toggled
+    if st.session_state.show_history:
+        with st.expander("📚 Chat History", expanded=True):
+            query = st.text_input(
+                "Search chats",
+                key="main_history_search",
+                placeholder="🔍 Search by title or message"
             )
-            st.write(response)
-    
-    # Add assistant message
-    st.session_state.messages.append({"role": "assistant", "content": response})
-    st.rerun()
+            
+            # Ranked search results, or everything newest first
+            chat_history = search_chats(query) if query else list(reversed(load_all_chats()))
+            
+            if chat_history:
+                st.markdown("**Search Results:**" if query else "**Recent Conversations:**")
+                
+                # Show in columns for better layout
+                for i, chat in enumerate(chat_history):
+                    col1, col2 = st.columns([5, 1])
+                    
+                    with col1:
+                        if st.button(
+                            f"💬 {chat['title'][:40]}..." if len(chat['title']) > 40 else f"💬 {chat['title']}",
+                            key=f"main_load_{chat['id']}",
+                            help=f"Created: {chat['timestamp']}",
+                            use_container_width=True
+                        ):
+                            load_chat(chat['id'])
+                    
+                    with col2:
+                        if st.button("🗑️", key=f"main_del_{chat['id']}", help="Delete"):
+                            delete_chat(chat['id'])
+                    
+                    if i < len(chat_history) - 1:
+                        st.markdown("---")
+            elif query:
+                st.info("No chats match your search.")
+            else:
+                st.info("No chat history yet. Start a conversation and it will be saved automatically!")
 
-# Welcome screen
-if len(st.session_state.messages) == 0:
-    # Determine colors based on dark mode
-    if st.session_state.dark_mode:
-        card_bg = "#1a1a1a"
-        card_border = "#333333"
-        title_color = "#ffffff"
-        text_color = "#b0b0b0"
-    else:
-        card_bg = "#f9fafb"
-        card_border = "#e5e7eb"
-        title_color = "#000000"
-        text_color = "#6b7280"
-    
-    # Title and subtitle
-    st.markdown(f"<h1 style='color: {title_color};'>Welcome to TextIQ 👋</h1>", unsafe_allow_html=True)
-    st.markdown(f"<p style='text-align: center; font-size: 1.1rem; color: {text_color}; margin-bottom: 0.5rem;'>Your intelligent AI assistant ready to help with anything you need.</p>", unsafe_allow_html=True)
-    st.markdown(f"<p style='text-align: center; font-size: 0.95rem; color: {text_color}; margin-bottom: 1rem;'>💡 <strong>Tip:</strong> Use the buttons at the top - <strong>⚙️ Settings</strong>, <strong>📝 New Chat</strong>, <strong>📚 History</strong>, and <strong>🌓 Theme</strong></p>", unsafe_allow_html=True)
-    st.markdown(f"<p style='text-align: center; font-size: 1rem; color: {text_color}; margin-bottom: 3rem;'>Start a conversation by typing a message below.</p>", unsafe_allow_html=True)
-    
-    # Feature cards using columns
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        st.markdown(f"""
-        <div style='text-align: center; padding: 2rem 1rem; background: {card_bg}; border: 2px solid {card_border}; border-radius: 16px;'>
-            <div style='font-size: 2.5rem; margin-bottom: 1rem;'>⚡</div>
-            <div style='font-weight: 700; color: {title_color}; margin-bottom: 0.5rem; font-size: 1.1rem;'>Lightning Fast</div>
-            <div style='font-size: 0.95rem; color: {text_color};'>Get instant responses</div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown(f"""
-        <div style='text-align: center; padding: 2rem 1rem; background: {card_bg}; border: 2px solid {card_border}; border-radius: 16px;'>
-            <div style='font-size: 2.5rem; margin-bottom: 1rem;'>🎯</div>
-            <div style='font-weight: 700; color: {title_color}; margin-bottom: 0.5rem; font-size: 1.1rem;'>Accurate</div>
-            <div style='font-size: 0.95rem; color: {text_color};'>Precise information</div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col3:
-        st.markdown(f"""
-        <div style='text-align: center; padding: 2rem 1rem; background: {card_bg}; border: 2px solid {card_border}; border-radius: 16px;'>
-            <div style='font-size: 2.5rem; margin-bottom: 1rem;'>🎨</div>
-            <div style='font-weight: 700; color: {title_color}; margin-bottom: 0.5rem; font-size: 1.1rem;'>Creative</div>
-            <div style='font-size: 0.95rem; color: {text_color};'>Innovative solutions</div>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col4:
-        st.markdown(f"""
-        <div style='text-align: center; padding: 2rem 1rem; background: {card_bg}; border: 2px solid {card_border}; border-radius: 16px;'>
-            <div style='font-size: 2.5rem; margin-bottom: 1rem;'>🔒</div>
-            <div style='font-weight: 700; color: {title_color}; margin-bottom: 0.5rem; font-size: 1.1rem;'>Secure</div>
-            <div style='font-size: 0.95rem; color: {text_color};'>Your data is safe</div>
-        </div>
-        """, unsafe_allow_html=True)
+    st.markdown("---")
+
+    # Save settings changed on this rerun before anything can stop the script
+    persist_session()
+
+    # Check setup
+    if not core.get_backend().ready():
+        st.error("⚠️ Please configure your API key in .env file")
+        st.stop()
+
+    # Surface background save failures
+    if history_store.last_error():
+        st.error(f"Failed to save chat: {history_store.last_error()}")
+
+    # Display chat messages; spilled ones are only read back from disk on request
+    messages = st.session_state.messages
+    first_shown = 0 if st.session_state.show_earlier else messages.spilled_count
+    if first_shown:
+        if st.button(f"⬆️ Show {first_shown} earlier messages", key="show_earlier_messages"):
+            st.session_state.show_earlier = True
+            rerun()
+    render_span = tracing.start_span("render_messages", shown=len(messages) - first_shown)
+    for message in messages[first_shown:]:
+        with st.chat_message(message["role"]):
+            st.write(message["content"])
+    render_span.end()
+
+    # Chat input
+    if prompt := st.chat_input("💬 Type your message here..."):
+        turn_span = tracing.start_span("chat_turn", mode=st.session_state.selected_model)
+        
+        # Add user message
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        
+        with st.chat_message("user"):
+            st.write(prompt)
+        
+        # Generate AI response
+        with st.chat_message("assistant"):
+            with st.spinner("Thinking..."):
+                model_name = MODELS[st.session_state.selected_model]
+                turn = metrics.Turn(model_name, submitted=RUN_STARTED)
+                with profiling.profile("turn", requested=st.query_params.get("profile"),
+                                       session=st.session_state.get("session_id") or st.session_state.chat_id,
+                                       turn=(len(st.session_state.messages) + 1) // 2):
+                    response = generate_response(
+                        st.session_state.messages,
+                        st.session_state.system_prompt,
+                        model_name,
+                        st.session_state.temperature,
+                        turn
+                    )
+                st.write(response)
+        
+        # Add assistant message (with its timing and token usage) and autosave the turn
+        st.session_state.messages.append({"role": "assistant", "content": response, "metrics": turn.as_dict()})
+        save_chat_history()
+        persist_session()
+        turn_span.end()
+        rerun()
+
+    # Welcome screen
+    if len(st.session_state.messages) == 0:
+        # Determine colors based on dark mode
+        if st.session_state.dark_mode:
+            card_bg = "#1a1a1a"
+            card_border = "#333333"
+            title_color = "#ffffff"
+            text_color = "#b0b0b0"
+        else:
+            card_bg = "#f9fafb"
+            card_border = "#e5e7eb"
+            title_color = "#000000"
+            text_color = "#6b7280"
+        
+        # Title and subtitle
+        st.markdown(f"<h1 style='color: {title_color};'>Welcome to TextIQ 👋</h1>", unsafe_allow_html=True)
+        st.markdown(f"<p style='text-align: center; font-size: 1.1rem; color: {text_color}; margin-bottom: 0.5rem;'>Your intelligent AI assistant ready to help with anything you need.</p>", unsafe_allow_html=True)
+        st.markdown(f"<p style='text-align: center; font-size: 0.95rem; color: {text_color}; margin-bottom: 1rem;'>💡 <strong>Tip:</strong> Use the buttons at the top - <strong>⚙️ Settings</strong>, <strong>📝 New Chat</strong>, <strong>📚 History</strong>, and <strong>🌓 Theme</strong></p>", unsafe_allow_html=True)
+        st.markdown(f"<p style='text-align: center; font-size: 1rem; color: {text_color}; margin-bottom: 3rem;'>Start a conversation by typing a message below.</p>", unsafe_allow_html=True)
+        
+        # Feature cards using columns
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            st.markdown(f"""
+            <div style='text-align: center; padding: 2rem 1rem; background: {card_bg}; border: 2px solid {card_border}; border-radius: 16px;'>
+                <div style='font-size: 2.5rem; margin-bottom: 1rem;'>⚡</div>
+                <div style='font-weight: 700; color: {title_color}; margin-bottom: 0.5rem; font-size: 1.1rem;'>Lightning Fast</div>
+                <div style='font-size: 0.95rem; color: {text_color};'>Get instant responses</div>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col2:
+            st.markdown(f"""
+            <div style='text-align: center; padding: 2rem 1rem; background: {card_bg}; border: 2px solid {card_border}; border-radius: 16px;'>
+                <div style='font-size: 2.5rem; margin-bottom: 1rem;'>🎯</div>
+                <div style='font-weight: 700; color: {title_color}; margin-bottom: 0.5rem; font-size: 1.1rem;'>Accurate</div>
+                <div style='font-size: 0.95rem; color: {text_color};'>Precise information</div>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col3:
+            st.markdown(f"""
+            <div style='text-align: center; padding: 2rem 1rem; background: {card_bg}; border: 2px solid {card_border}; border-radius: 16px;'>
+                <div style='font-size: 2.5rem; margin-bottom: 1rem;'>🎨</div>
+                <div style='font-weight: 700; color: {title_color}; margin-bottom: 0.5rem; font-size: 1.1rem;'>Creative</div>
+                <div style='font-size: 0.95rem; color: {text_color};'>Innovative solutions</div>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col4:
+            st.markdown(f"""
+            <div style='text-align: center; padding: 2rem 1rem; background: {card_bg}; border: 2px solid {card_border}; border-radius: 16px;'>
+                <div style='font-size: 2.5rem; margin-bottom: 1rem;'>🔒</div>
+                <div style='font-weight: 700; color: {title_color}; margin-bottom: 0.5rem; font-size: 1.1rem;'>Secure</div>
+                <div style='font-size: 0.95rem; color: {text_color};'>Your data is safe</div>
+            </div>
+            """, unsafe_allow_html=True)
+
+except Exception as e:
+    RUN_SPAN.record_exception(e)
+    raise
+finally:
+    finish_run()
@@ -0,0 +1,819 @@
+"""
+Benchmark Module for TextIQ
+Offline performance checks - no API key or network needed
+"""
+
+import gc
+import os
+import time
+import random
+import tempfile
+import itertools
+from typing import List, Dict
+
+import history_store
+import serialization
+
+# ============================================================================
+# SYNTHETIC DATA
+# ============================================================================
+
+VOCABULARY = (
+    "the of and to a in is that for it as with was on be by this are or from "
+    "python function error data model file code value list string use can you "
+    "will how what which return example create class request response api "
+    "history chat message user assistant system prompt streamlit session state "
+    "performance memory cache query index test result output input config key"
+).split()
+
+CODE_SNIPPET = """```python
+def process(items):
+    results = []
+    for item in items:
+        if item.is_valid():
+            results.append(item.transform())
+    return results
+```"""
+
+def make_sentence(rng: random.Random, words: int) -> str:
+    """Zipf-ish sentence from the benchmark vocabulary"""
+    picked = [VOCABULARY[min(int(rng.paretovariate(1.2)) - 1, len(VOCABULARY) - 1)] for _ in range(words)]
+    return " ".join(picked).capitalize() + "."
+
+def make_history(chats: int, turns: int = 6, seed: int = 42) -> List[Dict]:
+    """Realistic-looking chat history in the app's format"""
+    rng = random.Random(seed)
+    history = []
+    for n in range(chats):
+        messages = []
+        for _ in range(turns):
+            question = " ".join(make_sentence(rng, rng.randint(6, 20)) for _ in range(rng.randint(1, 3)))
+            answer = "\n\n".join(make_sentence(rng, rng.randint(10, 30)) for _ in range(rng.randint(2, 6)))
+            if rng.random() < 0.3:
+                answer += "\n\n" + CODE_SNIPPET
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        history.append({
+            "id": f"{n:032x}",
+            "timestamp": "2026-01-01 12:00:00",
+            "updated": "2026-01-01 12:05:00",
+            "title": messages[0]["content"][:50] + "...",
+            "messages": messages
+        })
+    return history
+
+def scale_history(base: List[Dict], chats: int) -> List[Dict]:
+    """Many distinct chats from a smaller generated set (cheaper than generating them all)"""
+    history = []
+    for n in range(chats):
+        chat = base[n % len(base)]
+        history.append(dict(chat, id=f"{n:032x}", messages=[
+            {"role": message["role"], "content": f"[{n}] {message['content']}"}
+            for message in chat["messages"]
+        ]))
+    return history
+
+def best_of(func, repeat: int = 5) -> float:
+    """Fastest of several runs, in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+def median_of(func, repeat: int = 11) -> float:
+    """Median of several runs, in milliseconds (steadier than the fastest for baseline checks)
+
+    Like timeit, the garbage collector is paused while timing: when a
+    collection happens to land depends on everything allocated before,
+    which made the same code vary by over 50% from one process to the next.
+    """
+    timings = []
+    enabled = gc.isenabled()
+    try:
+        for _ in range(repeat):
+            gc.collect()
+            gc.disable()
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+            if enabled:
+                gc.enable()
+    finally:
+        if enabled:
+            gc.enable()
+    return sorted(timings)[len(timings) // 2]
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+# Timings (ms, lower is better) written by --json and compared by --baseline
+METRICS: Dict[str, float] = {}
+
+# Default allowed slowdown against a baseline before a metric counts as a regression
+REGRESSION_THRESHOLD = 0.25
+
+# Differences smaller than this are timer noise, whatever the ratio
+NOISE_FLOOR_MS = 0.25
+
+# Sub-millisecond timings swing more in relative terms (a cache miss, a GC
+# pause), so below SMALL_METRIC_MS a metric must slow by SMALL_METRIC_THRESHOLD
+SMALL_METRIC_MS = 1.0
+SMALL_METRIC_THRESHOLD = 0.5
+
+def record(name: str, ms: float):
+    """Keep a timing for the JSON report and baseline comparison"""
+    METRICS[name] = round(ms, 4)
+
+def compare_to_baseline(baseline: Dict[str, float], threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """Print current vs baseline timings; returns the metrics that regressed"""
+    shared = [name for name in METRICS if name in baseline]
+    regressions = []
+    print(f"\nBaseline comparison ({len(shared)} metrics, threshold +{threshold:.0%})...")
+    print(f"   {'metric':44} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name in shared:
+        old, new = baseline[name], METRICS[name]
+        change = (new - old) / old if old else 0.0
+        allowed = max(threshold, SMALL_METRIC_THRESHOLD) if old < SMALL_METRIC_MS else threshold
+        regressed = change > allowed and new - old > NOISE_FLOOR_MS
+        if regressed:
+            regressions.append(name)
+        print(f"   {name[:44]:44} {old:>7.2f} ms {new:>7.2f} ms {change:>+7.0%}{'  ❌' if regressed else ''}")
+    missing = [name for name in baseline if name not in METRICS]
+    if missing:
+        print(f"   ({len(missing)} baseline metrics not measured in this run)")
+    return regressions
+
+# ============================================================================
+# BENCHMARKS
+# ============================================================================
+
+def bench_compression(chats: int = 2000, turns: int = 6):
+    """Compare history file size and load time per compression method"""
+    print(f"\nHistory compression ({chats} chats x {turns} turns)...")
+
+    history = make_history(chats, turns)
+    methods = ["none", "zlib"] + (["zstd"] if history_store.ZSTD_AVAILABLE else [])
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for method in methods:
+            path = os.path.join(tmp, f"history_{method}.json")
+            history_store.write_history_file(path, history, compression=method)
+            load_ms = best_of(lambda: history_store.read_history_file(path, strict=True))
+            results[method] = (os.path.getsize(path), load_ms)
+
+    base_size, base_load = results["none"]
+    print(f"   {'method':8} {'size':>12} {'ratio':>7} {'load':>10} {'vs none':>8}")
+    for method, (size, load_ms) in results.items():
+        print(f"   {method:8} {size / 1024:>9.0f} KB {base_size / size:>6.2f}x "
+              f"{load_ms:>7.1f} ms {load_ms / base_load:>7.2f}x")
+
+    if not history_store.ZSTD_AVAILABLE:
+        print("   (zstd skipped: pip install zstandard)")
+    return results
+
+def bench_codecs(chats: int = 2000, turns: int = 6):
+    """Compare encode/decode throughput of the installed codecs"""
+    print(f"\nSerialization codecs ({chats} chats x {turns} turns)...")
+
+    history = make_history(chats, turns)
+    results = {}
+    for name, codec in serialization.CODECS.items():
+        encoded = [codec.dumps(chat) for chat in history]
+        size = sum(len(data) for data in encoded)
+        encode_ms = best_of(lambda: [codec.dumps(chat) for chat in history])
+        decode_ms = best_of(lambda: [codec.loads(data) for data in encoded])
+        results[name] = (size, encode_ms, decode_ms)
+
+    print(f"   {'codec':8} {'size':>10} {'encode':>12} {'decode':>12}")
+    for name, (size, encode_ms, decode_ms) in results.items():
+        mb = size / 1024 / 1024
+        print(f"   {name:8} {size / 1024:>7.0f} KB {mb / encode_ms * 1000:>7.0f} MB/s "
+              f"{mb / decode_ms * 1000:>7.0f} MB/s")
+
+    missing = [name for name in serialization.CODEC_PREFERENCE if name not in results]
+    if missing:
+        print(f"   (not installed: {', '.join(missing)})")
+    print(f"   Default codec: {serialization.get_codec().name}")
+    return results
+
+def bench_dedup(chats: int = 1000, documents: int = 10, paste_rate: float = 0.4):
+    """Blob store savings when users paste the same documents and re-save chats"""
+    print(f"\nMessage deduplication ({chats} chats, {documents} shared documents)...")
+
+    rng = random.Random(7)
+    docs = ["\n".join(make_sentence(rng, 25) for _ in range(rng.randint(40, 120))) for _ in range(documents)]
+    history = make_history(chats, turns=3)
+    for chat in history:
+        if rng.random() < paste_rate:
+            chat["messages"].insert(1, {"role": "user", "content": rng.choice(docs)})
+    # Loaded-and-saved-again copies of some chats
+    history += [dict(chat, id=chat["id"] + "-copy") for chat in history[:chats // 10]]
+
+    results = {}
+    threshold = history_store.BLOB_MIN_BYTES
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, min_bytes in (("inline", 10 ** 12), ("blob store", threshold)):
+            path = os.path.join(tmp, f"history_{label.replace(' ', '_')}.json")
+            history_store.BLOB_MIN_BYTES = min_bytes
+            try:
+                write_ms = best_of(lambda: history_store.write_history_file(path, history), repeat=3)
+                load_ms = best_of(lambda: history_store.read_history_file(path, strict=True), repeat=3)
+            finally:
+                history_store.BLOB_MIN_BYTES = threshold
+            blob_bytes = sum(
+                os.path.getsize(os.path.join(root, name))
+                for root, _, files in os.walk(history_store.blob_dir(path)) for name in files
+            )
+            results[label] = (os.path.getsize(path) + blob_bytes, write_ms, load_ms)
+        stats = history_store.dedup_stats(os.path.join(tmp, "history_blob_store.json"))
+
+    print(f"   {'layout':11} {'on disk':>10} {'write':>10} {'load':>10}")
+    for label, (size, write_ms, load_ms) in results.items():
+        print(f"   {label:11} {size / 1024:>7.0f} KB {write_ms:>7.1f} ms {load_ms:>7.1f} ms")
+    print(f"   Dedup ratio: {stats['dedup_ratio']:.2f}x over {stats['references']} references "
+          f"to {stats['blobs']} blobs")
+    print(f"   Bytes saved: {stats['bytes_saved'] / 1024:.0f} KB")
+    return stats
+
+def bench_shards(big_user_chats: int = 5000, commits: int = 20):
+    """Commit latency for a light user next to a heavy one, shared file vs shards"""
+    print(f"\nPer-user shards (heavy user with {big_user_chats} chats)...")
+
+    heavy = make_history(big_user_chats, turns=2)
+    light = make_history(10, turns=2, seed=7)
+    for chat in light:
+        chat["id"] = "light-" + chat["id"]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        history_file = os.path.join(tmp, "chat_history.json")
+        layouts = {
+            "shared file": (history_file, history_file),
+            "shards": (history_store.shard_path(history_file, "uid:heavy"),
+                       history_store.shard_path(history_file, "uid:light")),
+        }
+        for label, (heavy_path, light_path) in layouts.items():
+            history_store.write_history_file(heavy_path, heavy)
+            if light_path != heavy_path:
+                history_store.write_history_file(light_path, light)
+            else:
+                history_store.write_history_file(light_path, heavy + light)
+
+            timings = []
+            for n in range(commits):
+                chat = dict(light[n % len(light)])
+                messages = chat.pop("messages")
+                start = time.perf_counter()
+                history_store.upsert_chat(light_path, chat, len(messages), [{"role": "user", "content": f"More {n}"}])
+                history_store.flush()
+                timings.append((time.perf_counter() - start) * 1000)
+            results[label] = sorted(timings)[len(timings) // 2]
+
+    for label, median_ms in results.items():
+        print(f"   {label:12} {median_ms:>7.1f} ms per light-user commit (median)")
+    return results
+
+def bench_window(sessions: int = 100, turns: int = 400):
+    """Python heap held by many long sessions: plain lists vs bounded windows"""
+    import tracemalloc
+    from message_window import MessageWindow
+
+    print(f"\nSession memory ({sessions} sessions x {turns} turns)...")
+    results = {}
+    for label, make in (("list", list), ("window", MessageWindow)):
+        tracemalloc.start()
+        history = make_history(sessions, turns)
+        start = time.perf_counter()
+        held = [make(chat["messages"]) for chat in history]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        del history
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[label] = (current, elapsed_ms)
+        del held
+
+    print(f"   {'layout':8} {'memory':>10} {'per session':>12} {'build':>10}")
+    for label, (current, elapsed_ms) in results.items():
+        print(f"   {label:8} {current / 1024 / 1024:>7.1f} MB {current / sessions / 1024:>9.0f} KB "
+              f"{elapsed_ms:>7.0f} ms")
+    print(f"   Window budget: {MessageWindow().max_bytes // 1024} KB per session (TEXTIQ_SESSION_MEMORY_KB)")
+    return results
+
+def bench_api(clients: int = 8, requests: int = 500, latency_ms: float = 0):
+    """HTTP API throughput against the mock backend, keep-alive vs new connections"""
+    import json
+    import threading
+    import http.client
+    import core
+    import api_server
+
+    print(f"\nHTTP API ({clients} clients x {requests} requests, mock backend)...")
+    body = json.dumps({"messages": [{"role": "user", "content": "How do I read a file in Python?"}]})
+    headers = {"Content-Type": "application/json"}
+    if api_server.API_TOKEN:
+        headers["Authorization"] = f"Bearer {api_server.API_TOKEN}"
+
+    previous = core.get_backend()
+    core.set_backend(core.MockBackend(latency_ms=latency_ms, token_delay_ms=0))
+    server = api_server.create_server("127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+
+    def client(keep_alive: bool, timings: List[float]):
+        conn = http.client.HTTPConnection(host, port)
+        for _ in range(requests):
+            start = time.perf_counter()
+            conn.request("POST", "/v1/chat/completions", body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            timings.append((time.perf_counter() - start) * 1000)
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            if not keep_alive:
+                conn.close()
+        conn.close()
+
+    results = {}
+    try:
+        for label, keep_alive in (("keep-alive", True), ("new conn", False)):
+            timings: List[float] = []
+            threads = [threading.Thread(target=client, args=(keep_alive, timings)) for _ in range(clients)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            timings.sort()
+            results[label] = (
+                len(timings) / elapsed,
+                timings[len(timings) // 2],
+                timings[min(int(len(timings) * 0.99), len(timings) - 1)],
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+        core.set_backend(previous)
+
+    print(f"   {'connections':12} {'req/s':>8} {'p50':>10} {'p99':>10}")
+    for label, (rate, p50, p99) in results.items():
+        print(f"   {label:12} {rate:>8.0f} {p50:>7.2f} ms {p99:>7.2f} ms")
+        record(f"api/{label}/p50", p50)
+        record(f"api/{label}/p99", p99)
+    return results
+
+def bench_replay(turns: int = 20):
+    """End-to-end turn latency replayed from a cassette (TEXTIQ_CASSETTE, else a synthetic one)"""
+    import core
+    import cassettes
+
+    path = cassettes.CASSETTE_FILE
+    with tempfile.TemporaryDirectory() as tmp:
+        if not os.path.exists(path):
+            # Gemini-like pacing: 300 ms to the first chunk, 40 ms between chunks
+            path = os.path.join(tmp, "cassette.json")
+            recorder = cassettes.RecordingBackend(core.MockBackend(latency_ms=300, token_delay_ms=40), path)
+            rng = random.Random(42)
+            for turn in range(turns):
+                messages = [{"role": "user", "content": make_sentence(rng, 12)}]
+                "".join(recorder.stream(messages, core.DEFAULT_SYSTEM_PROMPT, core.MODELS[core.DEFAULT_MODE],
+                                        core.DEFAULT_TEMPERATURE))
+        cassette = cassettes.Cassette(path)
+        print(f"\nReplayed turns ({len(cassette)} from {os.path.basename(path)}, original timing)...")
+
+        previous = core.get_backend()
+        core.set_backend(cassettes.ReplayBackend(path, time_scale=1.0))
+        first_chunk, total, overhead = [], [], []
+        try:
+            for interaction in cassette.interactions:
+                if "error" in interaction or not interaction["chunks"]:
+                    continue
+                request = interaction["request"]
+                start = time.perf_counter()
+                chunks = core.stream_response(**request)
+                next(chunks)
+                first_chunk.append((time.perf_counter() - start) * 1000)
+                for _ in chunks:
+                    pass
+                total.append((time.perf_counter() - start) * 1000)
+                overhead.append(total[-1] - sum(chunk["delay_ms"] for chunk in interaction["chunks"]))
+        finally:
+            core.set_backend(previous)
+
+    if not total:
+        print("   No successful replies in the cassette")
+        return None
+    results = {
+        "first chunk": sorted(first_chunk)[len(first_chunk) // 2],
+        "turn": sorted(total)[len(total) // 2],
+        "overhead": sorted(overhead)[len(overhead) // 2],
+    }
+    for label, median_ms in results.items():
+        print(f"   {label:12} {median_ms:>8.1f} ms (median)")
+        record(f"replay/{label}", median_ms)
+    return results
+
+def bench_sessions(ramp=(1, 5, 10), turns: int = 3, latency_ms: float = 100):
+    """Streamlit app rerun latency as concurrent sessions ramp up (see load_test.py)"""
+    try:
+        import streamlit  # noqa: F401
+    except ImportError:
+        print("\nConcurrent sessions: skipped (streamlit not installed)")
+        return None
+    import load_test
+
+    print(f"\nConcurrent app sessions ({turns} messages each, mock latency {latency_ms:.0f} ms)...")
+    print(f"   {load_test.HEADER}")
+    results = load_test.run_ramp(ramp, turns, latency_ms, report=lambda row: print(f"   {row}"))
+    for result in results:
+        record(f"sessions/{result['sessions']}/p50", result["run_p50_ms"])
+        record(f"sessions/{result['sessions']}/p95", result["run_p95_ms"])
+        for error in result["errors"][:3]:
+            print(f"   ❌ {error}")
+    return results
+
+# History sizes (chats) for the hot path suite
+HOTPATH_SIZES = (100, 10000, 100000)
+
+def bench_hotpaths(sizes=None):
+    """The app's per-request hot paths at several history sizes"""
+    import core
+    import theme
+    from message_window import MessageWindow
+
+    sizes = sizes or HOTPATH_SIZES
+    print(f"\nHot paths (history sizes: {', '.join(f'{size:,}' for size in sizes)} chats, median of runs)...")
+    base = make_history(min(max(sizes), 1000), turns=2)
+    new_turn = [{"role": "user", "content": "One more question?"},
+                {"role": "assistant", "content": "One more answer."}]
+    print(f"   {'operation':30} " + " ".join(f"{size:>11,}" for size in sizes))
+
+    rows: Dict[str, List[float]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            history = scale_history(base, size)
+            path = os.path.join(tmp, f"history_{size}.json")
+            history_store.write_history_file(path, history)
+            repeat = 11 if size <= 10000 else 3
+            timings = {}
+
+            # Each app function is timed as the history store calls it makes
+            counter = iter(range(10 ** 9))
+
+            def save_new_chat():
+                chat_id = f"new-{next(counter)}"
+                history_store.upsert_chat(path, {"id": chat_id, "timestamp": "2026-01-01 12:00:00",
+                                                 "updated": "2026-01-01 12:00:00", "title": "New..."}, 0, new_turn)
+                history_store.flush()
+
+            def save_next_turn():
+                chat = history[next(counter) % len(history)]
+                entry = {key: chat[key] for key in ("id", "timestamp", "title")}
+                entry["updated"] = "2026-01-02 12:00:00"
+                history_store.upsert_chat(path, entry, len(chat["messages"]), new_turn)
+                history_store.flush()
+
+            def load_chat():
+                wanted = history[len(history) // 2]["id"]
+                return next(chat for chat in history_store.load_chats(path) if chat["id"] == wanted)
+
+            def delete_chat():
+                history_store.delete_chat(path, history[next(counter) % len(history)]["id"])
+                history_store.flush()
+
+            timings["save_chat_history (new chat)"] = median_of(save_new_chat, repeat)
+            timings["save_chat_history (next turn)"] = median_of(save_next_turn, repeat)
+            timings["load_all_chats"] = median_of(lambda: history_store.load_chats(path), repeat)
+            timings["load_chat"] = median_of(load_chat, repeat)
+            timings["delete_chat"] = median_of(delete_chat, repeat)
+
+            # History building inside generate_response(), for a conversation
+            # of this many messages (in memory, and in a window that spilled)
+            messages = [message for chat in history for message in chat["messages"]][:size]
+            # Runs rotate over a few windows: how fast one reads back its
+            # spilled messages varies from window to window
+            windows = [MessageWindow(messages) for _ in range(3)]
+            rotation = itertools.cycle(windows)
+            timings["build_history"] = median_of(lambda: core.build_history(messages, core.DEFAULT_SYSTEM_PROMPT), repeat)
+            timings["build_history (message window)"] = median_of(
+                lambda: core.build_history(next(rotation), core.DEFAULT_SYSTEM_PROMPT), repeat)
+            del windows, rotation
+
+            for operation, ms in timings.items():
+                rows.setdefault(operation, []).append(ms)
+                record(f"hotpaths/{operation}/{size}", ms)
+            os.remove(path)
+
+    # Page CSS does not depend on history size
+    rows["load_custom_css (build)"] = [median_of(lambda: theme.build_css.__wrapped__(True), 21)]
+    rows["load_custom_css (cached)"] = [median_of(lambda: theme.build_css(True), 21)]
+    record("hotpaths/load_custom_css (build)", rows["load_custom_css (build)"][0])
+
+    for operation, timings in rows.items():
+        print(f"   {operation:30} " + " ".join(f"{ms:>8.3f} ms" for ms in timings))
+    return rows
+
+def bench_search(chats: int = 100000):
+    """Search index build, load, queries and commit latency while a compaction runs"""
+    import search_index
+
+    print(f"\nSearch index ({chats:,} chats)...")
+    history = scale_history(make_history(1000, turns=2), chats)
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        history_file = os.path.join(tmp, "chat_history.json")
+        index = search_index.SearchIndex(history_file)
+        start = time.perf_counter()
+        index.rebuild(history)
+        timings["rebuild"] = (time.perf_counter() - start) * 1000
+        snapshot_mb = os.path.getsize(index.snapshot_file) / 1024 / 1024
+        del history
+        gc.collect()
+
+        start = time.perf_counter()
+        follower = search_index.SearchIndex(history_file)
+        follower.load()
+        timings["load"] = (time.perf_counter() - start) * 1000
+
+        queries = {"rare term": str(chats // 2), "term in every chat": "the",
+                   "two terms": "python memory", "prefix": "perf"}
+        for label, query in queries.items():
+            timings[f"query ({label})"] = median_of(lambda: index.search(query), 5)
+
+        # Enough commits to trigger a compaction; none may wait for the snapshot write
+        commits = []
+        for n in range(search_index.COMPACT_AFTER + 50):
+            start = time.perf_counter()
+            index.add_chat({"id": f"new-{n}", "title": "Benchmark commit",
+                            "messages": [{"role": "user", "content": f"commit {n}"}]})
+            commits.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        index.wait_compacted()
+        compaction_left = (time.perf_counter() - start) * 1000
+        commits.sort()
+        timings["commit (p50)"] = commits[len(commits) // 2]
+        timings["commit (max)"] = commits[-1]
+
+        start = time.perf_counter()
+        follower.refresh()
+        timings["refresh after compaction"] = (time.perf_counter() - start) * 1000
+
+        # What each commit used to wait for once per COMPACT_AFTER commits
+        start = time.perf_counter()
+        index.save()
+        timings["snapshot write (blocking)"] = (time.perf_counter() - start) * 1000
+
+    print(f"   snapshot {snapshot_mb:,.0f} MB; compaction finished {compaction_left:,.0f} ms after the last commit")
+    for label, ms in timings.items():
+        print(f"   {label:28} {ms:>10.2f} ms")
+        record(f"search/{label}/{chats}", ms)
+    return timings
+
+# Time-to-prompt budget for `textiq chat`
+CHAT_STARTUP_BUDGET_MS = 250
+
+def bench_startup(runs: int = 5):
+    """Time until `textiq chat` shows its prompt, vs importing the Gemini SDK up front"""
+    import sys
+    import subprocess
+
+    print(f"\nTerminal chat startup (median of {runs} runs)...")
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def time_to_prompt(history_file: str) -> float:
+        command = [sys.executable, os.path.join(here, "textiq.py"), "-q", "--history", history_file,
+                   "chat", "--backend", "mock", "--no-save"]
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=here)
+        seen = b""
+        while not seen.endswith(b"You: "):
+            byte = process.stdout.read(1)
+            if not byte:
+                raise RuntimeError("textiq chat exited before showing a prompt")
+            seen += byte
+        elapsed = (time.perf_counter() - start) * 1000
+        process.communicate(b"/exit\n")
+        return elapsed
+
+    def time_command(code: str) -> float:
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=here)
+        return (time.perf_counter() - start) * 1000
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        history_file = os.path.join(tmp, "chat_history.json")
+        results["textiq chat"] = sorted(time_to_prompt(history_file) for _ in range(runs))[runs // 2]
+    results["python only"] = sorted(time_command("pass") for _ in range(runs))[runs // 2]
+    import core
+    if core.GEMINI_AVAILABLE:
+        results["gemini sdk import"] = sorted(
+            time_command("import google.generativeai") for _ in range(runs))[runs // 2]
+
+    for label, median_ms in results.items():
+        print(f"   {label:18} {median_ms:>7.0f} ms")
+    record("startup/time to prompt", results["textiq chat"])
+    status = "within" if results["textiq chat"] <= CHAT_STARTUP_BUDGET_MS else "OVER"
+    print(f"   Time to prompt is {status} the {CHAT_STARTUP_BUDGET_MS} ms budget")
+    return results
+
+# Heavy modules that must not load until they are needed
+DEFERRED_IMPORTS = ("google.generativeai", "grpc", "redis")
+
+def app_imports() -> List[str]:
+    """Top-level modules app.py imports (the script itself can't be imported)"""
+    import ast
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names.append(node.module)
+    return list(dict.fromkeys(names))
+
+def parse_importtime(report: str) -> List[tuple]:
+    """(module, self ms, cumulative ms, depth) rows from python -X importtime output"""
+    rows = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2  # One space, then two per level
+        rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000, depth))
+    return rows
+
+def bench_imports(runs: int = 3, top: int = 8):
+    """Import time of the app's modules, from python -X importtime"""
+    import sys
+    import json
+    import subprocess
+
+    print(f"\nApp startup imports (best of {runs} runs)...")
+    here = os.path.dirname(os.path.abspath(__file__))
+    modules = app_imports()
+
+    # Measure with cached bytecode, as a deployed app starts (the first run writes it)
+    env = {key: value for key, value in os.environ.items() if key != "PYTHONDONTWRITEBYTECODE"}
+    best = None
+    for _ in range(runs + 1):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+                                capture_output=True, text=True, cwd=here, env=env, check=True)
+        rows = parse_importtime(result.stderr)
+        total = sum(cumulative for name, _, cumulative, depth in rows if depth == 0)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+
+    wanted = set(modules)
+    direct = {name: cumulative for name, _, cumulative, depth in rows if depth == 0 and name in wanted}
+    print(f"   {'module':22} {'import':>10}")
+    for name in modules:
+        if name in direct:
+            print(f"   {name:22} {direct[name]:>7.1f} ms")
+        else:
+            print(f"   {name:22} {'-':>7}    (loaded by an earlier import)")
+    print(f"   {'total':22} {total:>7.1f} ms (including Python's own startup imports)")
+    record("imports/total", total)
+
+    print(f"   Slowest modules by self time:")
+    for name, self_ms, _, _ in sorted(rows, key=lambda row: -row[1])[:top]:
+        print(f"     {name[:48]:48} {self_ms:>6.1f} ms")
+
+    loaded = {name for name, _, _, _ in rows}
+    eager = [name for name in DEFERRED_IMPORTS if name in loaded]
+    if eager:
+        print(f"   ❌ Imported at startup: {', '.join(eager)}")
+    else:
+        print(f"   Deferred until first use: {', '.join(DEFERRED_IMPORTS)}")
+
+    # First script run (cold module caches) vs a rerun, in a fresh process
+    app_runs = None
+    try:
+        import streamlit.testing.v1  # noqa: F401
+    except ImportError:
+        print("   (app run timing skipped: streamlit not installed)")
+    else:
+        code = (
+            "import json, time\n"
+            "from streamlit.testing.v1 import AppTest\n"
+            f"at = AppTest.from_file({os.path.join(here, 'app.py')!r}, default_timeout=60)\n"
+            "timings = []\n"
+            "for _ in range(3):\n"
+            "    start = time.perf_counter()\n"
+            "    at.run()\n"
+            "    timings.append((time.perf_counter() - start) * 1000)\n"
+            "    if at.exception:\n"
+            "        raise SystemExit(at.exception[0].message)\n"
+            "print(json.dumps(timings))\n"
+        )
+        env.update(TEXTIQ_LLM_BACKEND="mock", TEXTIQ_SESSION_STORE="memory",
+                   PYTHONPATH=here + os.pathsep + os.environ.get("PYTHONPATH", ""))
+        with tempfile.TemporaryDirectory() as tmp:
+            result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                    cwd=tmp, env=env)
+        if result.returncode == 0:
+            app_runs = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"   App first run {app_runs[0]:.0f} ms, rerun {min(app_runs[1:]):.0f} ms")
+            record("imports/app first run", app_runs[0])
+            record("imports/app rerun", min(app_runs[1:]))
+        else:
+            print(f"   (app run timing failed: {result.stderr.strip().splitlines()[-1:]})")
+
+    return {"total_ms": total, "modules": direct, "eager": eager, "app_runs": app_runs}
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+BENCHMARKS = {
+    "compression": bench_compression,
+    "codecs": bench_codecs,
+    "dedup": bench_dedup,
+    "hotpaths": bench_hotpaths,
+    "search": bench_search,
+    "shards": bench_shards,
+    "window": bench_window,
+    "api": bench_api,
+    "replay": bench_replay,
+    "sessions": bench_sessions,
+    "startup": bench_startup,
+    "imports": bench_imports,
+}
+
+if __name__ == "__main__":
+    import sys
+    import json
+    import argparse
+    import platform
+    import contextlib
+
+    parser = argparse.ArgumentParser(description="TextIQ offline benchmarks")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--json", metavar="FILE", help="write timings as JSON (- for stdout)")
+    parser.add_argument("--baseline", metavar="FILE", help="compare against a previous --json file; "
+                        "exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="allowed slowdown vs the baseline (default: %(default)s = +25%%)")
+    parser.add_argument("--sizes", help="history sizes for hotpaths, comma separated "
+                        f"(default: {','.join(map(str, HOTPATH_SIZES))})")
+    args = parser.parse_args()
+
+    names = args.names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmark: {', '.join(unknown)}")
+        print(f"Available: {', '.join(BENCHMARKS)}")
+        sys.exit(1)
+    if args.sizes:
+        HOTPATH_SIZES = tuple(int(size) for size in args.sizes.split(","))
+
+    # With --json - stdout carries only the report; progress goes to stderr
+    report_out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr if args.json == "-" else sys.stdout):
+        print("=" * 60)
+        print("TEXTIQ - BENCHMARKS")
+        print("=" * 60)
+        for name in names:
+            BENCHMARKS[name]()
+
+        regressions = []
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)["metrics"]
+            regressions = compare_to_baseline(baseline, args.threshold)
+            if regressions:
+                # A slowdown has to show up twice: re-run and keep each metric's
+                # better median, so one noisy pass can't fail the gate on its own
+                print("\nRe-running to confirm...")
+                first = dict(METRICS)
+                for name in names:
+                    BENCHMARKS[name]()
+                for metric, ms in first.items():
+                    METRICS[metric] = min(ms, METRICS.get(metric, ms))
+                regressions = compare_to_baseline(baseline, args.threshold)
+            if regressions:
+                print(f"\n❌ {len(regressions)} regression(s) over +{args.threshold:.0%}")
+            else:
+                print("\n✅ No regressions")
+        print("=" * 60)
+
+    if args.json:
+        report = json.dumps({
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "codec": serialization.get_codec().name,
+            "benchmarks": names,
+            "metrics": METRICS,
+        }, indent=2)
+        if args.json == "-":
+            report_out.write(report + "\n")
+        else:
+            with open(args.json, "w", encoding="utf-8") as f:
+                f.write(report + "\n")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,211 @@
+"""
+TextIQ - Response Cassettes
+Records real model responses with their chunk timing and replays them offline
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from typing import List, Dict, Iterator, Optional
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Cassette used by the "record" and "replay" backends
+CASSETTE_FILE = os.getenv("TEXTIQ_CASSETTE", "textiq_cassette.json")
+
+# Replay delays are the recorded ones times this (0 = no delays, 2 = twice as slow)
+TIME_SCALE = float(os.getenv("TEXTIQ_CASSETTE_TIME_SCALE", "1"))
+
+CASSETTE_VERSION = 1
+
+# ============================================================================
+# CASSETTE FILES
+# ============================================================================
+
+class CassetteError(Exception):
+    """No recording for a request, or an unreadable cassette"""
+
+
+class RecordedError(Exception):
+    """A failure the model returned while recording, raised again on replay"""
+
+
+def request_key(messages: List[Dict], system_prompt: str, model_name: str, temperature: float) -> str:
+    """Stable id of a request: the same conversation and settings give the same key"""
+    request = {
+        "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+        "system_prompt": system_prompt,
+        "model": model_name,
+        "temperature": round(float(temperature), 3),
+    }
+    data = json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:32]
+
+class Cassette:
+    """Recorded interactions in one JSON file, looked up by request key"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.interactions: List[Dict] = []
+        self._replayed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CassetteError(f"can't read cassette {path}: {e}")
+            if data.get("version") != CASSETTE_VERSION:
+                raise CassetteError(f"cassette {path} has unsupported version {data.get('version')}")
+            self.interactions = data["interactions"]
+
+    def __len__(self):
+        return len(self.interactions)
+
+    def add(self, interaction: Dict):
+        """Append an interaction and rewrite the file"""
+        with self._lock:
+            self.interactions.append(interaction)
+            data = json.dumps({"version": CASSETTE_VERSION, "interactions": self.interactions},
+                              indent=1, ensure_ascii=False)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(data + "\n")
+            os.replace(temp_path, self.path)
+
+    def next_for(self, key: str) -> Dict:
+        """Next recording of a request; repeated requests cycle through their recordings"""
+        with self._lock:
+            matches = [interaction for interaction in self.interactions if interaction["key"] == key]
+            if not matches:
+                raise CassetteError(f"no recording for this request in {self.path} "
+                                    "(record it with TEXTIQ_LLM_BACKEND=record)")
+            count = self._replayed.get(key, 0)
+            self._replayed[key] = count + 1
+            return matches[count % len(matches)]
+
+# ============================================================================
+# BACKENDS
+# ============================================================================
+
+class RecordingBackend:
+    """Passes requests to another backend and records each reply with its timing"""
+    name = "record"
+
+    def __init__(self, inner, path: str = CASSETTE_FILE):
+        self.inner = inner
+        self.cassette = Cassette(path)
+
+    def ready(self) -> bool:
+        return self.inner.ready()
+
+    def setup_error(self) -> Optional[str]:
+        return self.inner.setup_error()
+
+    def list_models(self) -> List[str]:
+        return self.inner.list_models()
+
+    def _record(self, chunks: Iterator[str], request: Dict, streamed: bool, usage: Dict) -> Iterator[str]:
+        recorded, error = [], None
+        last = time.perf_counter()
+        try:
+            for text in chunks:
+                now = time.perf_counter()
+                recorded.append({"delay_ms": round((now - last) * 1000, 2), "text": text})
+                yield text
+                last = time.perf_counter()  # Time the consumer spent is not the model's
+        except GeneratorExit:
+            return  # Abandoned part way; a partial reply would replay as a complete one
+        except Exception as e:
+            error = {"delay_ms": round((time.perf_counter() - last) * 1000, 2), "message": str(e)}
+            self.cassette.add(self._interaction(request, streamed, recorded, usage, error))
+            raise
+        self.cassette.add(self._interaction(request, streamed, recorded, usage, error))
+
+    def _interaction(self, request: Dict, streamed: bool, chunks: List[Dict], usage: Dict,
+                     error: Optional[Dict]) -> Dict:
+        interaction = {
+            "key": request_key(**request),
+            "request": {
+                "messages": [{"role": m["role"], "content": m["content"]} for m in request["messages"]],
+                "system_prompt": request["system_prompt"],
+                "model_name": request["model_name"],
+                "temperature": request["temperature"],
+            },
+            "recorded": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "backend": self.inner.name,
+            "streamed": streamed,
+            "chunks": chunks,
+        }
+        if usage:
+            interaction["usage"] = dict(usage)
+        if error:
+            interaction["error"] = error
+        return interaction
+
+    def stream(self, messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+               usage: Optional[Dict] = None) -> Iterator[str]:
+        request = dict(messages=messages, system_prompt=system_prompt, model_name=model_name, temperature=temperature)
+        usage = {} if usage is None else usage
+        yield from self._record(self.inner.stream(**request, usage=usage), request, True, usage)
+
+    def generate(self, messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+                 usage: Optional[Dict] = None) -> str:
+        request = dict(messages=messages, system_prompt=system_prompt, model_name=model_name, temperature=temperature)
+        usage = {} if usage is None else usage
+
+        def whole_reply():
+            yield self.inner.generate(**request, usage=usage)
+
+        return "".join(self._record(whole_reply(), request, False, usage))
+
+
+class ReplayBackend:
+    """Serves recorded replies with their original chunk timing, scaled"""
+    name = "replay"
+
+    def __init__(self, path: str = CASSETTE_FILE, time_scale: float = TIME_SCALE):
+        self.path = path
+        self.time_scale = time_scale
+        self._cassette: Optional[Cassette] = None
+        self._lock = threading.Lock()
+
+    @property
+    def cassette(self) -> Cassette:
+        with self._lock:
+            if self._cassette is None:
+                self._cassette = Cassette(self.path)
+            return self._cassette
+
+    def ready(self) -> bool:
+        return os.path.exists(self.path)
+
+    def setup_error(self) -> Optional[str]:
+        if not os.path.exists(self.path):
+            return f"❌ Cassette not found: {self.path}"
+        return None
+
+    def _wait(self, delay_ms: float):
+        if delay_ms and self.time_scale:
+            time.sleep(delay_ms * self.time_scale / 1000)
+
+    def stream(self, messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+               usage: Optional[Dict] = None) -> Iterator[str]:
+        interaction = self.cassette.next_for(request_key(messages, system_prompt, model_name, temperature))
+        for chunk in interaction["chunks"]:
+            self._wait(chunk["delay_ms"])
+            yield chunk["text"]
+        if usage is not None:
+            usage.update(interaction.get("usage", {}))
+        if "error" in interaction:
+            self._wait(interaction["error"]["delay_ms"])
+            raise RecordedError(interaction["error"]["message"])
+
+    def generate(self, messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+                 usage: Optional[Dict] = None) -> str:
+        return "".join(self.stream(messages, system_prompt, model_name, temperature, usage))
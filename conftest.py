@@ -0,0 +1,15 @@
+"""
+pytest glue for testing.py
+Its test functions print their checks and return True/False for the
+built-in runner; a False return fails the test under pytest too
+"""
+
+import pytest
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    args = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    if pyfuncitem.obj(**args) is False:
+        pytest.fail(f"{pyfuncitem.name} reported a failure (see its output above)", pytrace=False)
+    return True
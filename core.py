@@ -0,0 +1,386 @@
+"""
+TextIQ - Core
+Models, settings and the response pipeline shared by the app, API server and CLI
+"""
+
+import os
+import time
+import threading
+import importlib.util
+from typing import List, Dict, Iterator, Optional, Sequence
+from dotenv import load_dotenv
+
+import metrics
+import tracing
+import key_pool
+
+# Google Gemini: only check it is installed here. The SDK pulls in gRPC and
+# protobuf (about a second), so it is imported by the first request instead.
+try:
+    GEMINI_AVAILABLE = importlib.util.find_spec("google.generativeai") is not None
+except ImportError:
+    GEMINI_AVAILABLE = False
+
+genai = None
+_genai_lock = threading.Lock()
+
+def load_sdk():
+    """The google.generativeai module, imported on first use"""
+    global genai
+    if genai is None:
+        with _genai_lock:
+            if genai is None:
+                import google.generativeai as sdk
+                genai = sdk
+    return genai
+
+# Load environment variables
+load_dotenv()
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+
+# More keys to spread requests over (comma separated); see key_pool.py
+GEMINI_API_KEYS = key_pool.parse_keys(os.getenv("GEMINI_API_KEYS", ""))
+
+# AI Models (internal use only)
+MODELS = {
+    "Fast Mode": "gemini-2.5-flash",
+    "Powerful Mode": "gemini-2.5-pro",
+    "Balanced Mode": "gemini-1.5-flash"
+}
+
+DEFAULT_MODE = "Fast Mode"
+
+DEFAULT_SYSTEM_PROMPT = """You are TextIQ, an intelligent AI assistant. You provide clear, 
+accurate, and helpful responses. You are professional, friendly, and always aim to assist users 
+in the best way possible."""
+
+DEFAULT_TEMPERATURE = 0.7
+
+MAX_OUTPUT_TOKENS = 2048
+
+# Chat history file (each user gets their own shard of it with
+# TEXTIQ_HISTORY_SHARDING=user)
+CHAT_HISTORY_FILE = "chat_history.json"
+
+# Response backend: "gemini", "mock" (offline, for tests and load tests),
+# "record" (Gemini, saving every reply to a cassette) or "replay" (the cassette)
+BACKEND_NAMES = ("gemini", "mock", "record", "replay")
+LLM_BACKEND = os.getenv("TEXTIQ_LLM_BACKEND", "gemini").lower()
+
+# Mock backend timing: delay before the first token and between tokens
+MOCK_LATENCY_MS = float(os.getenv("TEXTIQ_MOCK_LATENCY_MS", "0"))
+MOCK_TOKEN_DELAY_MS = float(os.getenv("TEXTIQ_MOCK_TOKEN_DELAY_MS", "0"))
+
+# ============================================================================
+# REQUEST BUILDING
+# ============================================================================
+
+@tracing.traced()
+def build_history(messages: List[Dict], system_prompt: str) -> List[Dict]:
+    """Gemini chat history: system prompt exchange plus every message but the last"""
+    history = []
+
+    # Add system prompt as first exchange
+    if system_prompt:
+        history.append({
+            "role": "user",
+            "parts": [system_prompt]
+        })
+        history.append({
+            "role": "model",
+            "parts": ["Understood. I'll follow these instructions."]
+        })
+
+    # Add conversation history
+    for msg in messages[:-1]:
+        history.append({
+            "role": "user" if msg["role"] == "user" else "model",
+            "parts": [msg["content"]]
+        })
+
+    return history
+
+# ============================================================================
+# BACKENDS
+# ============================================================================
+
+class GeminiBackend:
+    """Google Gemini via google-generativeai, over a pool of API keys"""
+    name = "gemini"
+
+    def __init__(self, api_key: str = "", api_keys: Sequence[str] = ()):
+        self.pool = key_pool.KeyPool(key_pool.merge_keys(api_key, api_keys))
+        self._clients: Dict[str, object] = {}
+        self._clients_lock = threading.Lock()
+
+    @property
+    def api_key(self) -> str:
+        """The first key of the pool"""
+        keys = self.pool.keys
+        return keys[0] if keys else ""
+
+    @api_key.setter
+    def api_key(self, api_key: str):
+        self.pool.set_keys(key_pool.merge_keys(api_key, self.pool.keys[1:]))
+
+    def ready(self) -> bool:
+        return GEMINI_AVAILABLE and any(len(key) >= 20 for key in self.pool.keys)
+
+    def setup_error(self) -> Optional[str]:
+        if not GEMINI_AVAILABLE:
+            return "❌ Please install: pip install google-generativeai"
+        if not self.pool.keys:
+            return "❌ API key not configured"
+        return None
+
+    def _client(self, api_key: str):
+        """One client per key; genai.configure() would switch the key for every thread"""
+        with self._clients_lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                from google.ai import generativelanguage
+                client = generativelanguage.GenerativeServiceClient(client_options={"api_key": api_key})
+                self._clients[api_key] = client
+            return client
+
+    def _start_chat(self, api_key: str, messages: List[Dict], system_prompt: str, model_name: str,
+                    temperature: float):
+        genai = load_sdk()
+
+        model = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config={
+                "temperature": temperature,
+                "max_output_tokens": MAX_OUTPUT_TOKENS,
+            }
+        )
+        model._client = self._client(api_key)
+
+        return model.start_chat(history=build_history(messages, system_prompt))
+
+    @staticmethod
+    def _read_usage(response, usage: Optional[Dict]):
+        """Token counts from the response's usage metadata"""
+        meta = getattr(response, "usage_metadata", None)
+        if usage is not None and meta:
+            usage["input_tokens"] = meta.prompt_token_count
+            usage["output_tokens"] = meta.candidates_token_count
+
+    def generate(self, messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+                 usage: Optional[Dict] = None) -> str:
+        def request(api_key: str) -> str:
+            chat = self._start_chat(api_key, messages, system_prompt, model_name, temperature)
+            response = chat.send_message(messages[-1]["content"])
+            self._read_usage(response, usage)
+            return response.text
+
+        return self.pool.call(request, usage)
+
+    def stream(self, messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+               usage: Optional[Dict] = None) -> Iterator[str]:
+        def request(api_key: str) -> Iterator[str]:
+            chat = self._start_chat(api_key, messages, system_prompt, model_name, temperature)
+            response = chat.send_message(messages[-1]["content"], stream=True)
+            for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+            # Complete once every chunk has arrived
+            self._read_usage(response, usage)
+
+        yield from self.pool.stream(request, usage)
+
+    def list_models(self) -> List[str]:
+        """Ids of the models the first key can generate text with"""
+        genai = load_sdk()
+        genai.configure(api_key=self.api_key)
+        return [model.name.replace("models/", "") for model in genai.list_models()
+                if "generateContent" in model.supported_generation_methods]
+
+
+class MockBackend:
+    """Offline backend with configurable latency; replies echo the prompt"""
+    name = "mock"
+
+    def __init__(self, latency_ms: float = MOCK_LATENCY_MS, token_delay_ms: float = MOCK_TOKEN_DELAY_MS):
+        self.latency_ms = latency_ms
+        self.token_delay_ms = token_delay_ms
+
+    def ready(self) -> bool:
+        return True
+
+    def setup_error(self) -> Optional[str]:
+        return None
+
+    def reply(self, messages: List[Dict], model_name: str) -> str:
+        prompt = messages[-1]["content"] if messages else ""
+        return f"Mock reply from {model_name} to: {prompt[:200]}"
+
+    def stream(self, messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+               usage: Optional[Dict] = None) -> Iterator[str]:
+        time.sleep(self.latency_ms / 1000)
+        words = self.reply(messages, model_name).split(" ")
+        for n, word in enumerate(words):
+            if n and self.token_delay_ms:
+                time.sleep(self.token_delay_ms / 1000)
+            yield word if n == 0 else " " + word
+        if usage is not None:
+            # One token per word, as a rough stand-in for the model's tokenizer
+            usage["input_tokens"] = len(system_prompt.split()) + sum(len(m["content"].split()) for m in messages)
+            usage["output_tokens"] = len(words)
+
+    def generate(self, messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+                 usage: Optional[Dict] = None) -> str:
+        return "".join(self.stream(messages, system_prompt, model_name, temperature, usage))
+
+    def list_models(self) -> List[str]:
+        return list(MODELS.values())
+
+# ============================================================================
+# PROCESS-WIDE BACKEND
+# ============================================================================
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def create_backend(name: Optional[str] = None, api_key: Optional[str] = None):
+    """Backend by name (one of BACKEND_NAMES)"""
+    name = (name or LLM_BACKEND).lower()
+    if name == "mock":
+        return MockBackend()
+    if name == "gemini":
+        if api_key is None:
+            return GeminiBackend(GEMINI_API_KEY, GEMINI_API_KEYS)
+        return GeminiBackend(api_key)
+    if name in ("record", "replay"):
+        import cassettes
+        if name == "replay":
+            return cassettes.ReplayBackend()
+        return cassettes.RecordingBackend(create_backend("gemini", api_key))
+    raise ValueError(f"Unknown backend '{name}' (use {', '.join(BACKEND_NAMES)})")
+
+def get_backend():
+    """Backend shared by every session in this process"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+def set_backend(backend):
+    """Replace the shared backend (e.g. with a MockBackend in tests)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+def configure(api_key: str, api_keys: Sequence[str] = ()):
+    """Use these API keys (e.g. from Streamlit secrets) for the Gemini backend"""
+    backend = get_backend()
+    backend = getattr(backend, "inner", backend)  # A recorder wraps the real backend
+    if isinstance(backend, GeminiBackend):
+        backend.pool.set_keys(key_pool.merge_keys(api_key, api_keys))
+
+def key_stats() -> List[Dict]:
+    """Usage per API key of the shared backend (empty if it has no key pool)"""
+    backend = get_backend()
+    pool = getattr(getattr(backend, "inner", backend), "pool", None)
+    return pool.stats() if pool is not None else []
+
+# ============================================================================
+# RESPONSE GENERATOR
+# ============================================================================
+
+def resolve_model(mode: Optional[str] = None) -> str:
+    """Model id for a mode name (model ids pass through)"""
+    mode = mode or DEFAULT_MODE
+    if mode in MODELS:
+        return MODELS[mode]
+    if mode in MODELS.values():
+        return mode
+    raise ValueError(f"Unknown mode '{mode}' (use one of: {', '.join(MODELS)})")
+
+def error_message(error: Exception) -> str:
+    """User-facing text for a failed generation"""
+    error_msg = str(error).lower()
+
+    if "quota" in error_msg or "429" in error_msg or "limit" in error_msg:
+        return "⏳ Usage limit reached. Please wait a moment or get a new API key."
+    else:
+        return f"❌ Error: {str(error)[:100]}"
+
+def _trace_usage(span, turn: metrics.Turn):
+    if span is tracing.NOOP_SPAN:
+        return
+    stats = turn.as_dict()
+    for key in ("ttft_ms", "input_tokens", "output_tokens"):
+        if stats[key] is not None:
+            span.set_attribute(f"textiq.{key}", stats[key])
+
+def generate_reply(messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+                   turn: Optional[metrics.Turn] = None) -> str:
+    """Reply from the shared backend, timed into turn and the metrics registry; raises on failure"""
+    turn = turn or metrics.Turn(model_name)
+    backend = get_backend()
+    with tracing.span("model.generate", model=model_name, backend=backend.name) as span:
+        turn.start()
+        try:
+            reply = backend.generate(messages, system_prompt, model_name, temperature, usage=turn.usage)
+        except Exception as e:
+            turn.finish(e)
+            raise
+        turn.chunk()
+        turn.finish()
+        _trace_usage(span, turn)
+    return reply
+
+def stream_reply(messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+                 turn: Optional[metrics.Turn] = None) -> Iterator[str]:
+    """generate_reply() as text chunks"""
+    turn = turn or metrics.Turn(model_name)
+    backend = get_backend()
+    with tracing.span("model.stream", model=model_name, backend=backend.name) as span:
+        turn.start()
+        try:
+            for text in backend.stream(messages, system_prompt, model_name, temperature, usage=turn.usage):
+                turn.chunk()
+                yield text
+        except GeneratorExit:
+            turn.error = "cancelled"
+            turn.finish()
+            raise
+        except Exception as e:
+            turn.finish(e)
+            raise
+        turn.finish()
+        _trace_usage(span, turn)
+
+def generate_response(messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+                      turn: Optional[metrics.Turn] = None) -> str:
+    """Generate AI response"""
+    backend = get_backend()
+    problem = backend.setup_error()
+    if problem:
+        return problem
+
+    try:
+        return generate_reply(messages, system_prompt, model_name, temperature, turn)
+    except Exception as e:
+        return error_message(e)
+
+def stream_response(messages: List[Dict], system_prompt: str, model_name: str, temperature: float,
+                    turn: Optional[metrics.Turn] = None) -> Iterator[str]:
+    """Generate AI response as text chunks"""
+    backend = get_backend()
+    problem = backend.setup_error()
+    if problem:
+        yield problem
+        return
+
+    try:
+        yield from stream_reply(messages, system_prompt, model_name, temperature, turn)
+    except Exception as e:
+        yield error_message(e)
@@ -0,0 +1,89 @@
+"""
+TextIQ - Metrics Exporter
+Serves the process's metrics to Prometheus from a background thread on a side port
+"""
+
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Set, Tuple
+
+import metrics
+import message_window
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Port for GET /metrics; 0 (the default) leaves the exporter off
+METRICS_PORT = int(os.getenv("TEXTIQ_METRICS_PORT", "0"))
+
+# Interface to listen on (0.0.0.0 to let a remote Prometheus scrape it)
+METRICS_HOST = os.getenv("TEXTIQ_METRICS_HOST", "127.0.0.1")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Sessions are counted by their live message windows (one per browser session)
+ACTIVE_SESSIONS = metrics.Gauge("textiq_active_sessions", "Sessions holding messages in this process",
+                                lambda: message_window.stats()["sessions"])
+SESSION_MEMORY_BYTES = metrics.Gauge("textiq_session_memory_bytes", "Memory held by the sessions' in-memory messages",
+                                     lambda: message_window.stats()["memory_bytes"])
+SPILLED_MESSAGES = metrics.Gauge("textiq_spilled_messages", "Session messages spilled to disk by the message window",
+                                 lambda: message_window.stats()["messages_spilled"])
+
+# ============================================================================
+# SERVER
+# ============================================================================
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics in the Prometheus text format"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        data = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+_server: Optional[MetricsServer] = None
+_start_lock = threading.Lock()
+_failed: Set[Tuple[str, int]] = set()  # Addresses we could not bind; not retried on every rerun
+
+def start(port: Optional[int] = None, host: str = METRICS_HOST) -> Optional[MetricsServer]:
+    """Start the exporter once per process (no-op unless a port is configured)"""
+    global _server
+    port = METRICS_PORT if port is None else port
+    with _start_lock:
+        if _server is not None or not port or (host, port) in _failed:
+            return _server
+        try:
+            _server = MetricsServer((host, port), MetricsHandler)
+        except OSError as e:
+            # Another process (e.g. a second replica on this host) has the port
+            _failed.add((host, port))
+            print(f"⚠️ Metrics exporter not started on {host}:{port}: {e}", file=sys.stderr)
+            return None
+        threading.Thread(target=_server.serve_forever, name="textiq-metrics", daemon=True).start()
+        return _server
+
+def stop():
+    """Stop the exporter (used by tests)"""
+    global _server
+    with _start_lock:
+        if _server is not None:
+            _server.shutdown()
+            _server.server_close()
+            _server = None
@@ -0,0 +1,707 @@
+"""
+TextIQ - Chat History Store
+Write-behind persistence with group commits, file locking and atomic replace
+"""
+
+import os
+import time
+import zlib
+import base64
+import atexit
+import hashlib
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List, Dict, Callable, Iterable, Iterator, Optional
+
+import metrics
+import serialization
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# How long the writer waits for more mutations before committing a batch
+GROUP_COMMIT_WINDOW = 0.005
+
+# Back-off before retrying a batch that failed to commit
+RETRY_DELAY = 1.0
+
+# How long the shutdown hook waits for pending writes
+SHUTDOWN_FLUSH_TIMEOUT = 10.0
+
+# Per-chat message compression: "none", "zlib" or "zstd" (falls back to zlib)
+HISTORY_COMPRESSION = os.getenv("TEXTIQ_HISTORY_COMPRESSION", "none").lower()
+
+# Chats whose messages serialize smaller than this are stored uncompressed
+COMPRESS_MIN_BYTES = 512
+
+# Message bodies at least this large are stored once, by hash, in the blob store
+BLOB_MIN_BYTES = int(os.getenv("TEXTIQ_BLOB_MIN_BYTES", "1024"))
+
+# "none" shares one file (the layout of existing installs); "user" gives every
+# user their own history shard, starting empty (see the README to move old chats)
+HISTORY_SHARDING = os.getenv("TEXTIQ_HISTORY_SHARDING", "none").lower()
+
+# Files whose chat ids are remembered for append-only commits
+MAX_KNOWN_FILES = 256
+
+# Format marker written on compressed chat entries
+PAYLOAD_FORMAT = 2
+PAYLOAD_KEYS = ("format", "compression", "codec", "payload")
+
+# ============================================================================
+# PAYLOAD COMPRESSION
+# ============================================================================
+
+def _compress(data: bytes, method: str) -> bytes:
+    if method == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+def _decompress(data: bytes, method: str) -> bytes:
+    if method == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise ValueError("History uses zstd compression: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if method == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown history compression: {method}")
+
+def resolve_compression(method: Optional[str] = None) -> str:
+    """Compression method to write with, given what is installed"""
+    method = (method or HISTORY_COMPRESSION).lower()
+    if method == "zstd" and not ZSTD_AVAILABLE:
+        return "zlib"
+    return method if method in ("zlib", "zstd") else "none"
+
+def encode_chat(chat: Dict, compression: str = "none", codec=None, directory: Optional[str] = None) -> Dict:
+    """Stored form of a chat: large bodies moved to the blob store, messages compressed if enabled"""
+    if directory is not None:
+        messages = externalize_messages(chat["messages"], directory, compression)
+        refs = [message["blob"] for message in messages if "blob" in message]
+        chat = {key: value for key, value in chat.items() if key != "blobs"}
+        chat["messages"] = messages
+        if refs:
+            # Kept outside the compressed payload so commits can count references cheaply
+            chat["blobs"] = refs
+    if compression == "none":
+        return chat
+    codec = codec or serialization.get_codec()
+    raw = codec.dumps(chat["messages"])
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return chat
+    stored = {key: value for key, value in chat.items() if key != "messages"}
+    stored["format"] = PAYLOAD_FORMAT
+    stored["compression"] = compression
+    stored["codec"] = codec.name
+    stored["payload"] = base64.b64encode(_compress(raw, compression)).decode("ascii")
+    return stored
+
+def decode_payload(stored: Dict) -> Dict:
+    """Stored chat with its messages decompressed (blob references kept)"""
+    if "payload" not in stored:
+        return stored
+    chat = {key: value for key, value in stored.items() if key not in PAYLOAD_KEYS}
+    raw = _decompress(base64.b64decode(stored["payload"]), stored["compression"])
+    chat["messages"] = serialization.get_codec(stored.get("codec", "json")).loads(raw)
+    return chat
+
+def decode_chat(stored: Dict, directory: str) -> Dict:
+    """Chat as the app sees it: decompressed, blob references resolved"""
+    chat = decode_payload(stored)
+    return resolve_chat(chat, directory) if "blobs" in chat else chat
+
+def resolve_chat(chat: Dict, directory: str) -> Dict:
+    """Chat with blob references replaced by their contents"""
+    chat = {key: value for key, value in chat.items() if key != "blobs"}
+    chat["messages"] = resolve_messages(chat["messages"], directory)
+    return chat
+
+# ============================================================================
+# CONTENT-ADDRESSED BLOB STORE
+# ============================================================================
+
+BLOB_EXTENSIONS = {"none": "txt", "zlib": "zlib", "zstd": "zst"}
+
+def blob_dir(path: str) -> str:
+    """Blob directory stored next to a history file"""
+    return os.path.splitext(path)[0] + ".blobs"
+
+def content_hash(content: str) -> str:
+    """Blob address for a message body"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def is_blob_content(content) -> bool:
+    """Whether a message body is large enough to live in the blob store"""
+    return isinstance(content, str) and len(content) >= BLOB_MIN_BYTES
+
+def _blob_files(directory: str, digest: str) -> List[str]:
+    folder = os.path.join(directory, digest[:2])
+    return [os.path.join(folder, f"{digest}.{ext}") for ext in BLOB_EXTENSIONS.values()]
+
+def write_blob(directory: str, digest: str, content: str, compression: str = "none"):
+    """Store a blob unless it already exists (blobs are immutable)"""
+    if any(os.path.exists(f) for f in _blob_files(directory, digest)):
+        return
+    data = content.encode("utf-8")
+    if compression != "none":
+        data = _compress(data, compression)
+    target = os.path.join(directory, digest[:2], f"{digest}.{BLOB_EXTENSIONS[compression]}")
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, target)
+
+@lru_cache(maxsize=64)
+def read_blob(directory: str, digest: str) -> str:
+    """Blob contents (cached: a digest always maps to the same bytes)"""
+    for blob_file, method in zip(_blob_files(directory, digest), BLOB_EXTENSIONS):
+        if os.path.exists(blob_file):
+            with open(blob_file, 'rb') as f:
+                data = f.read()
+            if method != "none":
+                data = _decompress(data, method)
+            return data.decode("utf-8")
+    raise ValueError(f"Missing history blob {digest}")
+
+def delete_blob(directory: str, digest: str):
+    """Remove a blob from disk"""
+    for blob_file in _blob_files(directory, digest):
+        try:
+            os.unlink(blob_file)
+        except FileNotFoundError:
+            pass
+
+def externalize_messages(messages: List[Dict], directory: str, compression: str = "none") -> List[Dict]:
+    """Stored messages: large bodies replaced by blob references"""
+    stored = []
+    for message in messages:
+        content = message.get("content")
+        if is_blob_content(content):
+            digest = content_hash(content)
+            write_blob(directory, digest, content, compression)
+            message = {key: value for key, value in message.items() if key != "content"}
+            message["blob"] = digest
+        stored.append(message)
+    return stored
+
+def resolve_messages(messages: List[Dict], directory: str) -> List[Dict]:
+    """Messages with blob references replaced by their contents"""
+    if not any("blob" in message for message in messages):
+        return messages
+    resolved = []
+    for message in messages:
+        if "blob" in message:
+            digest = message["blob"]
+            message = {key: value for key, value in message.items() if key != "blob"}
+            message["content"] = read_blob(directory, digest)
+        resolved.append(message)
+    return resolved
+
+def release_blobs(path: str, before: Counter, after: Counter) -> int:
+    """Delete blobs whose reference count dropped to zero"""
+    directory = blob_dir(path)
+    released = [digest for digest in before if not after.get(digest)]
+    for digest in released:
+        delete_blob(directory, digest)
+    return len(released)
+
+def collect_garbage(path: str) -> int:
+    """Delete unreferenced blobs (e.g. left by a crash mid-commit)"""
+    directory = blob_dir(path)
+    if not os.path.isdir(directory):
+        return 0
+    removed = 0
+    with history_lock(path):
+        live = Counter()
+        for stored in iter_stored_records(path):
+            live.update(stored.get("blobs", []))
+        for folder in os.listdir(directory):
+            for name in os.listdir(os.path.join(directory, folder)):
+                if name.split(".")[0] not in live:
+                    os.unlink(os.path.join(directory, folder, name))
+                    removed += 1
+    return removed
+
+def dedup_stats(path: str) -> Dict:
+    """Dedup ratio and bytes saved by the blob store for a history file"""
+    refs = Counter()
+    for stored in iter_stored_records(path):
+        refs.update(stored.get("blobs", []))
+    directory = blob_dir(path)
+    sizes = {digest: len(read_blob(directory, digest).encode("utf-8")) for digest in refs}
+    logical = sum(sizes[digest] * count for digest, count in refs.items())
+    unique = sum(sizes.values())
+    on_disk = sum(
+        os.path.getsize(blob_file)
+        for digest in refs for blob_file in _blob_files(directory, digest)
+        if os.path.exists(blob_file)
+    )
+    return {
+        "blobs": len(refs),
+        "references": sum(refs.values()),
+        "logical_bytes": logical,
+        "unique_bytes": unique,
+        "disk_bytes": on_disk,
+        "bytes_saved": logical - unique,
+        "dedup_ratio": logical / unique if unique else 1.0,
+    }
+
+# ============================================================================
+# PER-USER SHARDS
+# ============================================================================
+
+def shard_key(user_id: str) -> str:
+    """Filesystem-safe, fixed-length key for a user identity"""
+    return hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32]
+
+def shard_path(history_file: str, user_id: str) -> str:
+    """A user's own history file: <base>.shards/<ab>/<key>/<name>"""
+    # Each shard directory holds that user's lock, index and blobs too,
+    # so nothing a request touches grows with the number of users
+    key = shard_key(user_id)
+    root = os.path.splitext(history_file)[0] + ".shards"
+    return os.path.join(root, key[:2], key, os.path.basename(history_file))
+
+# ============================================================================
+# FILE I/O
+# ============================================================================
+
+def read_history_file(path: str, strict: bool = False) -> List[Dict]:
+    """Read all chats from a history file (strict=True raises instead of returning [])"""
+    try:
+        return list(iter_history_file(path))
+    except Exception:
+        if strict:
+            raise
+    return []
+
+def iter_history_file(path: str) -> Iterator[Dict]:
+    """Stream chats from a history file one record at a time"""
+    directory = blob_dir(path)
+    for stored in iter_stored_records(path):
+        yield decode_chat(stored, directory)
+
+def iter_stored_records(path: str) -> Iterator[Dict]:
+    """Stream chat records exactly as stored (compressed, with blob references)"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        yield from serialization.iter_records(f)
+
+def write_history_file(path: str, chats: Iterable[Dict], compression: Optional[str] = None, codec: Optional[str] = None):
+    """Atomically replace a history file with these chats"""
+    compression = resolve_compression(compression)
+    codec = serialization.get_codec(codec)
+    directory = blob_dir(path)
+    write_stored_records(path, (encode_chat(chat, compression, codec, directory) for chat in chats), codec)
+
+def write_stored_records(path: str, records: Iterable[Dict], codec=None):
+    """Atomically replace a history file (write temp, fsync, rename)"""
+    codec = codec or serialization.get_codec()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            serialization.write_records(f, records, codec)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    # Make the rename itself durable
+    if fcntl is not None:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def append_stored_records(path: str, records: List[Dict], codec, offset: int):
+    """Append records after offset, dropping any torn tail left by a crash"""
+    with open(path, 'r+b') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        codec.write_records(f, records)
+        f.flush()
+        os.fsync(f.fileno())
+
+def file_signature(path: str) -> Optional[tuple]:
+    """Identity of a file's current contents, None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+def scan_history_file(path: str) -> Optional[tuple]:
+    """(codec, chat ids, end of last complete record), None for legacy files"""
+    with open(path, 'rb') as f:
+        codec = serialization.read_header(f)
+        if codec is None:
+            return None
+        ids, end = set(), f.tell()
+        for stored, end in codec.iter_with_offsets(f):
+            ids.add(stored.get("id"))
+    return codec, ids, end
+
+@contextmanager
+def file_lock(lock_path: str, blocking: bool = True):
+    """Exclusive advisory lock on a lock file; yields False if non-blocking and busy"""
+    with open(lock_path, 'a+') as lock_file:
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                while True:
+                    try:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise
+                        continue  # LK_LOCK gives up after ~10s; keep waiting
+        except OSError:
+            if blocking:
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def history_lock(path: str):
+    """Exclusive advisory lock shared by every process using this history file"""
+    return file_lock(path + ".lock")
+
+# ============================================================================
+# MUTATIONS
+# ============================================================================
+
+def apply_mutation(chats: Dict[str, Dict], mutation: Dict):
+    """Apply one upsert/delete to chats keyed by id (idempotent)"""
+    if mutation["op"] == "delete":
+        chats.pop(mutation["id"], None)
+        return
+
+    fields = mutation["chat"]
+    chat = chats.get(fields["id"])
+    if chat is None:
+        chat = chats[fields["id"]] = dict(fields, messages=[])
+    else:
+        chat["updated"] = fields.get("updated", chat.get("updated"))
+    # Slice assignment keeps re-applying the same mutation harmless
+    start = mutation["start"]
+    chat["messages"][start:start + len(mutation["messages"])] = mutation["messages"]
+    if mutation.get("truncate"):
+        del chat["messages"][start + len(mutation["messages"]):]
+
+def apply_mutations(chats: List[Dict], mutations: List[Dict]) -> Dict[str, Dict]:
+    """Apply mutations to a chat list, returning chats keyed by id"""
+    by_id = {chat["id"]: chat for chat in chats}
+    for mutation in mutations:
+        apply_mutation(by_id, mutation)
+    return by_id
+
+# Chat ids of history files this process last wrote, so that commits which
+# only add new chats can append instead of rewriting the whole file. Entries
+# are (signature, codec, ids, end offset) and go stale when another writer
+# changes the file.
+_known_files: Dict[str, tuple] = {}
+
+def _remember_file(path: str, entry: tuple):
+    _known_files.pop(path, None)
+    _known_files[path] = entry
+    while len(_known_files) > MAX_KNOWN_FILES:
+        del _known_files[next(iter(_known_files))]
+
+def _append_offset(path: str, codec, pending: Dict[str, List[Dict]]) -> Optional[int]:
+    """Offset to append these chats at, None if the file must be rewritten"""
+    signature = file_signature(path)
+    if signature is None:
+        return None
+    known = _known_files.get(path)
+    if known is None or known[0] != signature:
+        # Scanning only pays off when every chat looks new
+        if any(m["op"] != "upsert" or m["start"] for ms in pending.values() for m in ms):
+            return None
+        scanned = scan_history_file(path)
+        if scanned is None:
+            return None
+        known = (signature,) + scanned
+        _remember_file(path, known)
+    _, file_codec, ids, end = known
+    if file_codec.name != codec.name or not ids.isdisjoint(pending):
+        return None
+    return end
+
+def commit_mutations(path: str, mutations: List[Dict]) -> Dict[str, Dict]:
+    """Apply mutations to a history file in one locked, atomic commit"""
+    # Records stream from the old file to the new one and only the chats
+    # being changed are decoded. Returns those chats (None when deleted).
+    pending: Dict[str, List[Dict]] = {}
+    for mutation in mutations:
+        chat_id = mutation["id"] if mutation["op"] == "delete" else mutation["chat"]["id"]
+        pending.setdefault(chat_id, []).append(mutation)
+
+    path = os.path.abspath(path)
+    compression = resolve_compression()
+    codec = serialization.get_codec()
+    directory = blob_dir(path)
+    changed: Dict[str, Optional[Dict]] = {}
+    before, after = Counter(), Counter()
+    written = set()
+
+    def apply(chat_id: str, stored: Optional[Dict]) -> Optional[Dict]:
+        chats = {chat_id: decode_payload(stored)} if stored is not None else {}
+        for mutation in pending.pop(chat_id):
+            apply_mutation(chats, mutation)
+        chat = chats.get(chat_id)
+        changed[chat_id] = chat
+        return None if chat is None else encode_chat(chat, compression, codec, directory)
+
+    def records() -> Iterator[Dict]:
+        for stored in iter_stored_records(path):
+            before.update(stored.get("blobs", []))
+            if stored.get("id") in pending:
+                stored = apply(stored["id"], stored)
+                if stored is None:
+                    continue
+            after.update(stored.get("blobs", []))
+            written.add(stored.get("id"))
+            yield stored
+        for chat_id in list(pending):
+            stored = apply(chat_id, None)
+            if stored is not None:
+                after.update(stored.get("blobs", []))
+                written.add(chat_id)
+                yield stored
+
+    # Read-modify-write under the cross-process lock; readers never need it
+    # because the file is replaced atomically (or only grows by whole records,
+    # which readers ignore until they are complete). Any read error aborts the
+    # commit, so a file that failed to parse is never overwritten.
+    os.makedirs(os.path.dirname(path), exist_ok=True)  # first write to a new shard
+    with history_lock(path):
+        offset = _append_offset(path, codec, pending)
+        if offset is not None:
+            new_records = [stored for stored in (apply(i, None) for i in list(pending)) if stored]
+            append_stored_records(path, new_records, codec, offset)
+            _, _, ids, _ = _known_files[path]
+            ids.update(stored["id"] for stored in new_records)
+            _remember_file(path, (file_signature(path), codec, ids, os.path.getsize(path)))
+        else:
+            _known_files.pop(path, None)
+            write_stored_records(path, records(), codec)
+            _remember_file(path, (file_signature(path), codec, written, os.path.getsize(path)))
+            # Blobs are only dropped once the file that stopped using them is in place
+            release_blobs(path, before, after)
+
+    return {
+        chat_id: None if chat is None else resolve_chat(chat, directory)
+        for chat_id, chat in changed.items()
+    }
+
+# ============================================================================
+# WRITE-BEHIND WRITER
+# ============================================================================
+
+class HistoryWriter:
+    """Queues history mutations and commits them from a single thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending: List[tuple] = []    # (path, mutation) not yet picked up
+        self._inflight: List[tuple] = []   # (path, mutation) being committed
+        self._listeners: Dict[str, Callable] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._generation = 0
+        self.last_error: Optional[str] = None
+        self.commits = 0
+        self.mutations = 0
+        self.file_sizes: Dict[str, int] = {}  # Size of each file after its last commit
+
+    def submit(self, path: str, mutation: Dict):
+        """Queue a mutation and return immediately"""
+        self.submit_many(path, [mutation])
+
+    def submit_many(self, path: str, mutations: List[Dict]):
+        """Queue mutations so they are picked up by the same commit"""
+        with self._lock:
+            self._pending.extend((path, mutation) for mutation in mutations)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="textiq-history-writer", daemon=True
+                )
+                self._thread.start()
+            self._changed.notify_all()
+
+    def add_listener(self, name: str, listener: Callable):
+        """Call listener(path, mutations, changed_chats) after each commit"""
+        with self._lock:
+            self._listeners[name] = listener
+
+    def read(self, path: str) -> List[Dict]:
+        """Chats on disk with queued mutations applied (read-your-writes)"""
+        start = time.perf_counter()
+        while True:
+            with self._lock:
+                generation = self._generation
+                queued = [m for p, m in self._inflight + self._pending if p == path]
+            chats = read_history_file(path)
+            # Retry if a commit landed between taking the queue and reading
+            with self._lock:
+                if generation == self._generation:
+                    break
+        READ_SECONDS.observe(time.perf_counter() - start)
+        if not queued:
+            return chats
+        return list(apply_mutations(chats, queued).values())
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued mutation is committed"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._pending or self._inflight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._changed.wait()
+            # Give concurrent sessions a moment to join this commit
+            time.sleep(GROUP_COMMIT_WINDOW)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._inflight = batch
+                listeners = list(self._listeners.values())
+
+            failed = []
+            for path in dict.fromkeys(p for p, _ in batch):
+                mutations = [m for p, m in batch if p == path]
+                start = time.perf_counter()
+                try:
+                    chats = commit_mutations(path, mutations)
+                except Exception as e:
+                    self.last_error = str(e)
+                    failed.extend((path, m) for m in mutations)
+                    continue
+                COMMIT_SECONDS.observe(time.perf_counter() - start)
+                try:
+                    self.file_sizes[path] = os.path.getsize(path)
+                except OSError:
+                    self.file_sizes.pop(path, None)
+                self.commits += 1
+                self.mutations += len(mutations)
+                for listener in listeners:
+                    try:
+                        listener(path, mutations, chats)
+                    except Exception:
+                        pass
+
+            with self._lock:
+                # Keep failed mutations queued (and visible to readers) for a retry
+                self._pending[:0] = failed
+                self._inflight = []
+                self._generation += 1
+                if not failed:
+                    self.last_error = None
+                self._changed.notify_all()
+            if failed:
+                time.sleep(RETRY_DELAY)
+
+_writer = HistoryWriter()
+
+READ_SECONDS = metrics.Histogram("textiq_history_read_seconds", "History file reads (load_chats)")
+COMMIT_SECONDS = metrics.Histogram("textiq_history_commit_seconds", "History commits, per file")
+FILE_BYTES = metrics.Gauge("textiq_history_file_bytes", "Total size of the history files written by this process",
+                           lambda: sum(list(_writer.file_sizes.values())))
+
+# ============================================================================
+# PUBLIC API
+# ============================================================================
+
+def upsert_chat(path: str, chat: Dict, start: int, messages: List[Dict], truncate: bool = False):
+    """Queue an upsert: create the chat if needed, write messages from start
+
+    With truncate, stored messages after the written ones are dropped, so the
+    chat ends with exactly these messages.
+    """
+    mutation = {"op": "upsert", "chat": chat, "start": start, "messages": messages}
+    if truncate:
+        mutation["truncate"] = True
+    _writer.submit(path, mutation)
+
+def upsert_chats(path: str, chats: List[Dict]):
+    """Queue whole chats, written from their first message, in one commit"""
+    _writer.submit_many(path, [
+        {"op": "upsert", "chat": {k: v for k, v in chat.items() if k != "messages"},
+         "start": 0, "messages": chat.get("messages", [])}
+        for chat in chats
+    ])
+
+def delete_chat(path: str, chat_id: str):
+    """Queue deletion of a chat"""
+    _writer.submit(path, {"op": "delete", "id": chat_id})
+
+def delete_chats(path: str, chat_ids: List[str]):
+    """Queue deletion of several chats in one commit"""
+    _writer.submit_many(path, [{"op": "delete", "id": chat_id} for chat_id in chat_ids])
+
+def load_chats(path: str) -> List[Dict]:
+    """Load all chats, including writes that are still queued"""
+    return _writer.read(path)
+
+def add_listener(name: str, listener: Callable):
+    """Register a commit listener (re-registering a name replaces it)"""
+    _writer.add_listener(name, listener)
+
+def flush(timeout: Optional[float] = None) -> bool:
+    """Wait for queued writes to reach disk"""
+    return _writer.flush(timeout)
+
+def last_error() -> Optional[str]:
+    """Error from the most recent failed commit, if it has not recovered"""
+    return _writer.last_error
+
+def stats() -> Dict:
+    """Commit counters for the writer thread"""
+    return {"commits": _writer.commits, "mutations": _writer.mutations}
+
+# Flush on interpreter shutdown so queued writes are not lost
+atexit.register(flush, SHUTDOWN_FLUSH_TIMEOUT)
@@ -0,0 +1,248 @@
+"""
+TextIQ - API Key Pool
+Spreads model requests over several API keys, each with its own rate limit
+and daily quota, and rests a key for a while after it is rate limited
+"""
+
+import os
+import re
+import time
+import threading
+from collections import deque
+from typing import List, Dict, Callable, Iterable, Iterator, Optional, Union
+
+import metrics
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Requests per minute and per 24 hours each key may make (0 = no local limit,
+# the default). Counted per process, so with several replicas set each one's share
+KEY_RPM = float(os.getenv("TEXTIQ_KEY_RPM", "0"))
+KEY_RPD = int(os.getenv("TEXTIQ_KEY_RPD", "0"))
+
+# Seconds a key rests after a 429, unless the error says how long to wait
+KEY_COOLDOWN = float(os.getenv("TEXTIQ_KEY_COOLDOWN", "60"))
+
+# Longest a request waits for a key with headroom before failing
+KEY_WAIT = float(os.getenv("TEXTIQ_KEY_WAIT", "5"))
+
+# A rate-limited request is retried on another key this many times
+KEY_RETRIES = int(os.getenv("TEXTIQ_KEY_RETRIES", "2"))
+
+DAY_SECONDS = 24 * 3600
+
+_RETRY_DELAY = re.compile(r"retry in ([\d.]+)\s*s|retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE)
+
+KEY_REQUESTS = metrics.Counter("textiq_api_key_requests_total", "Model requests per API key by outcome",
+                               ["key", "outcome"])
+
+# ============================================================================
+# KEYS
+# ============================================================================
+
+def parse_keys(value: Union[str, Iterable[str], None]) -> List[str]:
+    """Keys from a comma/space separated string or a list (e.g. from Streamlit secrets)"""
+    if not value:
+        return []
+    items = re.split(r"[\s,]+", value) if isinstance(value, str) else value
+    return [item.strip() for item in items if item and item.strip()]
+
+def merge_keys(*sources) -> List[str]:
+    """Keys from every source, in order, without duplicates"""
+    keys: List[str] = []
+    for source in sources:
+        for key in parse_keys(source):
+            if key not in keys:
+                keys.append(key)
+    return keys
+
+def mask(key: str) -> str:
+    """Printable stand-in for a key: its last four characters"""
+    return f"…{key[-4:]}" if len(key) >= 8 else "…"
+
+def is_rate_limited(error: BaseException) -> bool:
+    text = f"{type(error).__name__} {error}".lower()
+    return "429" in text or "resourceexhausted" in text or "resource exhausted" in text or "quota" in text
+
+def retry_delay(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, if the error says"""
+    match = _RETRY_DELAY.search(str(error))
+    return float(match.group(1) or match.group(2)) if match else None
+
+# ============================================================================
+# POOL
+# ============================================================================
+
+class KeyPoolExhausted(Exception):
+    """Every key is rate limited or out of quota"""
+
+
+class KeyState:
+    """Token bucket, 24-hour request log and cooldown of one key"""
+
+    def __init__(self, key: str, rpm: float, rpd: int, now: float):
+        self.key = key
+        self.label = mask(key)
+        self.rpm, self.rpd = rpm, rpd
+        self.tokens = float(rpm)
+        self.refilled = now
+        self.day_log: deque = deque()  # Request times of the last 24 hours
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.last_used: Optional[float] = None
+
+    def _refill(self, now: float):
+        if self.rpm:
+            self.tokens = min(self.rpm, self.tokens + (now - self.refilled) * self.rpm / 60)
+        self.refilled = now
+        while self.day_log and now - self.day_log[0] >= DAY_SECONDS:
+            self.day_log.popleft()
+
+    def headroom(self, now: float) -> float:
+        """Share of the tighter limit still unused (0 = can't send now)"""
+        self._refill(now)
+        if now < self.cooldown_until:
+            return 0.0
+        minute = self.tokens / self.rpm if self.rpm else 1.0
+        day = (self.rpd - len(self.day_log)) / self.rpd if self.rpd else 1.0
+        if (self.rpm and self.tokens < 1) or (self.rpd and len(self.day_log) >= self.rpd):
+            return 0.0
+        return min(minute, day)
+
+    def ready_in(self, now: float) -> float:
+        """Seconds until this key can send again"""
+        waits = [self.cooldown_until - now]
+        if self.rpm and self.tokens < 1:
+            waits.append((1 - self.tokens) * 60 / self.rpm)
+        if self.rpd and len(self.day_log) >= self.rpd:
+            waits.append(self.day_log[0] + DAY_SECONDS - now)
+        return max(0.0, *waits)
+
+    def take(self, now: float):
+        if self.rpm:
+            self.tokens -= 1
+        self.day_log.append(now)
+        self.requests += 1
+        self.last_used = now
+
+
+class KeyPool:
+    """Routes each request to the key with the most headroom"""
+
+    def __init__(self, keys: Iterable[str] = (), rpm: float = KEY_RPM, rpd: int = KEY_RPD,
+                 cooldown: float = KEY_COOLDOWN, wait: float = KEY_WAIT, retries: int = KEY_RETRIES,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.rpm, self.rpd, self.cooldown = rpm, rpd, cooldown
+        self.wait, self.retries = wait, retries
+        self.clock, self.sleep = clock, sleep
+        self._lock = threading.Lock()
+        self._states: List[KeyState] = []
+        self.set_keys(keys)
+
+    @property
+    def keys(self) -> List[str]:
+        return [state.key for state in self._states]
+
+    def set_keys(self, keys: Iterable[str]):
+        """Use these keys; keys already in the pool keep their limits and counts"""
+        keys = merge_keys(list(keys))
+        with self._lock:
+            current = {state.key: state for state in self._states}
+            now = self.clock()
+            self._states = [current.get(key) or KeyState(key, self.rpm, self.rpd, now) for key in keys]
+
+    def acquire(self, wait: Optional[float] = None) -> KeyState:
+        """Take a request's worth of the key with the most headroom, waiting up to `wait` seconds"""
+        deadline = self.clock() + (self.wait if wait is None else wait)
+        while True:
+            with self._lock:
+                if not self._states:
+                    raise KeyPoolExhausted("no API key configured")
+                now = self.clock()
+                # Most headroom first; among equals the key idle longest
+                best = max(self._states, key=lambda state: (state.headroom(now), -(state.last_used or 0)))
+                if best.headroom(now) > 0:
+                    best.take(now)
+                    return best
+                ready_in = min(state.ready_in(now) for state in self._states)
+            if now + ready_in > deadline:
+                raise KeyPoolExhausted(f"429 quota: every API key is rate limited; retry in {ready_in:.0f}s")
+            self.sleep(max(ready_in, 0.01))
+
+    def release(self, state: KeyState, error: Optional[BaseException] = None):
+        """Record how a request went; a rate-limited key rests"""
+        outcome = "ok"
+        with self._lock:
+            if error is not None and is_rate_limited(error):
+                state.rate_limited += 1
+                delay = retry_delay(error)
+                state.cooldown_until = self.clock() + (self.cooldown if delay is None else delay)
+                outcome = "rate_limited"
+            elif error is not None:
+                state.errors += 1
+                outcome = "error"
+        KEY_REQUESTS.inc(1, state.label, outcome)
+
+    def _should_retry(self, error: BaseException, retries: int) -> bool:
+        return is_rate_limited(error) and retries < self.retries and len(self._states) > 1
+
+    def call(self, request: Callable[[str], object], usage: Optional[Dict] = None):
+        """request(key), retried on another key if it is rate limited"""
+        retries = 0
+        while True:
+            state = self.acquire()
+            try:
+                result = request(state.key)
+            except Exception as e:
+                self.release(state, e)
+                if self._should_retry(e, retries):
+                    retries += 1
+                    if usage is not None:
+                        usage["retries"] = retries
+                    continue
+                raise
+            self.release(state)
+            return result
+
+    def stream(self, request: Callable[[str], Iterator[str]], usage: Optional[Dict] = None) -> Iterator[str]:
+        """request(key)'s chunks; retried on another key if rate limited before the first chunk"""
+        retries = 0
+        while True:
+            state = self.acquire()
+            started = False
+            try:
+                for chunk in request(state.key):
+                    started = True
+                    yield chunk
+            except GeneratorExit:
+                self.release(state)
+                raise
+            except Exception as e:
+                self.release(state, e)
+                if not started and self._should_retry(e, retries):
+                    retries += 1
+                    if usage is not None:
+                        usage["retries"] = retries
+                    continue
+                raise
+            self.release(state)
+            return
+
+    def stats(self) -> List[Dict]:
+        """Usage and limits per key (keys masked)"""
+        with self._lock:
+            now = self.clock()
+            return [{
+                "key": state.label,
+                "requests": state.requests,
+                "errors": state.errors,
+                "rate_limited": state.rate_limited,
+                "requests_24h": len(state.day_log),
+                "headroom": round(state.headroom(now), 3),
+                "cooldown_s": round(max(0.0, state.cooldown_until - now), 1),
+                "idle_s": round(now - state.last_used, 1) if state.last_used is not None else None,
+            } for state in self._states]
@@ -0,0 +1,292 @@
+"""
+TextIQ - Load Test
+Drives concurrent simulated sessions through app.py headlessly and reports
+rerun latency, throughput and memory as the session count ramps up
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+import warnings
+from urllib import parse
+from typing import List, Dict
+
+import core
+import memory
+import metrics
+import history_store
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# Concurrent sessions per ramp step
+SESSION_RAMP = (1, 5, 10, 25)
+
+# Chat messages each session sends
+TURNS = 5
+
+# Mock model timing (the app waits for the full reply)
+LATENCY_MS = 200
+TOKEN_DELAY_MS = 0
+
+# Longest a single script run may take before the session counts as failed
+RUN_TIMEOUT = 120
+
+# Session state flag set by the patched st.rerun()
+RERUN_FLAG = "_load_test_rerun"
+
+# ============================================================================
+# HEADLESS RUNTIME
+# ============================================================================
+
+_installed = None
+_install_lock = threading.Lock()
+
+def install_runtime():
+    """Patch Streamlit so many AppTest sessions can run at once in one process
+
+    AppTest swaps a fresh mock Runtime into the global slot on every run and
+    clears it afterwards, compiles the script again for every run, and
+    treats st.rerun() as a fresh run of the last widget trigger. Here one
+    mock Runtime is installed for the whole test, every session shares one
+    compiled script, and st.rerun() stops the run and leaves a flag the
+    session follows up with a plain rerun, as a browser would.
+    """
+    global _installed
+    with _install_lock:
+        if _installed is not None:
+            return _installed
+
+        from unittest.mock import MagicMock
+        import streamlit
+        from streamlit import source_util
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+        from streamlit.runtime.media_file_manager import MediaFileManager
+        from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+        from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+        from streamlit.testing.v1 import AppTest
+        from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+        runtime = MagicMock(spec=Runtime)
+        runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+        runtime.cache_storage_manager = MemoryCacheStorageManager()
+        previous = (Runtime._instance, streamlit.rerun)
+        Runtime._instance = runtime
+        source_util._cached_pages = None
+
+        def rerun():
+            streamlit.session_state[RERUN_FLAG] = True
+            streamlit.stop()
+
+        streamlit.rerun = rerun
+        script_cache = ScriptCache()
+        # Streamlit's TTL caches schedule expiry on an event loop that
+        # headless runs don't have; the unscheduled coroutines are harmless
+        warnings.filterwarnings("ignore", message="coroutine 'expire_cache' was never awaited")
+
+        class SessionTest(AppTest):
+            """AppTest that runs against the shared runtime and script cache"""
+
+            def _run(self, widget_state=None, timeout=None):
+                runner = LocalScriptRunner(self._script_path, self.session_state,
+                                           args=self.args, kwargs=self.kwargs)
+                runner._script_cache = script_cache
+                self._tree = runner.run(widget_state, self.query_params, timeout or self.default_timeout)
+                self._tree._runner = self
+                client_state = runner.event_data[-1]["client_state"]
+                self.query_params = parse.parse_qs(client_state.query_string)
+                return self
+
+        def uninstall():
+            Runtime._instance, streamlit.rerun = previous
+
+        _installed = (SessionTest, uninstall)
+        return _installed
+
+def uninstall_runtime():
+    """Undo install_runtime()"""
+    global _installed
+    with _install_lock:
+        if _installed is not None:
+            _installed[1]()
+            _installed = None
+
+# ============================================================================
+# SIMULATED SESSION
+# ============================================================================
+
+class SimulatedSession:
+    """One browser tab: sends messages, opens history and toggles the theme"""
+
+    def __init__(self, number: int, turns: int = TURNS):
+        session_test, _ = install_runtime()
+        self.number = number
+        self.turns = turns
+        self.app = session_test(APP_SCRIPT, default_timeout=RUN_TIMEOUT)
+        self.run_ms: List[float] = []     # Every script run, reruns included
+        self.action_ms: List[float] = []  # Every user action, until the page settles
+        self.errors: List[str] = []
+
+    def _settle(self):
+        """Run the script, then follow any st.rerun() it asked for"""
+        start = time.perf_counter()
+        while True:
+            run_start = time.perf_counter()
+            self.app.run()
+            self.run_ms.append((time.perf_counter() - run_start) * 1000)
+            self.errors += [e.message for e in self.app.exception]
+            if RERUN_FLAG not in self.app.session_state or not self.app.session_state[RERUN_FLAG]:
+                break
+            del self.app.session_state[RERUN_FLAG]
+        self.action_ms.append((time.perf_counter() - start) * 1000)
+
+    def _click(self, key: str):
+        self.app.button(key=key).click()
+        self._settle()
+
+    def send_message(self, text: str):
+        self.app.chat_input[0].set_value(text)
+        self._settle()
+
+    def browse_history(self):
+        """Open the history panel, reopen the current chat from it, close it"""
+        self._click("main_history")
+        load_key = f"main_load_{self.app.session_state['chat_id']}"
+        if load_key in [button.key for button in self.app.button]:
+            self._click(load_key)
+        self._click("main_history")
+
+    def toggle_theme(self):
+        self._click("main_dark_mode")
+
+    def run(self):
+        try:
+            self._settle()
+            for turn in range(self.turns):
+                self.send_message(f"Session {self.number}, question {turn + 1}: how does this work?")
+                if turn % 2:
+                    self.toggle_theme()
+                else:
+                    self.browse_history()
+            if len(self.app.session_state["messages"]) != 2 * self.turns:
+                self.errors.append(f"expected {2 * self.turns} messages, "
+                                   f"found {len(self.app.session_state['messages'])}")
+        except Exception as e:
+            self.errors.append(f"{type(e).__name__}: {e}")
+
+# ============================================================================
+# RAMP
+# ============================================================================
+
+def memory_mb() -> Dict[str, float]:
+    """Resident and peak memory of this process"""
+    return memory.process_memory()
+
+def run_step(sessions: int, turns: int = TURNS) -> Dict:
+    """Run this many sessions at once; latencies in ms"""
+    simulated = [SimulatedSession(number, turns) for number in range(sessions)]
+    threads = [threading.Thread(target=session.run, daemon=True) for session in simulated]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    run_ms = [ms for session in simulated for ms in session.run_ms]
+    action_ms = [ms for session in simulated for ms in session.action_ms]
+    # Measured while every session is still alive, as on a busy server
+    result = {
+        "sessions": sessions,
+        "runs": len(run_ms),
+        "runs_per_s": round(len(run_ms) / elapsed, 1),
+        "run_p50_ms": round(metrics.percentile(run_ms, 0.50), 1),
+        "run_p95_ms": round(metrics.percentile(run_ms, 0.95), 1),
+        "run_p99_ms": round(metrics.percentile(run_ms, 0.99), 1),
+        "action_p50_ms": round(metrics.percentile(action_ms, 0.50), 1),
+        "action_p95_ms": round(metrics.percentile(action_ms, 0.95), 1),
+        "seconds": round(elapsed, 2),
+        "errors": [f"session {session.number}: {error}" for session in simulated for error in session.errors],
+    }
+    result.update(memory_mb())
+    return result
+
+def run_ramp(ramp=SESSION_RAMP, turns: int = TURNS, latency_ms: float = LATENCY_MS,
+             token_delay_ms: float = TOKEN_DELAY_MS, report=print) -> List[Dict]:
+    """Run each step of the ramp in a scratch directory against a mock backend"""
+    previous_backend, previous_cwd = core.get_backend(), os.getcwd()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)  # History and session files land here
+            core.set_backend(core.MockBackend(latency_ms=latency_ms, token_delay_ms=token_delay_ms))
+            install_runtime()
+            for sessions in ramp:
+                result = run_step(sessions, turns)
+                results.append(result)
+                if report:
+                    report(format_row(result))
+            history_store.flush(10)
+    finally:
+        uninstall_runtime()
+        core.set_backend(previous_backend)
+        os.chdir(previous_cwd)
+    return results
+
+HEADER = (f"{'sessions':>8} {'runs':>6} {'runs/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'action p95':>10} {'RSS MB':>7} {'errors':>6}")
+
+def format_row(result: Dict) -> str:
+    return (f"{result['sessions']:>8} {result['runs']:>6} {result['runs_per_s']:>7.1f} "
+            f"{result['run_p50_ms']:>8.1f} {result['run_p95_ms']:>8.1f} {result['run_p99_ms']:>8.1f} "
+            f"{result['action_p95_ms']:>10.1f} {result.get('rss_mb', float('nan')):>7.1f} {len(result['errors']):>6}")
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="TextIQ concurrent-session load test")
+    parser.add_argument("--sessions", default=",".join(map(str, SESSION_RAMP)),
+                        help="comma-separated session counts to ramp through (default: %(default)s)")
+    parser.add_argument("--turns", type=int, default=TURNS, help="messages per session (default: %(default)s)")
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS,
+                        help="mock model delay before the reply (default: %(default)s)")
+    parser.add_argument("--token-delay-ms", type=float, default=TOKEN_DELAY_MS,
+                        help="mock model delay between reply tokens (default: %(default)s)")
+    parser.add_argument("--json", metavar="FILE", help="also write the results as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    try:
+        ramp = [int(count) for count in args.sessions.split(",") if count.strip()]
+    except ValueError:
+        parser.error("--sessions takes comma-separated numbers, e.g. 1,5,10")
+
+    print("=" * 80)
+    print("TEXTIQ - LOAD TEST")
+    print("=" * 80)
+    print(f"{args.turns} messages per session, mock model latency {args.latency_ms:.0f} ms\n")
+    print(HEADER)
+    results = run_ramp(ramp, args.turns, args.latency_ms, args.token_delay_ms)
+
+    errors = [error for result in results for error in result["errors"]]
+    for error in errors[:10]:
+        print(f"   ❌ {error}")
+    if args.json:
+        data = json.dumps({"turns": args.turns, "latency_ms": args.latency_ms, "steps": results}, indent=2)
+        if args.json == "-":
+            print(data)
+        else:
+            with open(args.json, "w", encoding="utf-8") as f:
+                f.write(data + "\n")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,311 @@
+"""
+TextIQ - Memory Accounting
+Approximate bytes held by each session's state and by module-level caches,
+with periodic tracemalloc snapshots diffed to find what keeps growing
+"""
+
+import gc
+import os
+import sys
+import time
+import types
+import threading
+import tracemalloc
+from collections import OrderedDict
+from typing import List, Dict, Mapping, Optional
+
+import message_window
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# "1" starts tracemalloc and the snapshot thread and shows the memory debug view
+MEMORY_DEBUG = os.getenv("TEXTIQ_MEMORY_DEBUG", "0").lower() in ("1", "true", "yes")
+
+# Seconds between tracemalloc snapshots
+SNAPSHOT_INTERVAL = float(os.getenv("TEXTIQ_MEMORY_SNAPSHOT_INTERVAL", "60"))
+
+# Snapshots kept for diffing (oldest dropped first)
+MAX_SNAPSHOTS = int(os.getenv("TEXTIQ_MEMORY_SNAPSHOTS", "10"))
+
+# Stack frames tracemalloc keeps per allocation (1 = the allocating line only)
+TRACE_FRAMES = int(os.getenv("TEXTIQ_MEMORY_FRAMES", "1"))
+
+# Source lines kept per snapshot; the rest of the allocations are summed, not itemized
+LINES_PER_SNAPSHOT = 500
+
+# A line is a leak suspect if it grew in every snapshot and by at least this much
+LEAK_MIN_BYTES = 64 * 1024
+
+# A session's state is measured at most this often (seconds), and forgotten
+# when it has not run for SESSION_EXPIRY
+ACCOUNT_INTERVAL = 10
+SESSION_EXPIRY = 3600
+MAX_SESSIONS = 1000
+
+# Objects followed per measurement, so one huge structure can't stall a run
+MAX_OBJECTS = 200000
+
+# ============================================================================
+# OBJECT SIZES
+# ============================================================================
+
+# Shared by every session and cache; following them would measure the whole process
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+                 types.MethodType, types.CodeType, types.FrameType, threading.Thread)
+
+def deep_size(obj, seen: Optional[set] = None) -> int:
+    """Approximate bytes reachable from obj (sys.getsizeof over gc referents)
+
+    Message windows count only the messages they hold in memory, not the
+    ones spilled to disk.
+    """
+    seen = set() if seen is None else seen
+    pending, size, visited = [obj], 0, 0
+    while pending and visited < MAX_OBJECTS:
+        item = pending.pop()
+        if id(item) in seen or isinstance(item, _SHARED_TYPES):
+            continue
+        seen.add(id(item))
+        visited += 1
+        if isinstance(item, message_window.MessageWindow):
+            size += item.memory_bytes()
+            continue
+        size += sys.getsizeof(item)
+        pending.extend(gc.get_referents(item))
+    return size
+
+def process_memory() -> Dict[str, float]:
+    """Resident and peak memory of this process
+
+    Without the resource module (Windows) psutil is used if installed;
+    failing that only the tracemalloc totals are returned.
+    """
+    if resource is None:
+        if psutil is not None:
+            info = psutil.Process().memory_info()
+            rss_mb = info.rss / 1024 / 1024
+            peak_mb = getattr(info, "peak_wset", info.rss) / 1024 / 1024
+            return {"rss_mb": round(rss_mb, 1), "peak_rss_mb": round(peak_mb, 1)}
+        current, peak = tracemalloc.get_traced_memory()
+        return {"traced_bytes": current, "peak_traced_bytes": peak}
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_kb /= 1024  # Bytes on macOS
+    rss_mb = peak_kb / 1024
+    try:
+        with open("/proc/self/statm") as f:
+            rss_mb = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        pass
+    return {"rss_mb": round(rss_mb, 1), "peak_rss_mb": round(peak_kb / 1024, 1)}
+
+# ============================================================================
+# SESSIONS AND CACHES
+# ============================================================================
+
+# session -> {"measured": time, "keys": {key: bytes}}; sizes only, never the objects
+_sessions: "OrderedDict[str, Dict]" = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def record_session(session_id: str, state: Mapping, force: bool = False):
+    """Measure each key of a session's state (rate limited; no-op unless MEMORY_DEBUG)"""
+    if not (MEMORY_DEBUG or force) or not session_id:
+        return
+    now = time.time()
+    with _sessions_lock:
+        entry = _sessions.get(session_id)
+        if entry and not force and now - entry["measured"] < ACCOUNT_INTERVAL:
+            return
+    sizes = {}
+    for key in list(state.keys()):
+        try:
+            sizes[str(key)] = deep_size(state[key])
+        except KeyError:
+            continue  # Removed while we were measuring
+    with _sessions_lock:
+        _sessions.pop(session_id, None)
+        _sessions[session_id] = {"measured": now, "keys": sizes}
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+
+def forget_session(session_id: str):
+    with _sessions_lock:
+        _sessions.pop(session_id, None)
+
+def session_usage(limit: int = 10) -> List[Dict]:
+    """Largest sessions measured recently, with their largest state keys"""
+    cutoff = time.time() - SESSION_EXPIRY
+    with _sessions_lock:
+        for session_id in [sid for sid, entry in _sessions.items() if entry["measured"] < cutoff]:
+            del _sessions[session_id]
+        entries = list(_sessions.items())
+    usage = [{
+        "session": session_id,
+        "bytes": sum(entry["keys"].values()),
+        "keys": sorted(entry["keys"].items(), key=lambda item: item[1], reverse=True),
+        "measured": entry["measured"],
+    } for session_id, entry in entries]
+    return sorted(usage, key=lambda session: session["bytes"], reverse=True)[:limit]
+
+def _caches() -> Dict[str, object]:
+    """Module-level caches, looked up at call time so this module imports none of them"""
+    import core
+    import metrics
+    import search_index
+    import history_store
+    import session_store
+    return {
+        "search_index: open indexes": search_index._indexes,
+        "history_store: queued writes": (history_store._writer._pending, history_store._writer._inflight),
+        "history_store: known files": history_store._known_files,
+        "metrics: recent turns": metrics._turns,
+        "metrics: series": [getattr(metric, "_values", None) or getattr(metric, "_series", None)
+                            for metric in metrics._registry],
+        "session_store: store": session_store._store,
+        "core: backend": core._backend,
+    }
+
+def cache_usage() -> List[Dict]:
+    """Approximate bytes held by each module-level cache, largest first"""
+    usage = []
+    for name, cache in _caches().items():
+        try:
+            size = deep_size(cache)
+        except Exception:
+            continue  # Measuring must not break the debug view
+        usage.append({"cache": name, "bytes": size})
+    windows = message_window.stats()
+    usage.append({"cache": f"message_window: {windows['sessions']} windows", "bytes": windows["memory_bytes"]})
+    return sorted(usage, key=lambda cache: cache["bytes"], reverse=True)
+
+# ============================================================================
+# SNAPSHOTS
+# ============================================================================
+
+_snapshots: List[Dict] = []
+_snapshots_lock = threading.Lock()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+_start_lock = threading.Lock()
+
+# tracemalloc's own allocations and import machinery are not the app's
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+def _location(frame) -> str:
+    """file:line, relative to the app or to site-packages"""
+    filename = frame.filename
+    if filename.startswith(_APP_DIR):
+        filename = filename[len(_APP_DIR):]
+    elif "site-packages" + os.sep in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    return f"{filename}:{frame.lineno}"
+
+def take_snapshot() -> Optional[Dict]:
+    """Summarize current allocations by source line and keep the summary"""
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+    statistics = snapshot.statistics("lineno")
+    current, peak = tracemalloc.get_traced_memory()
+    summary = {
+        "time": time.time(),
+        "traced_bytes": current,
+        "peak_traced_bytes": peak,
+        "lines": {_location(stat.traceback[0]): (stat.size, stat.count)
+                  for stat in statistics[:LINES_PER_SNAPSHOT]},
+        "sessions": sum(session["bytes"] for session in session_usage(MAX_SESSIONS)),
+    }
+    summary.update(process_memory())
+    del snapshot, statistics
+    with _snapshots_lock:
+        _snapshots.append(summary)
+        del _snapshots[:-MAX_SNAPSHOTS]
+    return summary
+
+def snapshots() -> List[Dict]:
+    with _snapshots_lock:
+        return list(_snapshots)
+
+def diff(older: Optional[Dict] = None, newer: Optional[Dict] = None, limit: int = 10) -> List[Dict]:
+    """Source lines whose allocations grew most between two snapshots (default: oldest to newest)"""
+    kept = snapshots()
+    if older is None or newer is None:
+        if len(kept) < 2:
+            return []
+        older, newer = older or kept[0], newer or kept[-1]
+    changes = []
+    for location in set(older["lines"]) | set(newer["lines"]):
+        size, count = newer["lines"].get(location, (0, 0))
+        old_size, old_count = older["lines"].get(location, (0, 0))
+        if size != old_size:
+            changes.append({"location": location, "size": size, "size_diff": size - old_size,
+                            "count_diff": count - old_count})
+    return sorted(changes, key=lambda change: change["size_diff"], reverse=True)[:limit]
+
+def leak_suspects(min_growth: int = LEAK_MIN_BYTES, limit: int = 10) -> List[Dict]:
+    """Lines that grew between every pair of kept snapshots (at least 3), by min_growth in total"""
+    kept = snapshots()
+    if len(kept) < 3:
+        return []
+    suspects = []
+    for location in kept[-1]["lines"]:
+        sizes = [snapshot["lines"].get(location, (0, 0))[0] for snapshot in kept]
+        if all(later > earlier for earlier, later in zip(sizes, sizes[1:])) and sizes[-1] - sizes[0] >= min_growth:
+            suspects.append({"location": location, "size": sizes[-1], "growth": sizes[-1] - sizes[0]})
+    return sorted(suspects, key=lambda suspect: suspect["growth"], reverse=True)[:limit]
+
+def _run(interval: float):
+    while not _stop.wait(interval):
+        try:
+            take_snapshot()
+        except Exception:
+            pass  # A failed snapshot is retried at the next interval
+
+def start(interval: Optional[float] = None, force: bool = False) -> bool:
+    """Start tracemalloc and the snapshot thread once per process (no-op unless MEMORY_DEBUG)"""
+    global _thread
+    if not (MEMORY_DEBUG or force):
+        return False
+    with _start_lock:
+        if _thread is None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACE_FRAMES)
+            _stop.clear()
+            take_snapshot()  # Baseline
+            _thread = threading.Thread(target=_run, args=(interval or SNAPSHOT_INTERVAL,),
+                                       name="textiq-memory", daemon=True)
+            _thread.start()
+    return True
+
+def stop():
+    """Stop snapshots and tracemalloc and forget what was recorded (used by tests)"""
+    global _thread
+    with _start_lock:
+        if _thread is not None:
+            _stop.set()
+            _thread.join()
+            _thread = None
+        tracemalloc.stop()
+    with _snapshots_lock:
+        _snapshots.clear()
+    with _sessions_lock:
+        _sessions.clear()
@@ -0,0 +1,212 @@
+"""
+TextIQ - Bounded Message Window
+Keeps recent messages in memory and spills older ones to disk
+"""
+
+import os
+import sys
+import weakref
+import tempfile
+import threading
+from array import array
+from collections import deque
+from collections.abc import Sequence
+from typing import List, Dict, Iterable, Iterator, Optional
+
+import serialization
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Message text kept in memory per session before older messages spill to disk
+MAX_WINDOW_BYTES = int(os.getenv("TEXTIQ_SESSION_MEMORY_KB", "256")) * 1024
+
+# Always keep at least the latest exchange in memory
+KEEP_MIN_MESSAGES = 2
+
+# Where spill files are written (one per session, removed with the session)
+SPILL_DIR = os.getenv("TEXTIQ_SPILL_DIR", os.path.join(tempfile.gettempdir(), "textiq-spill"))
+
+# Spilled messages read from disk per chunk while iterating
+PAGE_SIZE = 256
+
+# ============================================================================
+# COMPACT MESSAGES
+# ============================================================================
+
+def _pack(message: Dict) -> tuple:
+    """(role, content) tuple with an interned role; other keys kept as a dict"""
+    role = sys.intern(message["role"])
+    content = message["content"]
+    if len(message) == 2:
+        return (role, content)
+    extra = {key: value for key, value in message.items() if key not in ("role", "content")}
+    return (role, content, extra)
+
+def _unpack(packed: tuple) -> Dict:
+    message = {"role": packed[0], "content": packed[1]}
+    if len(packed) == 3:
+        message.update(packed[2])
+    return message
+
+def _packed_size(packed: tuple) -> int:
+    size = sys.getsizeof(packed) + sys.getsizeof(packed[1])
+    if len(packed) == 3:
+        size += sys.getsizeof(packed[2])
+    return size
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# ============================================================================
+# MESSAGE WINDOW
+# ============================================================================
+
+class MessageWindow(Sequence):
+    """List-like message history with a bounded in-memory tail"""
+
+    def __init__(self, messages: Iterable[Dict] = (), max_bytes: int = MAX_WINDOW_BYTES):
+        self.max_bytes = max_bytes
+        self._recent: deque = deque()
+        self._recent_bytes = 0
+        self._offsets = array('q')   # start of each spilled record in the spill file
+        self._spill_end = 0
+        self._spill_path: Optional[str] = None
+        self._codec = serialization.get_codec()
+        self.page_ins = 0
+        self.extend(messages)
+        with _registry_lock:
+            _windows[id(self)] = self
+
+    # ------------------------------------------------------------------
+    # List interface
+    # ------------------------------------------------------------------
+
+    def __len__(self):
+        return len(self._offsets) + len(self._recent)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return list(self._iter_range(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        if index >= len(self._offsets):
+            return _unpack(self._recent[index - len(self._offsets)])
+        return self._read_spilled(index, index + 1)[0]
+
+    def __iter__(self) -> Iterator[Dict]:
+        return self._iter_range(0, len(self))
+
+    def __eq__(self, other):
+        if isinstance(other, (MessageWindow, list, tuple)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"MessageWindow({len(self)} messages, {self.spilled_count} on disk)"
+
+    def append(self, message: Dict):
+        """Add a message, spilling the oldest ones if the window is over budget"""
+        packed = _pack(message)
+        self._recent.append(packed)
+        self._recent_bytes += _packed_size(packed)
+        if self._recent_bytes > self.max_bytes:
+            self._spill()
+
+    def extend(self, messages: Iterable[Dict]):
+        for message in messages:
+            self.append(message)
+
+    def _iter_range(self, start: int, stop: int) -> Iterator[Dict]:
+        spilled = len(self._offsets)
+        # Spilled messages are paged in a chunk at a time and not kept
+        for chunk_start in range(start, min(stop, spilled), PAGE_SIZE):
+            yield from self._read_spilled(chunk_start, min(chunk_start + PAGE_SIZE, stop, spilled))
+        for index in range(max(start, spilled), stop):
+            yield _unpack(self._recent[index - spilled])
+
+    # ------------------------------------------------------------------
+    # Spill file
+    # ------------------------------------------------------------------
+
+    def _spill(self):
+        batch = []
+        while self._recent_bytes > self.max_bytes and len(self._recent) > KEEP_MIN_MESSAGES:
+            packed = self._recent.popleft()
+            self._recent_bytes -= _packed_size(packed)
+            batch.append(self._codec.dumps(_unpack(packed)))
+        if not batch:
+            return
+        if self._spill_path is None:
+            os.makedirs(SPILL_DIR, exist_ok=True)
+            fd, self._spill_path = tempfile.mkstemp(dir=SPILL_DIR, prefix="session-", suffix=".spill")
+            os.close(fd)
+            weakref.finalize(self, _remove_file, self._spill_path)
+        with open(self._spill_path, 'ab') as f:
+            for data in batch:
+                self._offsets.append(self._spill_end)
+                f.write(data)
+                self._spill_end += len(data)
+
+    def _read_spilled(self, start: int, stop: int) -> List[Dict]:
+        end = self._offsets[stop] if stop < len(self._offsets) else self._spill_end
+        with open(self._spill_path, 'rb') as f:
+            f.seek(self._offsets[start])
+            data = f.read(end - self._offsets[start])
+        base = self._offsets[start]
+        bounds = [self._offsets[i] - base for i in range(start, stop)] + [end - base]
+        self.page_ins += stop - start
+        return [self._codec.loads(data[bounds[i]:bounds[i + 1]]) for i in range(stop - start)]
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+
+    @property
+    def spilled_count(self) -> int:
+        """Messages currently on disk (the oldest ones)"""
+        return len(self._offsets)
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the in-memory window"""
+        return (
+            sys.getsizeof(self._recent)
+            + sum(_packed_size(packed) for packed in self._recent)
+            + self._offsets.itemsize * len(self._offsets)
+        )
+
+    def spill_bytes(self) -> int:
+        return self._spill_end
+
+# ============================================================================
+# PROCESS-WIDE METRICS
+# ============================================================================
+
+_windows: "weakref.WeakValueDictionary[int, MessageWindow]" = weakref.WeakValueDictionary()
+_registry_lock = threading.Lock()
+
+def stats() -> Dict:
+    """Memory used by every live session's messages"""
+    with _registry_lock:
+        windows = list(_windows.values())
+    sizes = [window.memory_bytes() for window in windows]
+    return {
+        "sessions": len(windows),
+        "messages_in_memory": sum(len(window._recent) for window in windows),
+        "messages_spilled": sum(window.spilled_count for window in windows),
+        "memory_bytes": sum(sizes),
+        "max_session_bytes": max(sizes, default=0),
+        "spill_bytes": sum(window.spill_bytes() for window in windows),
+        "page_ins": sum(window.page_ins for window in windows),
+    }
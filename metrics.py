@@ -0,0 +1,278 @@
+"""
+TextIQ - Metrics
+Timing and token usage of each reply, a rolling per-model summary, and
+process-wide counters and histograms in the Prometheus text format
+"""
+
+import os
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from typing import List, Dict, Callable, Optional, Sequence
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Most recent turns kept for the per-model summary
+WINDOW = int(os.getenv("TEXTIQ_METRICS_WINDOW", "1000"))
+
+# ============================================================================
+# TURN
+# ============================================================================
+
+class Turn:
+    """Timing and token usage of one reply, filled in as it is generated
+
+    Times are from `submitted` (when the user sent the message): queue time
+    until the model request starts, time to the first chunk, and total.
+    Backends put token counts from the response into `usage`, and the key
+    pool the number of times a rate-limited request was retried on another key.
+    """
+
+    def __init__(self, model: str, submitted: Optional[float] = None):
+        self.model = model
+        self.submitted = submitted if submitted is not None else time.perf_counter()
+        self.started: Optional[float] = None
+        self.first_chunk: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.usage: Dict[str, int] = {}
+        self.retries = 0
+        self.error: Optional[str] = None
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def chunk(self):
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.finished = time.perf_counter()
+        self.retries = self.usage.get("retries", self.retries)
+        if error is not None:
+            self.error = type(error).__name__
+        record_turn(self.as_dict())
+
+    def _since_submitted(self, moment: Optional[float]) -> Optional[float]:
+        return round((moment - self.submitted) * 1000, 1) if moment is not None else None
+
+    def as_dict(self) -> Dict:
+        """JSON-friendly metrics, as stored on the assistant message"""
+        return {
+            "model": self.model,
+            "queue_ms": self._since_submitted(self.started),
+            "ttft_ms": self._since_submitted(self.first_chunk),
+            "latency_ms": self._since_submitted(self.finished),
+            "input_tokens": self.usage.get("input_tokens"),
+            "output_tokens": self.usage.get("output_tokens"),
+            "retries": self.retries,
+            "error": self.error,
+        }
+
+# ============================================================================
+# REGISTRY
+# ============================================================================
+
+_turns: deque = deque(maxlen=WINDOW)
+_lock = threading.Lock()
+
+def record_turn(turn: Dict):
+    """Add a finished turn (as from Turn.as_dict()) to the rolling window"""
+    with _lock:
+        _turns.append(turn)
+    model = turn["model"]
+    MODEL_REQUESTS.inc(1, model)
+    if turn["retries"]:
+        MODEL_RETRIES.inc(turn["retries"], model)
+    if turn["error"]:
+        MODEL_ERRORS.inc(1, model, turn["error"])
+    elif turn["latency_ms"] is not None:
+        MODEL_REQUEST_SECONDS.observe((turn["latency_ms"] - (turn["queue_ms"] or 0)) / 1000, model)
+    if turn["input_tokens"]:
+        MODEL_TOKENS.inc(turn["input_tokens"], model, "input")
+    if turn["output_tokens"]:
+        MODEL_TOKENS.inc(turn["output_tokens"], model, "output")
+
+def recent_turns() -> List[Dict]:
+    with _lock:
+        return list(_turns)
+
+def reset():
+    with _lock:
+        _turns.clear()
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile (0 for no values)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summary() -> Dict[str, Dict]:
+    """Per-model latency percentiles, error count and output tokens per second"""
+    by_model: Dict[str, List[Dict]] = {}
+    for turn in recent_turns():
+        by_model.setdefault(turn["model"], []).append(turn)
+
+    result = {}
+    for model, turns in by_model.items():
+        ok = [turn for turn in turns if not turn["error"] and turn["latency_ms"] is not None]
+        latency = [turn["latency_ms"] for turn in ok]
+        ttft = [turn["ttft_ms"] for turn in ok if turn["ttft_ms"] is not None]
+        # Output rate while the model is generating, i.e. after it was called
+        counted = [turn for turn in ok if turn["output_tokens"]]
+        generating_s = sum((turn["latency_ms"] - (turn["queue_ms"] or 0)) / 1000 for turn in counted)
+        output_tokens = sum(turn["output_tokens"] for turn in counted)
+        result[model] = {
+            "turns": len(turns),
+            "errors": len(turns) - len(ok),
+            "p50_ms": round(percentile(latency, 0.50), 1),
+            "p95_ms": round(percentile(latency, 0.95), 1),
+            "ttft_p50_ms": round(percentile(ttft, 0.50), 1),
+            "input_tokens": sum(turn["input_tokens"] or 0 for turn in ok),
+            "output_tokens": output_tokens,
+            "tokens_per_s": round(output_tokens / generating_s, 1) if generating_s > 0 else 0.0,
+            "retries": sum(turn["retries"] for turn in turns),
+        }
+    return result
+
+# ============================================================================
+# PROMETHEUS METRICS
+# ============================================================================
+
+# Latency buckets in seconds, from a cached history read up to a slow model reply
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry: List = []
+_registry_lock = threading.Lock()
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    """Monotonic count per label set"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+class Gauge:
+    """Current value, either set directly or read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, function: Optional[Callable[[], float]] = None):
+        self.name, self.help = name, help
+        self.function = function
+        self._value = 0.0
+        _register(self)
+
+    def set(self, value: float):
+        self._value = value
+
+    def value(self) -> float:
+        return self.function() if self.function else self._value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.value())}"]
+
+class Histogram:
+    """Observation counts in cumulative buckets per label set"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 register: bool = True):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # labels -> [counts per bucket + overflow, sum, lock]
+        self._lock = threading.Lock()
+        if register:
+            _register(self)
+
+    def _get_series(self, labels: tuple) -> list:
+        series = self._series.get(labels)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0, threading.Lock()])
+        return series
+
+    def observe(self, value: float, *labels: str):
+        series = self._get_series(labels)
+        index = bisect_left(self.buckets, value)
+        with series[2]:
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._series.items())
+        lines = []
+        for key, series in items:
+            with series[2]:
+                counts, total = list(series[0]), series[1]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format"""
+    with _registry_lock:
+        registry = list(_registry)
+    lines = []
+    for metric in registry:
+        try:
+            samples = metric.samples()
+        except Exception:
+            continue  # A failing gauge callback must not break the scrape
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+MODEL_REQUESTS = Counter("textiq_model_requests_total", "Model requests, including failed ones", ["model"])
+MODEL_RETRIES = Counter("textiq_model_retries_total", "Model requests retried on another API key", ["model"])
+MODEL_ERRORS = Counter("textiq_model_errors_total", "Failed model requests by error class", ["model", "error"])
+MODEL_REQUEST_SECONDS = Histogram("textiq_model_request_seconds", "Model request latency of successful replies",
+                                  ["model"])
+MODEL_TOKENS = Counter("textiq_model_tokens_total", "Tokens sent to and received from the model",
+                       ["model", "direction"])
+RERUN_SECONDS = Histogram("textiq_rerun_seconds", "Streamlit script run duration")
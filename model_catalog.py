@@ -0,0 +1,284 @@
+"""
+TextIQ - Model Catalog
+Which configured models the backend can serve: the model list is cached with
+a TTL and every model is probed at once, so a check takes as long as the
+slowest model rather than all of them in turn
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import List, Dict, Optional
+
+import core
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Seconds a model list or probe result is reused before it is checked again
+CATALOG_TTL = float(os.getenv("TEXTIQ_MODEL_CATALOG_TTL", "600"))
+
+# Longest a probe may take; slower models count as not responding
+PROBE_TIMEOUT = float(os.getenv("TEXTIQ_MODEL_PROBE_TIMEOUT", "15"))
+
+# "1" also sends every listed model a test message; off by default, since
+# each check would cost one request of quota per model
+PROBE_ENABLED = os.getenv("TEXTIQ_MODEL_PROBE", "0").lower() in ("1", "true", "yes")
+
+# Results are kept here between processes (per backend and API key)
+CATALOG_FILE = os.getenv("TEXTIQ_MODEL_CATALOG", "textiq_models.json")
+
+# The test message; the same request as the model tests in testing.py, so
+# their cassettes replay it
+PROBE_PROMPT = "Hi"
+
+STATUS_OK = "ok"
+STATUS_UNKNOWN = "unknown"    # Not checked yet, or the backend can't list models
+STATUS_TIMEOUT = "timeout"
+STATUS_ERROR = "error"
+STATUS_MISSING = "missing"    # Not in the backend's model list
+
+# Order of preference in the app; unavailable models go last
+STATUS_RANK = {STATUS_OK: 0, STATUS_UNKNOWN: 0, STATUS_TIMEOUT: 1, STATUS_ERROR: 2, STATUS_MISSING: 3}
+
+STATUS_LABELS = {STATUS_TIMEOUT: "not responding", STATUS_ERROR: "unavailable", STATUS_MISSING: "unavailable"}
+
+# ============================================================================
+# CATALOG
+# ============================================================================
+
+def _cache_key(backend) -> str:
+    """Backend name plus a hash of its API key; keys can see different models"""
+    api_key = getattr(getattr(backend, "inner", backend), "api_key", "")
+    digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else "nokey"
+    return f"{getattr(backend, 'name', type(backend).__name__)}:{digest}"
+
+class ModelCatalog:
+    """Cached model list and probe results for one backend (the shared one by default)"""
+
+    def __init__(self, backend=None, ttl: float = CATALOG_TTL, probe_timeout: float = PROBE_TIMEOUT,
+                 cache_file: Optional[str] = CATALOG_FILE, probe_models: bool = PROBE_ENABLED):
+        self._fixed_backend = backend
+        self.ttl = ttl
+        self.probe_timeout = probe_timeout
+        self.probe_models = probe_models
+        self.cache_file = cache_file
+        self._entries: Dict[str, Dict] = {}  # cache key -> listed, models, probed, statuses
+        self._lock = threading.Lock()
+        self._refreshing: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+        self._load()
+
+    @property
+    def backend(self):
+        return self._fixed_backend or core.get_backend()
+
+    def _entry(self) -> Dict:
+        return self._entries.setdefault(_cache_key(self.backend), {})
+
+    def _fresh(self, checked: Optional[float]) -> bool:
+        return checked is not None and time.time() - checked < self.ttl
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def _load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, encoding="utf-8") as f:
+                self._entries = json.load(f).get("entries", {})
+        except (OSError, ValueError, AttributeError):
+            self._entries = {}  # A broken cache is rebuilt on the next check
+
+    def _save(self):
+        if not self.cache_file:
+            return
+        try:
+            with self._lock:
+                data = json.dumps({"entries": self._entries}, indent=1)
+            temp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(data + "\n")
+            os.replace(temp_path, self.cache_file)
+        except OSError:
+            pass  # The cache only saves a network round trip
+
+    # ------------------------------------------------------------------
+    # Model list
+    # ------------------------------------------------------------------
+
+    def list_models(self, refresh: bool = False) -> Optional[List[str]]:
+        """Models the backend offers (cached for the TTL); None if it can't list them
+
+        Raises whatever the backend raised, so callers can explain the failure.
+        """
+        backend = self.backend
+        if not hasattr(backend, "list_models"):
+            return None
+        with self._lock:
+            entry = self._entry()
+            if not refresh and self._fresh(entry.get("listed")):
+                return list(entry["models"])
+        models = sorted(backend.list_models())
+        with self._lock:
+            entry = self._entry()
+            entry["listed"], entry["models"] = time.time(), models
+        self._save()
+        return list(models)
+
+    def listed_age(self) -> Optional[float]:
+        """Seconds since the cached model list was fetched"""
+        with self._lock:
+            listed = self._entry().get("listed")
+        return time.time() - listed if listed is not None else None
+
+    # ------------------------------------------------------------------
+    # Probes
+    # ------------------------------------------------------------------
+
+    def _probe_one(self, backend, model: str, results: Dict):
+        start = time.perf_counter()
+        try:
+            backend.generate([{"role": "user", "content": PROBE_PROMPT}], "", model, core.DEFAULT_TEMPERATURE)
+            result = {"status": STATUS_OK}
+        except Exception as e:
+            result = {"status": STATUS_ERROR, "error": str(e)[:200]}
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        results[model] = result
+
+    def probe(self, models: Optional[List[str]] = None, timeout: Optional[float] = None) -> Dict[str, Dict]:
+        """Send every model a test message at once; waits at most `timeout` seconds in total"""
+        backend = self.backend
+        models = list(dict.fromkeys(core.MODELS.values() if models is None else models))
+        timeout = self.probe_timeout if timeout is None else timeout
+        results: Dict[str, Dict] = {}
+        # Daemon threads, not an executor: a hung request must not hold up shutdown
+        threads = [threading.Thread(target=self._probe_one, args=(backend, model, results),
+                                    name=f"textiq-probe-{model}", daemon=True) for model in models]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+        checked = time.time()
+        statuses = {}
+        for model in models:
+            status = dict(results.get(model) or {"status": STATUS_TIMEOUT, "latency_ms": round(timeout * 1000, 1)})
+            status["checked"] = checked
+            statuses[model] = status
+        return statuses
+
+    def refresh(self, force: bool = False, models: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """List (and with probing on, probe) the configured models, unless the cached results are fresh"""
+        with self._lock:
+            entry = self._entry()
+            if not force and self._fresh(entry.get("probed")):
+                return dict(entry["statuses"])
+        models = list(dict.fromkeys(core.MODELS.values() if models is None else models))
+        try:
+            listed = self.list_models(refresh=force)
+            self.last_error = None
+        except Exception as e:
+            listed, self.last_error = None, str(e)[:200]
+
+        statuses = {}
+        checked = time.time()
+        for model in models:
+            if listed is not None and model not in listed:
+                statuses[model] = {"status": STATUS_MISSING, "checked": checked}
+        to_probe = [model for model in models if model not in statuses]
+        if self.probe_models:
+            statuses.update(self.probe(to_probe))
+        else:
+            statuses.update({model: {"status": STATUS_OK if listed is not None else STATUS_UNKNOWN,
+                                     "checked": checked} for model in to_probe})
+        with self._lock:
+            entry = self._entry()
+            entry["probed"], entry["statuses"] = time.time(), statuses
+        self._save()
+        return dict(statuses)
+
+    def refresh_async(self) -> bool:
+        """Refresh in a background thread if the results are stale; True if one is running"""
+        with self._lock:
+            if self._refreshing is not None and self._refreshing.is_alive():
+                return True
+            if self._fresh(self._entry().get("probed")):
+                return False
+            self._refreshing = threading.Thread(target=self._refresh_quietly, name="textiq-model-catalog",
+                                                daemon=True)
+            self._refreshing.start()
+            return True
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            self.last_error = str(e)[:200]
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for a background refresh; True once none is running"""
+        thread = self._refreshing
+        if thread is not None:
+            thread.join(timeout)
+        return thread is None or not thread.is_alive()
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def statuses(self) -> Dict[str, Dict]:
+        """Latest results per model (possibly stale; empty before the first check)"""
+        with self._lock:
+            return dict(self._entry().get("statuses", {}))
+
+    def status(self, model: str) -> str:
+        return self.statuses().get(model, {}).get("status", STATUS_UNKNOWN)
+
+    def available(self, model: str) -> bool:
+        return STATUS_RANK.get(self.status(model), 0) == 0
+
+    def _informative(self, modes: Dict[str, str]) -> bool:
+        # If no model works the check itself is suspect (offline, replaying a cassette)
+        return any(self.available(model) for model in modes.values())
+
+    def ordered_modes(self, modes: Optional[Dict[str, str]] = None) -> List[str]:
+        """Mode names with available models first, otherwise in their configured order"""
+        modes = core.MODELS if modes is None else modes
+        if not self._informative(modes):
+            return list(modes)
+        return sorted(modes, key=lambda mode: STATUS_RANK.get(self.status(modes[mode]), 0))
+
+    def mode_label(self, mode: str, modes: Optional[Dict[str, str]] = None) -> str:
+        """Mode name, marked if its model is unavailable"""
+        modes = core.MODELS if modes is None else modes
+        label = STATUS_LABELS.get(self.status(modes[mode]))
+        return f"{mode} ({label})" if label and self._informative(modes) else mode
+
+    def default_mode(self, modes: Optional[Dict[str, str]] = None) -> str:
+        """DEFAULT_MODE if its model is available, else the first available mode"""
+        modes = core.MODELS if modes is None else modes
+        if core.DEFAULT_MODE in modes and self.available(modes[core.DEFAULT_MODE]):
+            return core.DEFAULT_MODE
+        return self.ordered_modes(modes)[0]
+
+# ============================================================================
+# PROCESS-WIDE CATALOG
+# ============================================================================
+
+_catalog: Optional[ModelCatalog] = None
+_catalog_lock = threading.Lock()
+
+def get_catalog() -> ModelCatalog:
+    """Catalog of the shared backend, for every session in this process"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ModelCatalog()
+        return _catalog
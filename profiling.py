@@ -0,0 +1,294 @@
+"""
+TextIQ - Profiling
+On-demand CPU profiles of a Streamlit rerun or a single chat turn, written
+as pstats and as collapsed stacks for flame graphs
+"""
+
+import os
+import sys
+import time
+import pstats
+import cProfile
+import argparse
+import itertools
+import threading
+from collections import Counter
+from typing import List, Dict, Optional
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# What to profile: "off" (default), "rerun" (whole script runs) or "turn" (the model call of a chat turn)
+PROFILE_MODE = os.getenv("TEXTIQ_PROFILE", "off").lower()
+
+# Profile only 1 in N eligible runs, so it can stay on in production
+PROFILE_EVERY = max(1, int(os.getenv("TEXTIQ_PROFILE_EVERY", "1")))
+
+# "cprofile" (deterministic; every call, some overhead) or "sample" (stack samples; wall-clock, cheap)
+PROFILER = os.getenv("TEXTIQ_PROFILER", "cprofile").lower()
+
+# Sampling profiler interval
+SAMPLE_INTERVAL_MS = float(os.getenv("TEXTIQ_PROFILE_INTERVAL_MS", "5"))
+
+# "1" lets ?profile=rerun or ?profile=turn in the app URL profile that session's runs
+PROFILE_QUERY = os.getenv("TEXTIQ_PROFILE_QUERY", "0").lower() in ("1", "true", "yes")
+
+PROFILE_DIR = os.getenv("TEXTIQ_PROFILE_DIR", "profiles")
+
+# Deepest stack written to the collapsed file
+MAX_STACK_DEPTH = 200
+
+# ============================================================================
+# PROFILES
+# ============================================================================
+
+_counts: Dict[str, int] = {}
+_counts_lock = threading.Lock()
+_sequence = itertools.count(1)
+_active = threading.local()  # One profile per thread; a nested request is covered by the outer one
+
+# Kinds that begin a new run on their thread: a profile still active then was
+# left behind by a run that ended without stopping it (an exception, st.stop())
+_OUTERMOST = ("rerun",)
+
+def _sampled(kind: str) -> bool:
+    with _counts_lock:
+        count = _counts.get(kind, 0)
+        _counts[kind] = count + 1
+    return count % PROFILE_EVERY == 0
+
+def should_profile(kind: str, requested: Optional[str] = None) -> bool:
+    """Whether to profile this run: asked for in the URL, or configured and its turn in 1-in-N"""
+    if getattr(_active, "profile", None) is not None:
+        return False
+    if requested and PROFILE_QUERY:
+        return requested.lower() == kind
+    return PROFILE_MODE == kind and _sampled(kind)
+
+
+class _Sampler:
+    """Records the stack of one thread every few milliseconds from a background thread"""
+
+    def __init__(self, thread_id: int, interval_ms: float):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.samples: Counter = Counter()  # Stack of (file, line, function), root first -> count
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="textiq-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return  # The profiled thread ended without stopping us
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            self.samples[tuple(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def create_stats(self):
+        """pstats-compatible totals, so pstats.Stats() can load the samples"""
+        stats: Dict = {}
+        for stack, count in self.samples.items():
+            seconds = count * self.interval
+            for depth, func in enumerate(stack):
+                if func in stack[:depth]:
+                    continue  # Recursion: count a function once per sample
+                cc, nc, tt, ct, callers = stats.get(func, (0, 0, 0.0, 0.0, {}))
+                if depth:
+                    caller = stack[depth - 1]
+                    edge = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (edge[0] + count, edge[1] + count, edge[2], edge[3] + seconds)
+                stats[func] = (cc + count, nc + count, tt, ct + seconds, callers)
+            if stack:
+                cc, nc, tt, ct, callers = stats[stack[-1]]
+                stats[stack[-1]] = (cc, nc, tt + seconds, ct, callers)
+        self.stats = stats
+
+
+class Profile:
+    """A running profile; stop() writes it to PROFILE_DIR"""
+
+    def __init__(self, kind: str, profiler: str = PROFILER, **tags):
+        self.kind = kind
+        self.profiler = profiler
+        self.tags = dict(tags)
+        self.paths: List[str] = []
+        self._stopped = False
+        if profiler == "sample":
+            self._profiler = _Sampler(threading.get_ident(), SAMPLE_INTERVAL_MS)
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        _active.profile = self
+
+    def tag(self, **tags):
+        """Add tags (session, turn) known only after the profile started"""
+        self.tags.update(tags)
+
+    def _halt(self):
+        if self.profiler == "sample":
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+        self._stopped = True
+        if getattr(_active, "profile", None) is self:
+            _active.profile = None
+
+    def stop(self) -> List[str]:
+        """Stop profiling and write the .pstats and .collapsed files; returns their paths"""
+        if self._stopped:
+            return self.paths
+        self._halt()
+        self.paths = write(self)
+        return self.paths
+
+    def discard(self):
+        """Stop profiling without writing anything"""
+        if not self._stopped:
+            self._halt()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+class _NoopProfile:
+    """Stand-in returned when this run is not profiled"""
+    paths: List[str] = []
+
+    def tag(self, **tags):
+        pass
+
+    def stop(self) -> List[str]:
+        return []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_PROFILE = _NoopProfile()
+
+def _discard_stale(kind: str):
+    active = getattr(_active, "profile", None)
+    if active is not None and kind in _OUTERMOST:
+        active.discard()
+
+def start(kind: str, requested: Optional[str] = None, **tags):
+    """Start profiling this thread if this run should be profiled; stop() the result"""
+    _discard_stale(kind)
+    if not should_profile(kind, requested):
+        return NOOP_PROFILE
+    try:
+        return Profile(kind, **tags)
+    except ValueError:
+        return NOOP_PROFILE  # Another profiler (e.g. a debugger's) already owns this thread
+
+def profile(kind: str, requested: Optional[str] = None, **tags):
+    """Context manager: `with profiling.profile("turn", session=sid, turn=3):`"""
+    return start(kind, requested, **tags)
+
+# ============================================================================
+# OUTPUT
+# ============================================================================
+
+def _label(func: tuple) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name  # Built-in, e.g. <method 'join' of 'str' objects>
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+def collapse_samples(samples: Counter, interval: float) -> Dict[str, int]:
+    """Sampled stacks as collapsed-stack lines weighted in microseconds"""
+    lines: Counter = Counter()
+    for stack, count in samples.items():
+        if stack:
+            lines[";".join(_label(func) for func in stack)] += int(count * interval * 1e6)
+    return dict(lines)
+
+def collapse_stats(stats: Dict) -> Dict[str, int]:
+    """Approximate stacks from cProfile's caller graph, weighted in microseconds
+
+    cProfile keeps caller -> callee totals, not whole stacks, so a function's
+    time is split between its call paths in proportion to each path's share.
+    """
+    callees: Dict[tuple, List] = {}
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for func, entry in stats.items() if not any(caller in stats for caller in entry[4])]
+
+    lines: Counter = Counter()
+    pending = [(root, (), stats[root][3]) for root in roots]
+    while pending:
+        func, path, seconds = pending.pop()
+        ct, tt = stats[func][3], stats[func][2]
+        share = seconds / ct if ct else 0.0
+        path += (func,)
+        own_us = int(tt * share * 1e6)
+        if own_us:
+            lines[";".join(_label(step) for step in path)] += own_us
+        if len(path) >= MAX_STACK_DEPTH:
+            continue
+        for callee, edge_seconds in callees.get(func, ()):
+            if callee not in path and edge_seconds * share >= 1e-6:
+                pending.append((callee, path, edge_seconds * share))
+    return dict(lines)
+
+def write(profile: Profile) -> List[str]:
+    """Write a stopped profile to PROFILE_DIR as <name>.pstats and <name>.collapsed"""
+    session = str(profile.tags.get("session") or "nosession")[:12]
+    turn = profile.tags.get("turn")
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{profile.kind}-{session}"
+    name += (f"-t{turn}" if turn is not None else "") + f"-{next(_sequence)}"
+    base = os.path.join(PROFILE_DIR, name)
+
+    profiler = profile._profiler
+    if profile.profiler == "sample":
+        collapsed = collapse_samples(profiler.samples, profiler.interval)
+    else:
+        profiler.create_stats()
+        collapsed = collapse_stats(profiler.stats)
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        pstats.Stats(profiler).dump_stats(f"{base}.pstats")
+        with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+            for stack, microseconds in sorted(collapsed.items()):
+                f.write(f"{stack} {microseconds}\n")
+    except OSError:
+        return []  # Profiling must never break the run it profiles
+    return [f"{base}.pstats", f"{base}.collapsed"]
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Show the slowest functions in a TextIQ profile")
+    parser.add_argument("file", help=".pstats file written by a profiled run")
+    parser.add_argument("--sort", default="cumulative", help="pstats sort key (default: %(default)s)")
+    parser.add_argument("--limit", type=int, default=25, help="functions to show (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    stats = pstats.Stats(args.file)
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.limit)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,279 @@
+"""
+TextIQ - History Retention
+Count-, size- and age-based eviction of old chats with an optional cold archive
+"""
+
+import os
+import gzip
+import json
+import time
+import threading
+from datetime import datetime
+from collections import Counter, OrderedDict
+from typing import List, Dict, Iterator, Optional, Tuple
+
+import metrics
+import serialization
+import history_store
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Limits (0 = unlimited)
+MAX_CHATS = int(os.getenv("TEXTIQ_RETENTION_MAX_CHATS", "0"))
+MAX_MB = float(os.getenv("TEXTIQ_RETENTION_MAX_MB", "0"))
+MAX_AGE_DAYS = float(os.getenv("TEXTIQ_RETENTION_MAX_AGE_DAYS", "0"))
+
+# Eviction order: "lru" (least recently updated) or "oldest" (created first)
+ORDER = os.getenv("TEXTIQ_RETENTION_ORDER", "lru").lower()
+
+# Append evicted chats to a gzip JSONL cold file instead of dropping them
+ARCHIVE = os.getenv("TEXTIQ_RETENTION_ARCHIVE", "0").lower() in ("1", "true", "yes")
+
+# Seconds between background checks
+CHECK_INTERVAL = 300.0
+
+# How long eviction waits for queued history writes to commit
+FLUSH_TIMEOUT = 30.0
+
+# Chats active this recently are never evicted (they may be open in a session)
+PROTECT_RECENT_SECONDS = 3600
+
+# History files watched by the background thread; the least recently
+# started are dropped past this count or after this long without a session
+MAX_WATCHED = 256
+WATCH_IDLE_SECONDS = 86400
+
+# Format of the app's timestamp/updated fields
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# ============================================================================
+# POLICY
+# ============================================================================
+
+class RetentionPolicy:
+    """Limits a history file is kept within"""
+
+    def __init__(self, max_chats: int = MAX_CHATS, max_bytes: int = int(MAX_MB * 1024 * 1024),
+                 max_age_days: float = MAX_AGE_DAYS, order: str = ORDER, archive: bool = ARCHIVE):
+        if order not in ("lru", "oldest"):
+            raise ValueError(f"Unknown retention order '{order}' (use lru or oldest)")
+        self.max_chats = max_chats
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.order = order
+        self.archive = archive
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_chats or self.max_bytes or self.max_age_days)
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+def archive_path(path: str) -> str:
+    """Cold file evicted chats are appended to"""
+    return os.path.splitext(path)[0] + ".archive.jsonl.gz"
+
+def chat_time(stored: Dict, order: str) -> float:
+    """Eviction sort key: last activity (lru) or creation time; unparseable sorts first"""
+    value = stored.get("timestamp")
+    if order == "lru":
+        value = stored.get("updated") or value
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+def iter_sized_records(path: str) -> Iterator[Tuple[Dict, int]]:
+    """Stored chat records with the bytes each takes in the history file"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        codec = serialization.read_header(f)
+        if codec is None:
+            f.seek(0)
+            for stored in serialization.iter_records(f):
+                yield stored, len(json.dumps(stored))
+            return
+        previous = f.tell()
+        for stored, end in codec.iter_with_offsets(f):
+            yield stored, end - previous
+            previous = end
+
+def blob_bytes(directory: str, digest: str) -> int:
+    """Disk size of one blob"""
+    return sum(
+        os.path.getsize(blob_file)
+        for blob_file in history_store._blob_files(directory, digest)
+        if os.path.exists(blob_file)
+    )
+
+def store_size(path: str) -> int:
+    """Bytes used by a history file and its blob store"""
+    total = os.path.getsize(path) if os.path.exists(path) else 0
+    for root, _, files in os.walk(history_store.blob_dir(path)):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+# ============================================================================
+# EVICTION
+# ============================================================================
+
+def select_evictions(path: str, policy: RetentionPolicy, now: Optional[float] = None) -> List[str]:
+    """Ids of the chats to evict, least recently used (or oldest) first"""
+    now = time.time() if now is None else now
+    entries = [
+        (chat_time(stored, policy.order), stored["id"], size, stored.get("blobs", []))
+        for stored, size in iter_sized_records(path)
+    ]
+    entries.sort()
+    refs = Counter(digest for entry in entries for digest in entry[3])
+    directory = history_store.blob_dir(path)
+
+    count = len(entries)
+    total = store_size(path)
+    age_cutoff = now - policy.max_age_days * 86400
+    evicted = []
+    for when, chat_id, size, blobs in entries:
+        if when >= now - PROTECT_RECENT_SECONDS:
+            break
+        over_limit = (
+            (policy.max_chats and count > policy.max_chats)
+            or (policy.max_bytes and total > policy.max_bytes)
+            or (policy.max_age_days and when < age_cutoff)
+        )
+        if not over_limit:
+            break  # Everything after this is newer
+        evicted.append(chat_id)
+        count -= 1
+        total -= size
+        for digest in blobs:
+            refs[digest] -= 1
+            if refs[digest] == 0:
+                total -= blob_bytes(directory, digest)
+    return evicted
+
+def archive_chats(path: str, chat_ids: List[str]) -> int:
+    """Append chats to the cold archive (one gzip member per call)"""
+    wanted = set(chat_ids)
+    directory = history_store.blob_dir(path)
+    archived = 0
+    with open(archive_path(path), 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            for stored in history_store.iter_stored_records(path):
+                if stored.get("id") in wanted:
+                    chat = history_store.decode_chat(stored, directory)
+                    f.write(json.dumps(chat, ensure_ascii=False).encode("utf-8") + b"\n")
+                    archived += 1
+        raw.flush()
+        os.fsync(raw.fileno())
+    return archived
+
+def enforce(path: str, policy: Optional[RetentionPolicy] = None) -> List[str]:
+    """Evict chats over the policy's limits; returns the evicted ids"""
+    policy = policy or RetentionPolicy()
+    if not policy.enabled or not os.path.exists(path):
+        return []
+
+    # One process enforces at a time; the others skip this round
+    with history_store.file_lock(path + ".retention.lock", blocking=False) as acquired:
+        if not acquired:
+            return []
+        # Queued writes first, so eviction sees (and archives) the latest state
+        history_store.flush(FLUSH_TIMEOUT)
+        chat_ids = select_evictions(path, policy)
+        archived = archive_chats(path, chat_ids) if chat_ids and policy.archive else 0
+        if chat_ids:
+            history_store.delete_chats(path, chat_ids)
+            history_store.flush(FLUSH_TIMEOUT)
+        _record(path, len(chat_ids), archived)
+    return chat_ids
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+_stats_lock = threading.Lock()
+_stats = {"runs": 0, "evicted_chats": 0, "archived_chats": 0, "last_run": None, "last_error": None}
+_store_sizes: Dict[str, Tuple[int, int]] = {}  # path -> (chats, bytes) after the last run
+
+EVICTED = metrics.Counter("textiq_retention_evicted_total", "Chats evicted by the retention policy")
+HISTORY_BYTES = metrics.Gauge("textiq_history_bytes", "Size of the history files and blobs checked by retention")
+
+def _record(path: str, evicted: int, archived: int):
+    chats = sum(1 for _ in history_store.iter_stored_records(path))
+    size = store_size(path)
+    with _stats_lock:
+        _stats["runs"] += 1
+        _stats["evicted_chats"] += evicted
+        _stats["archived_chats"] += archived
+        _stats["last_run"] = time.time()
+        _stats["last_error"] = None
+        _store_sizes[os.path.abspath(path)] = (chats, size)
+        HISTORY_BYTES.set(sum(size for _, size in _store_sizes.values()))
+    if evicted:
+        EVICTED.inc(evicted)
+
+def stats() -> Dict:
+    """Eviction counters and store size as of the last run"""
+    with _stats_lock:
+        result = dict(_stats)
+        result["store_chats"] = sum(chats for chats, _ in _store_sizes.values())
+        result["store_bytes"] = sum(size for _, size in _store_sizes.values())
+    return result
+
+# ============================================================================
+# BACKGROUND ENFORCEMENT
+# ============================================================================
+
+# History files (one per user shard) -> (policy, last started), checked by one thread
+_watched: "OrderedDict[str, Tuple[RetentionPolicy, float]]" = OrderedDict()
+_worker: Optional[threading.Thread] = None
+_workers_lock = threading.Lock()
+
+def _forget(path: str):
+    """Stop watching a history file (caller holds _workers_lock)"""
+    del _watched[path]
+    with _stats_lock:
+        _store_sizes.pop(path, None)
+        HISTORY_BYTES.set(sum(size for _, size in _store_sizes.values()))
+
+def _expire_idle(now: float):
+    """Drop files no session has started within WATCH_IDLE_SECONDS"""
+    with _workers_lock:
+        # Ordered by last start, so the idle ones are at the front
+        while _watched and next(iter(_watched.values()))[1] < now - WATCH_IDLE_SECONDS:
+            _forget(next(iter(_watched)))
+
+def _run():
+    while True:
+        _expire_idle(time.time())
+        with _workers_lock:
+            watched = [(path, policy) for path, (policy, _) in _watched.items()]
+        for path, policy in watched:
+            try:
+                enforce(path, policy)
+            except Exception as e:
+                with _stats_lock:
+                    _stats["last_error"] = str(e)
+        time.sleep(CHECK_INTERVAL)
+
+def start(path: str, policy: Optional[RetentionPolicy] = None) -> bool:
+    """Enforce the policy on a history file from the background thread"""
+    global _worker
+    policy = policy or RetentionPolicy()
+    if not policy.enabled:
+        return False
+    key = os.path.abspath(path)
+    with _workers_lock:
+        _watched[key] = (policy, time.time())
+        _watched.move_to_end(key)
+        while len(_watched) > MAX_WATCHED:
+            _forget(next(iter(_watched)))
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="textiq-retention", daemon=True)
+            _worker.start()
+    return True
@@ -0,0 +1,555 @@
+"""
+TextIQ - Chat History Search
+Incremental inverted index with BM25 ranking and prefix matching
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import bisect
+import shutil
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Dict, Tuple, Optional, Callable
+
+import serialization
+import history_store
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# BM25 tuning
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Title terms are counted this many times so title hits rank higher
+TITLE_BOOST = 3
+
+# Prefix matching: minimum prefix length, max expansions and score weight
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_EXPANSIONS = 50
+PREFIX_WEIGHT = 0.7
+
+# Tokens matching more than this fraction of chats only re-rank other hits
+COMMON_TERM_FRACTION = 0.05
+
+# Journal entries before the snapshot is rewritten (in a background thread)
+COMPACT_AFTER = 500
+
+# Indexes kept in memory at once (one per history shard); the rest reload from disk
+MAX_OPEN_INDEXES = 64
+
+INDEX_VERSION = 3
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase search terms"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def index_paths(history_file: str) -> Tuple[str, str, str]:
+    """Snapshot, journal and previous journal paths stored next to the history file"""
+    base = os.path.splitext(history_file)[0]
+    return base + ".index.json", base + ".index.log", base + ".index.log.prev"
+
+def _file_stamp(path: str) -> Optional[tuple]:
+    """Identity of a file's current contents (changes when it is replaced)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def chat_term_frequencies(chat: Dict) -> Dict[str, int]:
+    """Term frequencies for a chat's title and message contents"""
+    counts = Counter()
+    for term in tokenize(chat.get("title", "")):
+        counts[term] += TITLE_BOOST
+    for message in chat.get("messages", []):
+        counts.update(tokenize(message.get("content", "")))
+    return dict(counts)
+
+def chat_meta(chat: Dict) -> Dict[str, str]:
+    """What a search result shows, so results need no history read"""
+    return {"title": chat.get("title", ""), "timestamp": chat.get("timestamp", "")}
+
+# ============================================================================
+# SEARCH INDEX
+# ============================================================================
+
+class SearchIndex:
+    """Inverted index over saved chats, persisted as snapshot + journal
+
+    Every process using a history file appends to the same journal under a
+    file lock, and replays what the others appended before reading or
+    writing, so each process's copy stays current.
+
+    The snapshot holds each chat's term frequencies. Those dicts are never
+    changed in place, so compaction copies only the top-level dicts under
+    the lock and writes the snapshot from a background thread while
+    commits carry on.
+    """
+
+    def __init__(self, history_file: str):
+        self.snapshot_file, self.journal_file, self.previous_journal_file = index_paths(history_file)
+        self.lock_file = os.path.splitext(history_file)[0] + ".index.lock"
+        self.lock = threading.RLock()
+        self.generation = 0         # Snapshots written so far; the journal header names it
+        self._compacting: Optional[threading.Thread] = None
+        self._reset()
+
+    def _file_lock(self):
+        """Lock shared by every process using this index"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.lock_file)), exist_ok=True)
+        return history_store.file_lock(self.lock_file)
+
+    def _reset(self):
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_len: Dict[str, int] = {}
+        self.doc_tf: Dict[str, Dict[str, int]] = {}  # Replaced, never updated in place
+        self.meta: Dict[str, Dict[str, str]] = {}
+        self.total_len = 0
+        self.terms: List[str] = []
+        self.journal_entries = 0
+        self.journal_offset = 0     # Bytes of the journal applied to this copy
+        self.snapshot_stamp = None  # The snapshot this copy was loaded from
+
+    # ------------------------------------------------------------------
+    # In-memory updates
+    # ------------------------------------------------------------------
+
+    def _apply_add(self, doc_id: str, frequencies: Dict[str, int], meta: Optional[Dict] = None,
+                   keep_sorted: bool = True):
+        self._apply_remove(doc_id)
+        for term, count in frequencies.items():
+            docs = self.postings.get(term)
+            if docs is None:
+                docs = self.postings[term] = {}
+                if keep_sorted:
+                    bisect.insort(self.terms, term)
+            docs[doc_id] = count
+        length = sum(frequencies.values())
+        self.doc_len[doc_id] = length
+        self.doc_tf[doc_id] = frequencies
+        if meta is not None:
+            self.meta[doc_id] = meta
+        self.total_len += length
+
+    def _apply_remove(self, doc_id: str):
+        terms = self.doc_tf.pop(doc_id, None)
+        self.meta.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+                position = bisect.bisect_left(self.terms, term)
+                if position < len(self.terms) and self.terms[position] == term:
+                    del self.terms[position]
+        self.total_len -= self.doc_len.pop(doc_id, 0)
+
+    def add_chat(self, chat: Dict):
+        """Index (or re-index) a chat"""
+        frequencies = chat_term_frequencies(chat)
+        meta = chat_meta(chat)
+        with self.lock, self._file_lock():
+            self._catch_up()
+            self._apply_add(chat["id"], frequencies, meta)
+            self._journal({"op": "add", "id": chat["id"], "tf": frequencies, "meta": meta})
+
+    def remove_chat(self, chat_id: str):
+        """Drop a chat from the index"""
+        with self.lock, self._file_lock():
+            self._catch_up()
+            if chat_id not in self.doc_tf:
+                return
+            self._apply_remove(chat_id)
+            self._journal({"op": "del", "id": chat_id})
+
+    def rebuild(self, chats: List[Dict]):
+        """Rebuild the whole index from a list of chats"""
+        with self.lock, self._file_lock():
+            self._reset()
+            for chat in chats:
+                self._apply_add(chat["id"], chat_term_frequencies(chat), chat_meta(chat), keep_sorted=False)
+            self.terms = sorted(self.postings)
+            self._save()
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def _expand(self, token: str) -> List[Tuple[str, float]]:
+        """Index terms matching a query token, with their weight"""
+        matches = []
+        if token in self.postings:
+            matches.append((token, 1.0))
+        if len(token) < MIN_PREFIX_LENGTH:
+            return matches
+
+        candidates = []
+        position = bisect.bisect_left(self.terms, token)
+        while position < len(self.terms) and self.terms[position].startswith(token):
+            term = self.terms[position]
+            if term != token:
+                candidates.append(term)
+            position += 1
+
+        if len(candidates) > MAX_PREFIX_EXPANSIONS:
+            candidates = heapq.nlargest(
+                MAX_PREFIX_EXPANSIONS, candidates, key=lambda t: len(self.postings[t])
+            )
+        matches.extend((term, PREFIX_WEIGHT) for term in candidates)
+        return matches
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[str, float]]:
+        """Return (chat_id, score) pairs, best match first"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        with self.lock:
+            doc_count = len(self.doc_len)
+            if doc_count == 0:
+                return []
+            avg_len = self.total_len / doc_count
+            scores: Dict[str, float] = {}
+
+            # Score rare tokens first; very common tokens then only re-rank
+            # chats the rarer ones already matched instead of scanning everything
+            expanded = [self._expand(token) for token in tokens]
+            expanded.sort(key=lambda matches: sum(len(self.postings[t]) for t, _ in matches))
+
+            # BM25 term score: factor * tf / (tf + base + per_len * doc_len)
+            base = BM25_K1 * (1 - BM25_B)
+            per_len = BM25_K1 * BM25_B / avg_len
+            doc_len = self.doc_len
+
+            for matches in expanded:
+                common = bool(scores) and (
+                    sum(len(self.postings[t]) for t, _ in matches) > COMMON_TERM_FRACTION * doc_count
+                )
+                # One matching term (the usual case) adds straight into the scores
+                best: Dict[str, float] = scores if len(matches) == 1 else {}
+                for term, weight in matches:
+                    docs = self.postings[term]
+                    df = len(docs)
+                    factor = weight * math.log(1 + (doc_count - df + 0.5) / (df + 0.5)) * (BM25_K1 + 1)
+                    if common:
+                        hits = [(doc_id, docs[doc_id]) for doc_id in scores if doc_id in docs]
+                    else:
+                        hits = docs.items()
+                    if best is scores:
+                        get = scores.get
+                        for doc_id, tf in hits:
+                            scores[doc_id] = get(doc_id, 0.0) + factor * tf / (tf + base + per_len * doc_len[doc_id])
+                        continue
+                    for doc_id, tf in hits:
+                        score = factor * tf / (tf + base + per_len * doc_len[doc_id])
+                        if score > best.get(doc_id, 0.0):
+                            best[doc_id] = score
+                if best is not scores:
+                    for doc_id, score in best.items():
+                        scores[doc_id] = scores.get(doc_id, 0.0) + score
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def search_chats(self, query: str, limit: int = 20) -> List[Dict]:
+        """Matching chats' id, title and timestamp, best match first"""
+        results = self.search(query, limit)
+        with self.lock:
+            return [dict({"title": "", "timestamp": ""}, **self.meta.get(doc_id, {}), id=doc_id)
+                    for doc_id, _ in results]
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def _journal(self, entry: Dict):
+        """Append an entry (caller holds the file lock and has caught up)"""
+        try:
+            with open(self.journal_file, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+            self.journal_offset = _file_size(self.journal_file)
+            self.journal_entries += 1
+            if self.journal_entries >= COMPACT_AFTER:
+                self._compact_soon()
+        except OSError:
+            pass
+
+    def _write_snapshot(self, docs: Dict, meta: Dict, generation: int) -> str:
+        """Write a snapshot to a temporary file; returns its path"""
+        snapshot = {"version": INDEX_VERSION, "generation": generation, "docs": docs, "meta": meta}
+        os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_file)), exist_ok=True)
+        tmp_file = f"{self.snapshot_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(serialization.dumps_document(snapshot))
+        return tmp_file
+
+    def _install(self, tmp_file: str, generation: int, compacted_from: Optional[int]):
+        """Swap in a written snapshot (caller holds both locks and has caught up)
+
+        The snapshot covers the journal up to compacted_from; the entries
+        after it stay in the new journal, behind a header that lets other
+        processes on the previous snapshot keep their copy instead of
+        reloading. None means the snapshot replaces everything (a rebuild).
+        """
+        tail = b""
+        if compacted_from is not None and os.path.exists(self.journal_file):
+            with open(self.journal_file, 'rb') as f:
+                f.seek(compacted_from)
+                tail = f.read(self.journal_offset - compacted_from)
+            # Kept for processes that had not replayed up to compacted_from yet
+            shutil.copyfile(self.journal_file, self.previous_journal_file)
+        header = (json.dumps({"op": "compacted", "generation": generation, "from": compacted_from}) + "\n").encode()
+        # Snapshot first: if we stop in between, the old journal replays
+        # harmlessly over the new snapshot (the last entry per chat wins)
+        os.replace(tmp_file, self.snapshot_file)
+        journal_tmp = f"{self.journal_file}.{os.getpid()}.tmp"
+        with open(journal_tmp, 'wb') as f:
+            f.write(header + tail)
+        os.replace(journal_tmp, self.journal_file)
+        self.snapshot_stamp = _file_stamp(self.snapshot_file)
+        self.generation = generation
+        self.journal_offset = len(header) + len(tail)
+        self.journal_entries = tail.count(b"\n")
+
+    def _save(self, compacted_from: Optional[int] = None):
+        tmp_file = self._write_snapshot(self.doc_tf, self.meta, self.generation + 1)
+        self._install(tmp_file, self.generation + 1, compacted_from)
+
+    def save(self):
+        """Write a snapshot and truncate the journal, keeping what other processes journaled"""
+        with self.lock, self._file_lock():
+            self._catch_up()
+            self._save(self.journal_offset)
+
+    def _compact_soon(self):
+        """Start a background compaction unless one is running (caller holds the lock)"""
+        if self._compacting is not None and self._compacting.is_alive():
+            return
+        self._compacting = threading.Thread(target=self._compact, name="textiq-index-compact", daemon=True)
+        self._compacting.start()
+
+    def _compact(self):
+        """Write a snapshot without holding the locks while it is serialized"""
+        tmp_file = None
+        try:
+            with self.lock, self._file_lock():
+                if not self._catch_up():
+                    return
+                docs, meta = dict(self.doc_tf), dict(self.meta)
+                stamp, generation, offset = self.snapshot_stamp, self.generation, self.journal_offset
+            tmp_file = self._write_snapshot(docs, meta, generation + 1)
+            with self.lock, self._file_lock():
+                # Rebuilt, invalidated or compacted by another process meanwhile
+                if not self._catch_up() or self.snapshot_stamp != stamp:
+                    return
+                self._install(tmp_file, generation + 1, offset)
+                tmp_file = None
+        except OSError:
+            pass
+        finally:
+            if tmp_file is not None:
+                try:
+                    os.remove(tmp_file)
+                except OSError:
+                    pass
+
+    def wait_compacted(self, timeout: Optional[float] = None) -> bool:
+        """Wait for a background compaction; True once none is running"""
+        thread = self._compacting
+        if thread is not None:
+            thread.join(timeout)
+        return thread is None or not thread.is_alive()
+
+    def _replay(self, journal_file: Optional[str] = None, end: Optional[int] = None):
+        """Apply journal entries past journal_offset (up to byte `end`, if given)"""
+        with open(journal_file or self.journal_file, 'rb') as f:
+            f.seek(self.journal_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Torn write at the end of the journal; read it once complete
+                if end is not None and self.journal_offset >= end:
+                    break
+                self.journal_offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry["op"] == "add":
+                    self._apply_add(entry["id"], entry["tf"], entry.get("meta"))
+                elif entry["op"] == "del":
+                    self._apply_remove(entry["id"])
+                else:
+                    continue  # The header naming the snapshot
+                self.journal_entries += 1
+
+    def _load(self) -> bool:
+        if not os.path.exists(self.snapshot_file) and not os.path.exists(self.journal_file):
+            return False
+        self._reset()
+        if os.path.exists(self.snapshot_file):
+            stamp = _file_stamp(self.snapshot_file)
+            with open(self.snapshot_file, 'rb') as f:
+                snapshot = serialization.loads_document(f.read())
+            if snapshot.get("version") != INDEX_VERSION:
+                return False
+            meta = snapshot.get("meta", {})
+            for doc_id, frequencies in snapshot["docs"].items():
+                self._apply_add(doc_id, frequencies, meta.get(doc_id), keep_sorted=False)
+            self.terms = sorted(self.postings)
+            self.generation = snapshot.get("generation", 0)
+            self.snapshot_stamp = stamp
+        if os.path.exists(self.journal_file):
+            self._replay()
+        return True
+
+    def load(self) -> bool:
+        """Load snapshot and replay journal; False if nothing on disk"""
+        with self.lock, self._file_lock():
+            return self._load()
+
+    def _changed_on_disk(self) -> bool:
+        return (_file_stamp(self.snapshot_file) != self.snapshot_stamp
+                or _file_size(self.journal_file) != self.journal_offset)
+
+    def _catch_up(self) -> bool:
+        """Apply what other processes wrote since we last read (caller holds the file lock)
+
+        A snapshot rewritten by another process means the journal was
+        compacted under us, so the index is reloaded. False if the files
+        are gone or unreadable and the index must be rebuilt.
+        """
+        if not self._changed_on_disk():
+            return True
+        stamp = _file_stamp(self.snapshot_file)
+        if stamp is None and self.snapshot_stamp is not None:
+            return False  # Invalidated, e.g. after an import
+        try:
+            if stamp != self.snapshot_stamp:
+                try:
+                    followed = self._follow_compaction(stamp)
+                except (OSError, ValueError, KeyError):
+                    followed = False
+                if not followed:
+                    return self._load()
+            elif _file_size(self.journal_file) < self.journal_offset:
+                return self._load()
+            self._replay()
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def _follow_compaction(self, stamp: Optional[tuple]) -> bool:
+        """Keep this copy across another process's compaction of the snapshot we loaded
+
+        That snapshot plus the journal we replayed is still current; we
+        finish the old journal from its saved copy and move our position
+        into the new one. False if it was a rebuild or more than one
+        snapshot ago, which needs a full reload.
+        """
+        with open(self.journal_file, 'rb') as f:
+            line = f.readline()
+        if not line.endswith(b"\n"):
+            return False
+        header = json.loads(line)
+        compacted_from = header.get("from")
+        if header.get("op") != "compacted" or header.get("generation") != self.generation + 1 \
+                or compacted_from is None:
+            return False
+        if self.journal_offset < compacted_from:
+            with open(self.previous_journal_file, 'rb') as f:
+                first = f.readline()
+            previous = json.loads(first) if first.endswith(b"\n") else {}
+            # A journal without a header predates the first snapshot
+            if (previous.get("generation", 0) if previous.get("op") == "compacted" else 0) != self.generation:
+                return False
+            self._replay(self.previous_journal_file, compacted_from)
+            if self.journal_offset != compacted_from:
+                return False
+        self.journal_offset = len(line) + self.journal_offset - compacted_from
+        self.journal_entries = 0
+        self.generation += 1
+        self.snapshot_stamp = stamp
+        return True
+
+    def refresh(self) -> bool:
+        """Pick up other processes' changes; False if the index must be rebuilt"""
+        with self.lock:
+            if not self._changed_on_disk():
+                return True  # Two stats: cheap enough to check on every query
+            with self._file_lock():
+                return self._catch_up()
+
+# ============================================================================
+# PROCESS-WIDE REGISTRY
+# ============================================================================
+
+_indexes: "OrderedDict[str, SearchIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def get_index(history_file: str, loader: Optional[Callable[[], List[Dict]]] = None) -> SearchIndex:
+    """Get the shared index for a history file, building it on first use"""
+    key = os.path.abspath(history_file)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            # Other processes (replicas, `textiq.py import`) may have changed it
+            if not index.refresh() and loader is not None:
+                index.rebuild(loader())
+        else:
+            index = SearchIndex(history_file)
+            try:
+                loaded = index.load()
+            except (OSError, ValueError, KeyError):
+                loaded = False
+            if not loaded and loader is not None:
+                index.rebuild(loader())
+            _indexes[key] = index
+            # Least recently used indexes are dropped; their snapshot and
+            # journal on disk are already complete
+            while len(_indexes) > MAX_OPEN_INDEXES:
+                _indexes.popitem(last=False)
+        return index
+
+def on_commit(history_file: str, mutations: List[Dict], changed: Dict[str, Optional[Dict]]):
+    """History store listener: apply committed upserts and deletes"""
+    index = get_index(history_file, loader=lambda: history_store.read_history_file(history_file))
+    for chat_id, chat in changed.items():
+        if chat is None:
+            index.remove_chat(chat_id)
+        else:
+            index.add_chat(chat)
+
+def invalidate(history_file: str):
+    """Drop the index so it is rebuilt from the history file on next use"""
+    with _indexes_lock:
+        _indexes.pop(os.path.abspath(history_file), None)
+        with SearchIndex(history_file)._file_lock():
+            for path in index_paths(history_file):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
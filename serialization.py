@@ -0,0 +1,173 @@
+"""
+TextIQ - Serialization Codecs
+orjson or msgpack when installed, stdlib json otherwise
+"""
+
+import os
+import json
+from typing import Any, Iterable, Iterator, BinaryIO, Optional, Tuple
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Codec for new files: "auto" picks the fastest installed one
+DEFAULT_CODEC = os.getenv("TEXTIQ_CODEC", "auto").lower()
+
+# Preference order for "auto"
+CODEC_PREFERENCE = ["orjson", "msgpack", "json"]
+
+# File header: b"TEXTIQ <version> <codec>\n"
+HEADER_MAGIC = b"TEXTIQ "
+FORMAT_VERSION = 2
+
+# ============================================================================
+# CODECS
+# ============================================================================
+
+class JsonCodec:
+    """Stdlib json, compact, one record per line"""
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def write_records(self, f: BinaryIO, records: Iterable[Any]):
+        for record in records:
+            f.write(self.dumps(record))
+            f.write(b"\n")
+
+    def iter_records(self, f: BinaryIO) -> Iterator[Any]:
+        for record, _ in self.iter_with_offsets(f):
+            yield record
+
+    def iter_with_offsets(self, f: BinaryIO) -> Iterator[Tuple[Any, int]]:
+        offset = f.tell()
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # torn or in-progress append at the end of the file
+            offset += len(line)
+            if line.strip():
+                yield self.loads(line), offset
+
+
+class OrjsonCodec(JsonCodec):
+    """orjson, compact, one record per line"""
+    name = "orjson"
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec:
+    """msgpack, records back to back (self-delimiting)"""
+    name = "msgpack"
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+    def write_records(self, f: BinaryIO, records: Iterable[Any]):
+        packer = msgpack.Packer(use_bin_type=True)
+        for record in records:
+            f.write(packer.pack(record))
+
+    def iter_records(self, f: BinaryIO) -> Iterator[Any]:
+        # A truncated record at the end of the file is silently left unread
+        yield from msgpack.Unpacker(f, raw=False)
+
+    def iter_with_offsets(self, f: BinaryIO) -> Iterator[Tuple[Any, int]]:
+        start = f.tell()
+        unpacker = msgpack.Unpacker(f, raw=False)
+        for record in unpacker:
+            yield record, start + unpacker.tell()
+
+
+CODECS = {"json": JsonCodec()}
+if ORJSON_AVAILABLE:
+    CODECS["orjson"] = OrjsonCodec()
+if MSGPACK_AVAILABLE:
+    CODECS["msgpack"] = MsgpackCodec()
+
+INSTALL_HINTS = {"orjson": "pip install orjson", "msgpack": "pip install msgpack"}
+
+def get_codec(name: Optional[str] = None):
+    """Codec by name; "auto" (default) picks the fastest installed one"""
+    name = (name or DEFAULT_CODEC).lower()
+    if name == "auto":
+        return next(CODECS[n] for n in CODEC_PREFERENCE if n in CODECS)
+    if name not in CODECS:
+        hint = INSTALL_HINTS.get(name)
+        raise ValueError(f"Codec '{name}' is not available" + (f": {hint}" if hint else ""))
+    return CODECS[name]
+
+# ============================================================================
+# FILE FORMAT
+# ============================================================================
+
+def header_bytes(codec) -> bytes:
+    """Header line recording format version and codec"""
+    return HEADER_MAGIC + f"{FORMAT_VERSION} {codec.name}\n".encode("ascii")
+
+def parse_header(line: bytes):
+    """Codec named in a header line (without the magic)"""
+    version, name = line.decode("ascii").split()
+    if int(version) > FORMAT_VERSION:
+        raise ValueError(f"File format {version} is newer than this TextIQ supports")
+    return get_codec(name)
+
+def write_records(f: BinaryIO, records: Iterable[Any], codec=None):
+    """Write a header followed by records"""
+    codec = codec or get_codec()
+    f.write(header_bytes(codec))
+    codec.write_records(f, records)
+
+def read_header(f: BinaryIO):
+    """Codec of a headered file positioned after the header, None for empty or legacy files"""
+    if f.read(len(HEADER_MAGIC)) != HEADER_MAGIC:
+        return None
+    return parse_header(f.readline())
+
+def iter_records(f: BinaryIO) -> Iterator[Any]:
+    """Stream records from a file; legacy (headerless) files hold one JSON list"""
+    magic = f.read(len(HEADER_MAGIC))
+    if not magic:
+        return
+    if magic != HEADER_MAGIC:
+        f.seek(0)
+        yield from json.load(f)
+        return
+    codec = parse_header(f.readline())
+    yield from codec.iter_records(f)
+
+def dumps_document(obj: Any, codec=None) -> bytes:
+    """Header plus a single encoded object"""
+    codec = codec or get_codec()
+    return header_bytes(codec) + codec.dumps(obj)
+
+def loads_document(data: bytes) -> Any:
+    """Decode dumps_document() output, or legacy plain JSON"""
+    if not data.startswith(HEADER_MAGIC):
+        return json.loads(data)
+    header, _, payload = data[len(HEADER_MAGIC):].partition(b"\n")
+    return parse_header(header).loads(payload)
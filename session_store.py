@@ -0,0 +1,402 @@
+"""
+TextIQ - Session State Store
+Persists conversations and settings outside the Streamlit process
+"""
+
+import os
+import time
+import sqlite3
+import threading
+import importlib.util
+from contextlib import contextmanager
+from typing import Any, List, Dict, Optional
+
+import core
+import serialization
+
+# redis-py is only imported when the redis store is used
+REDIS_AVAILABLE = importlib.util.find_spec("redis") is not None
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# "sqlite" (default), "redis", "memory" (this process only) or "none"
+SESSION_STORE = os.getenv("TEXTIQ_SESSION_STORE", "sqlite").lower()
+
+# SQLite database shared by every app process on this machine (default:
+# textiq_sessions.db next to the chat history file)
+SESSION_DB = os.getenv("TEXTIQ_SESSION_DB", "")
+SESSION_DB_NAME = "textiq_sessions.db"
+
+# Redis server shared by every replica (used when SESSION_STORE is "redis")
+REDIS_URL = os.getenv("TEXTIQ_SESSION_REDIS_URL", "redis://localhost:6379/0")
+
+# Idle sessions are forgotten after this many seconds
+SESSION_TTL = int(os.getenv("TEXTIQ_SESSION_TTL", str(7 * 24 * 3600)))
+
+# Session state keys persisted besides the messages
+PERSISTED_KEYS = ("system_prompt", "selected_model", "temperature", "chat_id", "saved_count")
+
+KEY_PREFIX = "textiq:session:"
+
+# Expired SQLite keys are purged after this many expire() calls
+PURGE_EVERY = 100
+
+# ============================================================================
+# REDIS-COMPATIBLE BACKENDS
+# ============================================================================
+
+class Pipeline:
+    """Commands queued and run as one transaction, like redis-py's pipeline()"""
+
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name: str):
+        def queue(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self) -> List[Any]:
+        with self._client._atomic():
+            results = [getattr(self._client, name)(*args, **kwargs) for name, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+
+class FakeRedis:
+    """In-memory stand-in for the subset of redis-py the store uses"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._hashes: Dict[str, Dict[bytes, bytes]] = {}
+        self._lists: Dict[str, List[bytes]] = {}
+        self._expires: Dict[str, float] = {}
+
+    def _alive(self, key: str) -> bool:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.time():
+            self._hashes.pop(key, None)
+            self._lists.pop(key, None)
+            self._expires.pop(key, None)
+            return False
+        return True
+
+    def hset(self, name: str, mapping: Dict[str, bytes]) -> int:
+        with self._lock:
+            self._alive(name)
+            fields = self._hashes.setdefault(name, {})
+            added = sum(1 for field in mapping if field.encode() not in fields)
+            fields.update((field.encode(), value) for field, value in mapping.items())
+            return added
+
+    def hgetall(self, name: str) -> Dict[bytes, bytes]:
+        with self._lock:
+            return dict(self._hashes.get(name, {})) if self._alive(name) else {}
+
+    def rpush(self, name: str, *values: bytes) -> int:
+        with self._lock:
+            self._alive(name)
+            items = self._lists.setdefault(name, [])
+            items.extend(values)
+            return len(items)
+
+    def lrange(self, name: str, start: int, end: int) -> List[bytes]:
+        with self._lock:
+            items = self._lists.get(name, []) if self._alive(name) else []
+            return items[start:None if end == -1 else end + 1]
+
+    def llen(self, name: str) -> int:
+        with self._lock:
+            return len(self._lists.get(name, [])) if self._alive(name) else 0
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            deleted = 0
+            for name in names:
+                found = self._hashes.pop(name, None) is not None
+                found = (self._lists.pop(name, None) is not None) or found
+                self._expires.pop(name, None)
+                deleted += found
+            return deleted
+
+    def expire(self, name: str, seconds: int) -> bool:
+        with self._lock:
+            if name not in self._hashes and name not in self._lists:
+                return False
+            self._expires[name] = time.time() + seconds
+            return True
+
+    def _atomic(self):
+        return self._lock
+
+    def pipeline(self) -> Pipeline:
+        return Pipeline(self)
+
+
+class SQLiteRedis:
+    """The same subset of redis-py on a local SQLite file (safe across processes)"""
+
+    def __init__(self, path: str):
+        self._lock = threading.RLock()
+        self._in_transaction = False
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS hashes (key TEXT, field TEXT, value BLOB, PRIMARY KEY (key, field)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS lists (key TEXT, idx INTEGER, value BLOB, PRIMARY KEY (key, idx)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS expiry (key TEXT PRIMARY KEY, expires REAL) WITHOUT ROWID;
+        """)
+        self._expire_calls = 0
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE so concurrent processes serialize their writes
+
+        Nested use (a pipeline's commands) joins the outer transaction.
+        """
+        if self._in_transaction:
+            yield self._conn
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._in_transaction = True
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        else:
+            self._conn.execute("COMMIT")
+        finally:
+            self._in_transaction = False
+
+    @contextmanager
+    def _atomic(self):
+        with self._lock, self._transaction():
+            yield
+
+    def pipeline(self) -> Pipeline:
+        return Pipeline(self)
+
+    def _drop_if_expired(self, conn, name: str) -> bool:
+        row = conn.execute("SELECT expires FROM expiry WHERE key = ?", (name,)).fetchone()
+        if row is None or row[0] > time.time():
+            return False
+        for table in ("hashes", "lists", "expiry"):
+            conn.execute(f"DELETE FROM {table} WHERE key = ?", (name,))
+        return True
+
+    def hset(self, name: str, mapping: Dict[str, bytes]) -> int:
+        with self._lock, self._transaction() as conn:
+            self._drop_if_expired(conn, name)
+            existing = {row[0] for row in conn.execute("SELECT field FROM hashes WHERE key = ?", (name,))}
+            conn.executemany(
+                "INSERT OR REPLACE INTO hashes (key, field, value) VALUES (?, ?, ?)",
+                [(name, field, value) for field, value in mapping.items()]
+            )
+            return sum(1 for field in mapping if field not in existing)
+
+    def hgetall(self, name: str) -> Dict[bytes, bytes]:
+        with self._lock, self._transaction() as conn:
+            if self._drop_if_expired(conn, name):
+                return {}
+            rows = conn.execute("SELECT field, value FROM hashes WHERE key = ?", (name,))
+            return {field.encode(): bytes(value) for field, value in rows}
+
+    def rpush(self, name: str, *values: bytes) -> int:
+        with self._lock, self._transaction() as conn:
+            self._drop_if_expired(conn, name)
+            length = conn.execute("SELECT COUNT(*) FROM lists WHERE key = ?", (name,)).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO lists (key, idx, value) VALUES (?, ?, ?)",
+                [(name, length + n, value) for n, value in enumerate(values)]
+            )
+            return length + len(values)
+
+    def lrange(self, name: str, start: int, end: int) -> List[bytes]:
+        with self._lock, self._transaction() as conn:
+            if self._drop_if_expired(conn, name):
+                return []
+            length = conn.execute("SELECT COUNT(*) FROM lists WHERE key = ?", (name,)).fetchone()[0]
+            start = max(start + length if start < 0 else start, 0)
+            end = end + length if end < 0 else min(end, length - 1)
+            rows = conn.execute(
+                "SELECT value FROM lists WHERE key = ? AND idx BETWEEN ? AND ? ORDER BY idx",
+                (name, start, end)
+            )
+            return [bytes(row[0]) for row in rows]
+
+    def llen(self, name: str) -> int:
+        with self._lock, self._transaction() as conn:
+            if self._drop_if_expired(conn, name):
+                return 0
+            return conn.execute("SELECT COUNT(*) FROM lists WHERE key = ?", (name,)).fetchone()[0]
+
+    def delete(self, *names: str) -> int:
+        with self._lock, self._transaction() as conn:
+            deleted = 0
+            for name in names:
+                found = 0
+                for table in ("hashes", "lists"):
+                    found += conn.execute(f"DELETE FROM {table} WHERE key = ?", (name,)).rowcount
+                conn.execute("DELETE FROM expiry WHERE key = ?", (name,))
+                deleted += bool(found)
+            return deleted
+
+    def expire(self, name: str, seconds: int) -> bool:
+        with self._lock, self._transaction() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM hashes WHERE key = ? UNION ALL SELECT 1 FROM lists WHERE key = ? LIMIT 1",
+                (name, name)
+            ).fetchone()
+            if exists is None:
+                return False
+            conn.execute("INSERT OR REPLACE INTO expiry (key, expires) VALUES (?, ?)", (name, time.time() + seconds))
+            self._expire_calls += 1
+            if self._expire_calls % PURGE_EVERY == 0:
+                self._purge(conn)
+            return True
+
+    def _purge(self, conn):
+        expired = "SELECT key FROM expiry WHERE expires <= ?"
+        now = time.time()
+        for table in ("hashes", "lists"):
+            conn.execute(f"DELETE FROM {table} WHERE key IN ({expired})", (now,))
+        conn.execute("DELETE FROM expiry WHERE expires <= ?", (now,))
+
+# ============================================================================
+# SESSION STORE
+# ============================================================================
+
+class SessionStore:
+    """Snapshots session state to a Redis-compatible client, writing only deltas"""
+
+    def __init__(self, client, codec=None):
+        self.client = client
+        self.codec = codec or serialization.get_codec()
+        self.saves = 0
+        self.full_writes = 0
+        self.messages_written = 0
+        self.restores = 0
+
+    def _keys(self, session_id: str):
+        return KEY_PREFIX + session_id, KEY_PREFIX + session_id + ":messages"
+
+    def load(self, session_id: str, owner: str = "") -> Optional[Dict[str, Any]]:
+        """Session state saved under this id by this owner, or None if unknown, expired or someone else's"""
+        state_key, messages_key = self._keys(session_id)
+        stored, stored_messages = self.client.pipeline().hgetall(state_key).lrange(messages_key, 0, -1).execute()
+        fields = {
+            (name.decode() if isinstance(name, bytes) else name): value
+            for name, value in stored.items()
+        }
+        if not fields or fields.pop("owner", b"").decode() != owner:
+            return None
+        codec = serialization.get_codec(fields.pop("codec", b"json").decode())
+        state = {name: codec.loads(value) for name, value in fields.items() if name in PERSISTED_KEYS}
+        state["messages"] = [codec.loads(value) for value in stored_messages]
+        state["session_synced"] = {
+            "codec": codec.name,
+            "chat_id": state.get("chat_id"),
+            "count": len(state["messages"]),
+            "fields": {name: state[name] for name in PERSISTED_KEYS if name in state},
+        }
+        self.restores += 1
+        return state
+
+    def save(self, session_id: str, state, owner: str = "") -> int:
+        """Write what changed since the last save; returns the number of values written
+
+        The writes go out as one transaction (Redis MULTI/EXEC, one SQLite
+        transaction), so a crash or a concurrent rerun can't leave settings
+        and messages that don't belong together.
+        """
+        state_key, messages_key = self._keys(session_id)
+        synced = state.get("session_synced")
+        messages = state.get("messages", [])
+        pipe = self.client.pipeline()
+
+        # A different chat (or a shorter one) replaces the stored messages;
+        # otherwise only the messages added this turn are appended
+        full_write = (synced is None or synced["chat_id"] != state.get("chat_id")
+                      or len(messages) < synced["count"] or synced["codec"] != self.codec.name)
+        if full_write:
+            synced = {"codec": self.codec.name, "chat_id": state.get("chat_id"), "count": 0, "fields": {}}
+            pipe.delete(state_key, messages_key)
+        codec = serialization.get_codec(synced["codec"])
+
+        changed = {
+            name: state[name] for name in PERSISTED_KEYS
+            if name in state and synced["fields"].get(name, object()) != state[name]
+        }
+        new_messages = messages[synced["count"]:]
+        if not changed and not new_messages:
+            return 0
+
+        mapping = {name: codec.dumps(value) for name, value in changed.items()}
+        mapping["codec"] = codec.name.encode()
+        mapping["owner"] = owner.encode()
+        pipe.hset(state_key, mapping=mapping)
+        if new_messages:
+            pipe.rpush(messages_key, *(codec.dumps(message) for message in new_messages))
+        pipe.expire(state_key, SESSION_TTL)
+        pipe.expire(messages_key, SESSION_TTL)
+        pipe.execute()
+
+        if full_write:
+            self.full_writes += 1
+        synced["fields"].update(changed)
+        synced["count"] = len(messages)
+        state["session_synced"] = synced
+        self.saves += 1
+        self.messages_written += len(new_messages)
+        return len(changed) + len(new_messages)
+
+    def stats(self) -> Dict:
+        """Write and restore counters"""
+        return {
+            "saves": self.saves,
+            "full_writes": self.full_writes,
+            "messages_written": self.messages_written,
+            "restores": self.restores,
+        }
+
+# ============================================================================
+# PROCESS-WIDE STORE
+# ============================================================================
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+def session_db_path() -> str:
+    """SQLite database path: TEXTIQ_SESSION_DB, or beside the chat history"""
+    if SESSION_DB:
+        return SESSION_DB
+    return os.path.join(os.path.dirname(os.path.abspath(core.CHAT_HISTORY_FILE)), SESSION_DB_NAME)
+
+def create_client(kind: str = SESSION_STORE):
+    """Redis-compatible client for a store kind"""
+    if kind == "sqlite":
+        return SQLiteRedis(session_db_path())
+    if kind == "memory":
+        return FakeRedis()
+    if kind == "redis":
+        if not REDIS_AVAILABLE:
+            raise ValueError("Session store 'redis' needs the redis package: pip install redis")
+        import redis
+        return redis.Redis.from_url(REDIS_URL)
+    raise ValueError(f"Unknown session store '{kind}' (use sqlite, redis, memory or none)")
+
+def get_store() -> Optional[SessionStore]:
+    """Shared session store, or None when persistence is off"""
+    global _store
+    if SESSION_STORE == "none":
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore(create_client())
+        return _store
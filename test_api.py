@@ -45,12 +45,13 @@ print("\n3. Testing API connection...")
 try:
     genai.configure(api_key=api_key)
     
-    # Try listing models
+    # Always list models live (this is the connection test); the app's
+    # cached list in textiq_models.json is updated with the result
+    import core
+    import model_catalog
+    catalog = model_catalog.ModelCatalog(core.GeminiBackend(api_key))
     print("   Attempting to list available models...")
-    models = []
-    for m in genai.list_models():
-        if 'generateContent' in m.supported_generation_methods:
-            models.append(m.name)
+    models = catalog.list_models(refresh=True)
     
     if models:
         print(f"   ✅ SUCCESS! Found {len(models)} models")
@@ -82,8 +83,10 @@ except Exception as e:
 # Test actual generation
 print("\n4. Testing message generation...")
 try:
-    # Use first available model
-    model_name = models[0].replace("models/", "")
+    # Use the app's own model (default mode first) if the key can use it;
+    # the listed models are sorted by name, so the first is an arbitrary pick
+    configured = [core.MODELS[core.DEFAULT_MODE]] + list(core.MODELS.values())
+    model_name = next((name for name in configured if name in models), models[0])
     model = genai.GenerativeModel(model_name)
     
     print(f"   Using model: {model_name}")
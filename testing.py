@@ -5,6 +5,11 @@ Comprehensive test suite matching all app.py features
 
 import os
 import json
+import time
+import tempfile
+import threading
+import multiprocessing
+import uuid
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -40,6 +45,37 @@ DEFAULT_SYSTEM_PROMPT = """You are TextIQ, an intelligent AI assistant. You prov
 accurate, and helpful responses. You are professional, friendly, and always aim to assist users 
 in the best way possible."""
 
+# The API tests replay tests.cassette.json by default, so the suite runs
+# offline (see cassettes.py). TEXTIQ_TEST_CASSETTE_MODE=record refreshes the
+# cassette from Gemini; an empty TEXTIQ_TEST_CASSETTE calls the API directly
+TEST_CASSETTE = os.getenv("TEXTIQ_TEST_CASSETTE",
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests.cassette.json"))
+TEST_CASSETTE_MODE = os.getenv("TEXTIQ_TEST_CASSETTE_MODE", "replay").lower()
+
+_cassette_backend = None
+
+def cassette_backend():
+    """Record/replay backend for the API tests, or None to call Gemini directly"""
+    global _cassette_backend
+    if TEST_CASSETTE and _cassette_backend is None:
+        import core
+        import cassettes
+        if TEST_CASSETTE_MODE == "record":
+            _cassette_backend = cassettes.RecordingBackend(core.GeminiBackend(GEMINI_API_KEY), TEST_CASSETTE)
+        else:
+            _cassette_backend = cassettes.ReplayBackend(TEST_CASSETTE)
+    return _cassette_backend
+
+def ask_model(model_name, prompt, generation_config):
+    """Reply text for one prompt, through the cassette when TEXTIQ_TEST_CASSETTE is set"""
+    backend = cassette_backend()
+    if backend is None:
+        model = genai.GenerativeModel(model_name)
+        response = model.generate_content(prompt, generation_config=generation_config)
+        return response.text if response else ""
+    return backend.generate([{"role": "user", "content": prompt}], "", model_name,
+                            generation_config.get("temperature", 0.7))
+
 # ============================================================================
 # TEST FUNCTIONS
 # ============================================================================
@@ -107,35 +143,42 @@ def test_api_connection():
     """Test Google Gemini API connectivity with actual models from app.py"""
     print("\nTesting Google Gemini API connection...")
     
-    if not GEMINI_API_KEY:
+    replaying = TEST_CASSETTE and TEST_CASSETTE_MODE != "record"
+    if replaying:
+        print(f"Replaying recorded responses from {TEST_CASSETTE}")
+    
+    if not replaying and not GEMINI_API_KEY:
         print("❌ SKIP: API key not configured")
         return False
     
-    if not GEMINI_AVAILABLE:
+    if not replaying and not GEMINI_AVAILABLE:
         print("❌ FAIL: google-generativeai package not installed")
         return False
     
     try:
-        print("Configuring Gemini API...")
-        genai.configure(api_key=GEMINI_API_KEY)
+        if not replaying:
+            print("Configuring Gemini API...")
+            genai.configure(api_key=GEMINI_API_KEY)
         
         # Test with Fast Mode model (same as app.py)
         test_model = MODELS["Fast Mode"]
         print(f"Creating test model ({test_model})...")
-        model = genai.GenerativeModel(test_model)
         
         print("Sending test request...")
-        response = model.generate_content(
+        start = time.perf_counter()
+        text = ask_model(
+            test_model,
             "Say 'Hello, test successful!' in one sentence.",
             generation_config={
                 "temperature": 0.7,
                 "max_output_tokens": 50,
             }
         )
+        elapsed_ms = (time.perf_counter() - start) * 1000
         
-        if response and response.text:
-            print("✓ PASS: API connection successful")
-            print(f"   Sample response: {response.text[:80]}...")
+        if text:
+            print(f"✓ PASS: API connection successful ({elapsed_ms:.0f} ms)")
+            print(f"   Sample response: {text[:80]}...")
             return True
         else:
             print("⚠️  WARNING: API responded but no text received")
@@ -166,8 +209,9 @@ def test_chat_history_system():
     try:
         # Test data matching app.py structure
         test_chat = {
-            "id": datetime.now().strftime("%Y%m%d_%H%M%S"),
+            "id": uuid.uuid4().hex,
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "title": "Test chat for verification",
             "messages": [
                 {"role": "user", "content": "Test message 1"},
@@ -213,12 +257,17 @@ def test_session_state_structure():
     # Expected session state keys from app.py
     expected_keys = [
         "messages",
+        "chat_id",
+        "saved_count",
+        "history_file",
+        "session_id",
         "system_prompt", 
         "selected_model",
         "temperature",
         "dark_mode",
         "show_settings",
-        "show_history"
+        "show_history",
+        "show_earlier"
     ]
     
     print("Expected session state keys from app.py:")
@@ -233,31 +282,36 @@ def test_models_from_app():
     """Test all three models defined in app.py"""
     print("\nTesting all models from app.py...")
     
-    if not GEMINI_API_KEY or not GEMINI_AVAILABLE:
+    replaying = TEST_CASSETTE and TEST_CASSETTE_MODE != "record"
+    if not replaying and (not GEMINI_API_KEY or not GEMINI_AVAILABLE):
         print("❌ SKIP: API not configured")
         return False
     
     try:
-        genai.configure(api_key=GEMINI_API_KEY)
+        import core
+        import model_catalog
+        
+        # Every model at once: the check takes as long as the slowest one
+        backend = cassette_backend() or core.GeminiBackend(GEMINI_API_KEY)
+        catalog = model_catalog.ModelCatalog(backend, cache_file=None)
+        start = time.perf_counter()
+        statuses = catalog.probe(list(MODELS.values()), timeout=60)
+        total_ms = (time.perf_counter() - start) * 1000
         
         results = {}
         for mode_name, model_name in MODELS.items():
-            try:
-                model = genai.GenerativeModel(model_name)
-                # Quick test
-                response = model.generate_content(
-                    "Hi",
-                    generation_config={"max_output_tokens": 10}
-                )
-                if response and response.text:
-                    print(f"✓ {mode_name} ({model_name}) - Working")
-                    results[mode_name] = True
-                else:
-                    print(f"⚠️  {mode_name} ({model_name}) - No response")
-                    results[mode_name] = False
-            except Exception as e:
-                print(f"❌ {mode_name} ({model_name}) - Error: {str(e)[:50]}")
+            status = statuses[model_name]
+            if status["status"] == model_catalog.STATUS_OK:
+                print(f"✓ {mode_name} ({model_name}) - Working ({status['latency_ms']:.0f} ms)")
+                results[mode_name] = True
+            elif status["status"] == model_catalog.STATUS_TIMEOUT:
+                print(f"⚠️  {mode_name} ({model_name}) - No response")
                 results[mode_name] = False
+            else:
+                print(f"❌ {mode_name} ({model_name}) - Error: {status['error'][:50]}")
+                results[mode_name] = False
+        print(f"   Probed in {total_ms:.0f} ms "
+              f"(one at a time: {sum(status['latency_ms'] for status in statuses.values()):.0f} ms)")
         
         working_count = sum(results.values())
         total_count = len(results)
@@ -359,6 +413,1856 @@ def test_system_prompt():
         return False
 
 
+def test_search_index():
+    """Test chat history search index (ranking, prefix match, persistence)"""
+    print("\nTesting chat history search index...")
+    
+    try:
+        import search_index
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            history_file = os.path.join(tmp, "chat_history.json")
+            index = search_index.SearchIndex(history_file)
+            index.add_chat({"id": "a", "title": "Python decorators", "messages": [
+                {"role": "user", "content": "How do decorators work in Python?"}]})
+            index.add_chat({"id": "b", "title": "Trip planning", "messages": [
+                {"role": "user", "content": "Plan a trip to Paris with a python course"}]})
+            index.add_chat({"id": "c", "title": "Recipes", "messages": [
+                {"role": "user", "content": "Vegan pasta recipes"}]})
+            
+            if [doc for doc, _ in index.search("python")] != ["a", "b"]:
+                print("❌ FAIL: Ranking does not favour the title match")
+                return False
+            print("✓ BM25 ranking works")
+            
+            if [doc for doc, _ in index.search("deco")] != ["a"]:
+                print("❌ FAIL: Prefix query did not match")
+                return False
+            print("✓ Prefix matching works")
+            
+            index.remove_chat("a")
+            if [doc for doc, _ in index.search("python")] != ["b"]:
+                print("❌ FAIL: Deleted chat still returned")
+                return False
+            print("✓ Delete updates the index")
+            
+            reloaded = search_index.SearchIndex(history_file)
+            if not reloaded.load() or reloaded.search("python") != index.search("python"):
+                print("❌ FAIL: Index did not survive a reload")
+                return False
+            print("✓ Snapshot + journal reload works")
+            
+            # Two processes sharing one history: each sees the other's commits
+            shared_file = os.path.join(tmp, "shared_history.json")
+            first, second = search_index.SearchIndex(shared_file), search_index.SearchIndex(shared_file)
+            first.add_chat({"id": "x", "title": "Kafka tuning", "timestamp": "2024-01-01 10:00", "messages": []})
+            second.add_chat({"id": "y", "title": "Kafka consumers", "messages": []})
+            first.save()  # Compacts; must keep the entry the other process appended
+            second.add_chat({"id": "z", "title": "Kafka streams", "messages": []})
+            first.refresh()
+            fresh = search_index.SearchIndex(shared_file)
+            fresh.load()
+            if {doc for doc, _ in first.search("kafka")} != {"x", "y", "z"} or \
+                    {doc for doc, _ in fresh.search("kafka")} != {"x", "y", "z"}:
+                print("❌ FAIL: Another process's index changes were lost or not picked up")
+                return False
+            results = first.search_chats("tuning")
+            if results != [{"id": "x", "title": "Kafka tuning", "timestamp": "2024-01-01 10:00"}]:
+                print(f"❌ FAIL: Search results without their titles: {results}")
+                return False
+            print("✓ Index changes from other processes are replayed; results carry titles")
+            
+            # Query latency on a large synthetic history
+            words = [f"word{i}" for i in range(5000)]
+            chats = []
+            for i in range(20000):
+                content = " ".join(words[(i * 7 + j * 13) % len(words)] for j in range(40))
+                chats.append({"id": str(i), "title": f"Chat {i} {words[i % len(words)]}",
+                              "messages": [{"role": "user", "content": content}]})
+            index.rebuild(chats)
+            
+            timings = []
+            for query in ["word42", "word1", "word7 word99", "chat 123", "wo"]:
+                start = time.perf_counter()
+                index.search(query)
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"✓ {len(chats)} chats indexed, slowest query {max(timings):.1f} ms")
+            
+            # Compaction runs off the committing thread; another process's copy
+            # follows it without reloading the snapshot
+            follower = search_index.SearchIndex(history_file)
+            follower.load()
+            reloads = []
+            load = follower._load
+            follower._load = lambda: reloads.append(1) or load()
+            generation = index.generation
+            start = time.perf_counter()
+            for i in range(search_index.COMPACT_AFTER):
+                index.add_chat({"id": f"new{i}", "title": f"Compaction {i}", "messages": []})
+            commit_ms = (time.perf_counter() - start) * 1000
+            if index.generation != generation or not index.wait_compacted(timeout=120):
+                print("❌ FAIL: Snapshot rewritten on the committing thread")
+                return False
+            index.add_chat({"id": "late", "title": "Compaction late", "messages": []})
+            follower.refresh()
+            found = {doc for doc, _ in follower.search("compaction", limit=1000)}
+            if index.generation != generation + 1 or reloads or len(found) != search_index.COMPACT_AFTER + 1:
+                print(f"❌ FAIL: Compaction not followed ({len(reloads)} reloads, {len(found)} chats found)")
+                return False
+            print(f"✓ {search_index.COMPACT_AFTER} commits in {commit_ms:.0f} ms while the snapshot is "
+                  f"compacted in the background; other copies follow without reloading")
+        
+        print("✓ PASS: Search index works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_history_store():
+    """Test write-behind history store (group commit, read-your-writes)"""
+    print("\nTesting write-behind history store...")
+    
+    try:
+        import history_store
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            history_file = os.path.join(tmp, "chat_history.json")
+            sessions, turns = 8, 25
+            
+            def session(n):
+                chat = {"id": f"chat{n}", "timestamp": "now", "updated": "now", "title": f"Chat {n}"}
+                for turn in range(turns):
+                    history_store.upsert_chat(history_file, chat, turn * 2, [
+                        {"role": "user", "content": f"q{turn}"},
+                        {"role": "assistant", "content": f"a{turn}"}
+                    ])
+            
+            before = history_store.stats()
+            start = time.perf_counter()
+            threads = [threading.Thread(target=session, args=(n,)) for n in range(sessions)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            queued_ms = (time.perf_counter() - start) * 1000
+            
+            history_store.delete_chat(history_file, "chat0")
+            visible = {chat["id"]: len(chat["messages"]) for chat in history_store.load_chats(history_file)}
+            if "chat0" in visible or any(count != turns * 2 for count in visible.values()):
+                print("❌ FAIL: Queued writes not visible to readers")
+                return False
+            print(f"✓ {sessions * turns} mutations queued in {queued_ms:.1f} ms (read-your-writes OK)")
+            
+            if not history_store.flush(timeout=10):
+                print("❌ FAIL: Writer did not flush")
+                return False
+            on_disk = {chat["id"]: len(chat["messages"])
+                       for chat in history_store.read_history_file(history_file, strict=True)}
+            if on_disk != visible:
+                print("❌ FAIL: File contents differ from queued writes")
+                return False
+            
+            after = history_store.stats()
+            commits = after["commits"] - before["commits"]
+            mutations = after["mutations"] - before["mutations"]
+            print(f"✓ {mutations} mutations written in {commits} group commit(s)")
+        
+        print("✓ PASS: Write-behind history store works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def _stress_writer(history_file, worker, chats_per_worker, ready):
+    """Stress test worker process: one committed upsert per chat"""
+    import history_store
+    ready.wait()
+    for i in range(chats_per_worker):
+        chat = {"id": f"w{worker}-{i}", "timestamp": "now", "updated": "now", "title": f"Worker {worker} chat {i}"}
+        history_store.upsert_chat(history_file, chat, 0, [
+            {"role": "user", "content": f"question {worker}/{i}"},
+            {"role": "assistant", "content": f"answer {worker}/{i}"}
+        ])
+        history_store.flush()
+
+
+def test_history_stress(workers=4, chats_per_worker=50):
+    """Test concurrent writer processes sharing one history file"""
+    print("\nTesting multi-process history writes...")
+    
+    try:
+        import history_store
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            history_file = os.path.join(tmp, "chat_history.json")
+            context = multiprocessing.get_context("spawn")
+            ready = context.Barrier(workers + 1)
+            processes = [
+                context.Process(target=_stress_writer, args=(history_file, n, chats_per_worker, ready))
+                for n in range(workers)
+            ]
+            
+            # Start the clock once every worker has finished importing
+            for process in processes:
+                process.start()
+            ready.wait()
+            start = time.perf_counter()
+            for process in processes:
+                process.join()
+            elapsed = time.perf_counter() - start
+            
+            chats = history_store.read_history_file(history_file, strict=True)
+            
+            expected = workers * chats_per_worker
+            by_id = {chat["id"]: chat for chat in chats}
+            corrupted = [
+                chat_id for chat_id, chat in by_id.items()
+                if [m["content"] for m in chat["messages"]] != [
+                    f"question {chat_id[1:].replace('-', '/')}", f"answer {chat_id[1:].replace('-', '/')}"]
+            ]
+            lost = expected - len(by_id)
+            
+            print(f"   {workers} processes x {chats_per_worker} committed writes")
+            print(f"   Lost chats: {lost}, corrupted chats: {len(corrupted)}")
+            print(f"   Throughput: {expected / elapsed:.0f} commits/sec ({elapsed:.2f}s total)")
+            
+            if lost or corrupted or len(chats) != expected:
+                print("❌ FAIL: Concurrent writers lost or corrupted chats")
+                return False
+        
+        print("✓ PASS: No lost or corrupted chats across processes")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_history_compression():
+    """Test compressed chat payloads (format marker, transparent load)"""
+    print("\nTesting history compression...")
+    
+    try:
+        import history_store
+        import serialization
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            history_file = os.path.join(tmp, "chat_history.json")
+            long_chat = {"id": "long", "timestamp": "now", "title": "Long chat", "messages": [
+                {"role": "user", "content": "Explain compression " * 50},
+                {"role": "assistant", "content": "Compression removes redundancy. " * 50}
+            ]}
+            short_chat = {"id": "short", "timestamp": "now", "title": "Hi", "messages": [
+                {"role": "user", "content": "Hi"}
+            ]}
+            
+            history_store.write_history_file(history_file, [long_chat, short_chat], compression="zlib")
+            with open(history_file, 'rb') as f:
+                stored = {chat["id"]: chat for chat in serialization.iter_records(f)}
+            
+            if stored["long"].get("format") != history_store.PAYLOAD_FORMAT or "messages" in stored["long"]:
+                print("❌ FAIL: Long chat not stored compressed")
+                return False
+            if "payload" in stored["short"]:
+                print("❌ FAIL: Tiny chat should stay uncompressed")
+                return False
+            print("✓ Compressed entries carry a format marker")
+            
+            if history_store.read_history_file(history_file, strict=True) != [long_chat, short_chat]:
+                print("❌ FAIL: Round trip changed the chats")
+                return False
+            print("✓ Mixed compressed/plain history loads transparently")
+            
+            stored["long"]["compression"] = "brotli"
+            with open(history_file, 'wb') as f:
+                serialization.write_records(f, list(stored.values()))
+            try:
+                history_store.read_history_file(history_file, strict=True)
+                print("❌ FAIL: Unknown compression was not reported")
+                return False
+            except ValueError:
+                print("✓ Unreadable entries block commits instead of being dropped")
+        
+        print("✓ PASS: History compression works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_serialization_codecs():
+    """Test history codecs (header, round trip, legacy files)"""
+    print("\nTesting serialization codecs...")
+    
+    try:
+        import history_store
+        import serialization
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        chats = [{"id": str(n), "timestamp": "now", "title": f"Chat {n} ünïcode",
+                  "messages": [{"role": "user", "content": f"line one\nline two {n}"}]} for n in range(3)]
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            history_file = os.path.join(tmp, "chat_history.json")
+            
+            for name in serialization.CODECS:
+                history_store.write_history_file(history_file, chats, codec=name)
+                with open(history_file, 'rb') as f:
+                    header = f.readline()
+                if header != serialization.HEADER_MAGIC + f"{serialization.FORMAT_VERSION} {name}\n".encode():
+                    print(f"❌ FAIL: {name} header not recorded")
+                    return False
+                if history_store.read_history_file(history_file, strict=True) != chats:
+                    print(f"❌ FAIL: {name} round trip changed the chats")
+                    return False
+                print(f"✓ {name} codec round trip OK")
+            
+            # Files written before codecs existed: indented JSON list, no header
+            with open(history_file, 'w') as f:
+                json.dump(chats, f, indent=2)
+            if history_store.read_history_file(history_file, strict=True) != chats:
+                print("❌ FAIL: Legacy history file not readable")
+                return False
+            print("✓ Legacy indent=2 JSON history still readable")
+        
+        print(f"✓ PASS: Serialization codecs work (default: {serialization.get_codec().name})")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_blob_dedup():
+    """Test content-addressed message storage and blob cleanup"""
+    print("\nTesting message deduplication...")
+    
+    try:
+        import history_store
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            history_file = os.path.join(tmp, "chat_history.json")
+            document = "Pasted document line with plenty of detail.\n" * 200
+            
+            for chat_id in ("a", "b"):
+                chat = {"id": chat_id, "timestamp": "now", "updated": "now", "title": f"Chat {chat_id}"}
+                history_store.upsert_chat(history_file, chat, 0, [
+                    {"role": "user", "content": f"Summarize this ({chat_id}):"},
+                    {"role": "user", "content": document}
+                ])
+            history_store.flush(timeout=10)
+            
+            stats = history_store.dedup_stats(history_file)
+            if stats["blobs"] != 1 or stats["references"] != 2:
+                print(f"❌ FAIL: Expected 1 blob with 2 references, got {stats}")
+                return False
+            print(f"✓ Duplicate body stored once ({stats['dedup_ratio']:.1f}x, "
+                  f"{stats['bytes_saved']} bytes saved)")
+            
+            chats = {chat["id"]: chat for chat in history_store.read_history_file(history_file, strict=True)}
+            if chats["a"]["messages"][1]["content"] != document or "blobs" in chats["a"]:
+                print("❌ FAIL: Blob reference not resolved on load")
+                return False
+            print("✓ References resolve transparently on load")
+            
+            blob_files = lambda: [f for _, _, files in os.walk(history_store.blob_dir(history_file)) for f in files]
+            history_store.delete_chat(history_file, "a")
+            history_store.flush(timeout=10)
+            if len(blob_files()) != 1:
+                print("❌ FAIL: Blob removed while still referenced")
+                return False
+            history_store.delete_chat(history_file, "b")
+            history_store.flush(timeout=10)
+            if blob_files():
+                print("❌ FAIL: Unreferenced blob not cleaned up")
+                return False
+            print("✓ Blob deleted with its last reference")
+        
+        print("✓ PASS: Message deduplication works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_export_import():
+    """Test streaming JSONL export/import and the append commit path"""
+    print("\nTesting history export/import...")
+    
+    try:
+        import io
+        import history_store
+        import serialization
+        import textiq
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "source.json")
+            target = os.path.join(tmp, "target.json")
+            chats = [
+                {"id": f"chat-{n}", "timestamp": "now", "updated": "now", "title": f"Chat {n}",
+                 "messages": [{"role": "user", "content": f"Question {n}"},
+                              {"role": "assistant", "content": f"Answer {n}"}]}
+                for n in range(25)
+            ]
+            history_store.write_history_file(source, chats)
+            
+            exported = io.StringIO()
+            count = textiq.export_chats(source, exported, quiet=True)
+            if count != 25 or len(exported.getvalue().splitlines()) != 25:
+                print(f"❌ FAIL: Expected 25 exported lines, got {count}")
+                return False
+            print("✓ Export writes one JSON line per chat")
+            
+            exported.seek(0)
+            textiq.import_chats(target, exported, batch_size=10, quiet=True)
+            if history_store.read_history_file(target, strict=True) != chats:
+                print("❌ FAIL: Imported history differs from the export")
+                return False
+            print("✓ Import round-trips in batched commits")
+            
+            # Re-importing is idempotent; a torn tail from a crash is ignored and replaced
+            exported.seek(0)
+            textiq.import_chats(target, exported, batch_size=10, quiet=True)
+            with open(target, 'ab') as f:
+                f.write(serialization.get_codec().dumps({"id": "torn", "title": "Torn"})[:-4])
+            if len(history_store.read_history_file(target, strict=True)) != 25:
+                print("❌ FAIL: Torn record at the end of the file was not ignored")
+                return False
+            textiq.import_chats(target, io.StringIO('{"messages": [{"role": "user", "content": "Hi"}]}\n'), quiet=True)
+            if len(history_store.read_history_file(target, strict=True)) != 26:
+                print("❌ FAIL: New chat not appended after a torn record")
+                return False
+            print("✓ Re-import is idempotent and torn appends are recovered")
+            
+            try:
+                textiq.import_chats(target, io.StringIO('{"title": "no messages"}\n'), quiet=True)
+                print("❌ FAIL: Malformed line accepted")
+                return False
+            except ValueError:
+                print("✓ Malformed input rejected")
+        
+        print("✓ PASS: Export/import works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_retention():
+    """Test retention limits, eviction order and the cold archive"""
+    print("\nTesting history retention...")
+    
+    try:
+        import gzip
+        import metrics
+        import history_store
+        import retention
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            history_file = os.path.join(tmp, "chat_history.json")
+            now = time.time()
+            stamp = lambda days: time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now - days * 86400))
+            chats = [
+                {"id": f"chat-{days}", "timestamp": stamp(100), "updated": stamp(days), "title": f"{days} days",
+                 "messages": [{"role": "user", "content": f"Message from {days} days ago"}]}
+                for days in range(30)
+            ]
+            history_store.write_history_file(history_file, chats)
+            
+            evicted = retention.enforce(history_file, retention.RetentionPolicy(max_chats=10, archive=True))
+            remaining = {chat["id"] for chat in history_store.read_history_file(history_file, strict=True)}
+            if len(evicted) != 20 or remaining != {f"chat-{days}" for days in range(10)}:
+                print(f"❌ FAIL: Expected the 20 least recently used chats evicted, kept {sorted(remaining)}")
+                return False
+            print("✓ Count limit evicts least recently used chats first")
+            
+            with gzip.open(retention.archive_path(history_file), 'rt', encoding='utf-8') as f:
+                archived = [json.loads(line) for line in f]
+            if sorted(archived, key=lambda chat: chat["id"]) != sorted(chats[10:], key=lambda chat: chat["id"]):
+                print("❌ FAIL: Evicted chats missing from the archive")
+                return False
+            print("✓ Evicted chats archived to the compressed cold file")
+            
+            evicted = retention.enforce(history_file, retention.RetentionPolicy(max_age_days=5))
+            if len(evicted) != 5:
+                print(f"❌ FAIL: Expected 5 chats over the age limit, evicted {len(evicted)}")
+                return False
+            evicted = retention.enforce(history_file, retention.RetentionPolicy(max_chats=1))
+            if "chat-0" in evicted or len(evicted) != 4:
+                print("❌ FAIL: Recently active chat was evicted")
+                return False
+            print("✓ Age limit applied; recently active chats are protected")
+            
+            stats = retention.stats()
+            if stats["evicted_chats"] < 29 or stats["store_chats"] < 1 or not stats["store_bytes"]:
+                print(f"❌ FAIL: Unexpected metrics {stats}")
+                return False
+            print(f"✓ Metrics: {stats['evicted_chats']} evicted, {stats['store_bytes']} bytes in store")
+            
+            exported = metrics.render()
+            if (retention.EVICTED.value() < 29 or retention.HISTORY_BYTES.value() != stats["store_bytes"]
+                    or "textiq_retention_evicted_total" not in exported or "textiq_history_bytes" not in exported):
+                print("❌ FAIL: Retention metrics not exported")
+                return False
+            print("✓ Evictions and history bytes exported as Prometheus metrics")
+            
+            saved = retention.MAX_WATCHED, dict(retention._watched)
+            retention.MAX_WATCHED = 2
+            try:
+                policy = retention.RetentionPolicy(max_chats=1000)
+                for shard in ("a", "b", "c"):
+                    retention.start(os.path.join(tmp, f"{shard}.json"), policy)
+                watched = [os.path.basename(path) for path in retention._watched]
+                retention._expire_idle(time.time() + retention.WATCH_IDLE_SECONDS + 1)
+                expired = len(retention._watched)
+            finally:
+                retention.MAX_WATCHED = saved[0]
+                retention._watched.update(saved[1])
+            if watched != ["b.json", "c.json"] or expired:
+                print(f"❌ FAIL: Watched files not bounded ({watched}, {expired} left after idle expiry)")
+                return False
+            print("✓ Watched history files bounded and expired when idle")
+        
+        print("✓ PASS: History retention works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_history_shards():
+    """Test per-user history shards are isolated"""
+    print("\nTesting per-user history shards...")
+    
+    try:
+        import history_store
+        import search_index
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            history_file = os.path.join(tmp, "chat_history.json")
+            alice = history_store.shard_path(history_file, "email:alice@example.com")
+            bob = history_store.shard_path(history_file, "uid:" + uuid.uuid4().hex)
+            if alice == bob or alice != history_store.shard_path(history_file, "email:alice@example.com"):
+                print("❌ FAIL: Shard paths are not stable and distinct per user")
+                return False
+            if ".." in os.path.relpath(history_store.shard_path(history_file, "../../etc"), tmp):
+                print("❌ FAIL: User identity escaped the shard directory")
+                return False
+            print("✓ Each user maps to a stable, safe shard path")
+            
+            for path, owner in ((alice, "alice"), (bob, "bob")):
+                chat = {"id": uuid.uuid4().hex, "timestamp": "now", "updated": "now", "title": f"{owner} chat"}
+                history_store.upsert_chat(path, chat, 0, [{"role": "user", "content": f"Private note from {owner}"}])
+            history_store.flush(timeout=10)
+            
+            titles = [chat["title"] for chat in history_store.load_chats(alice)]
+            if titles != ["alice chat"] or os.path.exists(history_file):
+                print(f"❌ FAIL: Alice sees {titles}")
+                return False
+            print("✓ Users only see their own chats")
+            
+            index = lambda path: search_index.get_index(path, loader=lambda: history_store.read_history_file(path))
+            if index(bob).search("alice") or not index(alice).search("alice"):
+                print("❌ FAIL: Search index shared between users")
+                return False
+            if not os.path.exists(alice + ".lock") or os.path.dirname(alice) == os.path.dirname(bob):
+                print("❌ FAIL: Shards do not have their own directory and lock")
+                return False
+            print("✓ Each shard has its own directory, lock and search index")
+        
+        print("✓ PASS: Per-user history shards work")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_session_store():
+    """Test session state snapshots, delta writes and rehydration"""
+    print("\nTesting session state store...")
+    
+    try:
+        import session_store
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        import core
+        previous_file = core.CHAT_HISTORY_FILE
+        with tempfile.TemporaryDirectory() as tmp:
+            core.CHAT_HISTORY_FILE = os.path.join(tmp, "data", "chat_history.json")
+            try:
+                db_path = session_store.session_db_path()
+            finally:
+                core.CHAT_HISTORY_FILE = previous_file
+            if not session_store.SESSION_DB and db_path != os.path.join(tmp, "data", "textiq_sessions.db"):
+                print(f"❌ FAIL: Session database not next to the chat history: {db_path}")
+                return False
+            print("✓ Session database kept next to the chat history")
+            
+            backends = {
+                "FakeRedis": session_store.FakeRedis(),
+                "SQLite": session_store.SQLiteRedis(os.path.join(tmp, "sessions.db")),
+            }
+            for name, client in backends.items():
+                store = session_store.SessionStore(client)
+                state = {
+                    "messages": [{"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Hi!"}],
+                    "chat_id": "chat-1", "saved_count": 2, "system_prompt": DEFAULT_SYSTEM_PROMPT,
+                    "selected_model": "Fast Mode", "temperature": 0.7, "dark_mode": True
+                }
+                store.save("session-1", state)
+                
+                # Next turn: only the new messages and the changed setting are written
+                state["messages"].append({"role": "user", "content": "Another question"})
+                state["temperature"] = 1.0
+                written = store.save("session-1", state)
+                if written != 2 or store.save("session-1", state) != 0:
+                    print(f"❌ FAIL: {name} wrote {written} values for a one-message, one-setting turn")
+                    return False
+                
+                restored = store.load("session-1")
+                expected = {key: state[key] for key in session_store.PERSISTED_KEYS}
+                if (restored["messages"] != state["messages"] or "dark_mode" in restored
+                        or {key: restored[key] for key in session_store.PERSISTED_KEYS} != expected):
+                    print(f"❌ FAIL: {name} restored a different session")
+                    return False
+                
+                # Switching chats replaces the stored messages
+                restored.update(chat_id="chat-2", messages=[{"role": "user", "content": "New chat"}])
+                store.save("session-1", restored)
+                if store.load("session-1")["messages"] != restored["messages"] or store.load("unknown") is not None:
+                    print(f"❌ FAIL: {name} kept messages from the previous chat")
+                    return False
+                
+                client.expire(session_store.KEY_PREFIX + "session-1", 0)
+                if store.load("session-1") is not None:
+                    print(f"❌ FAIL: {name} restored an expired session")
+                    return False
+                print(f"✓ {name}: delta writes, rehydration, chat switch and expiry")
+                
+                # A session is only restored for the user who saved it
+                store.save("session-2", dict(state, session_synced=None), owner="email:a@example.com")
+                if store.load("session-2", owner="email:b@example.com") is not None or \
+                        store.load("session-2") is not None or store.load("session-2", owner="email:a@example.com") is None:
+                    print(f"❌ FAIL: {name} restored a session for another user")
+                    return False
+                
+                # Readers never see one chat's settings with another chat's messages
+                writer_state = {}
+                mismatched = []
+                done = threading.Event()
+                
+                def switch_chats():
+                    for n in range(100):
+                        chat_id = f"chat-{n}"
+                        writer_state.update(chat_id=chat_id, messages=[
+                            {"role": "user", "content": chat_id} for _ in range(1 + n % 3)])
+                        store.save("session-3", writer_state)
+                    done.set()
+                
+                writer = threading.Thread(target=switch_chats)
+                writer.start()
+                while not done.is_set():
+                    loaded = store.load("session-3")
+                    if loaded and any(message["content"] != loaded["chat_id"] for message in loaded["messages"]):
+                        mismatched.append(loaded["chat_id"])
+                writer.join()
+                if mismatched:
+                    print(f"❌ FAIL: {name} restored {len(mismatched)} half-written sessions")
+                    return False
+                print(f"✓ {name}: sessions bound to their user; each save is one transaction")
+            
+            # A failed SQLite pipeline leaves nothing behind
+            client = backends["SQLite"]
+            try:
+                client.pipeline().hset("half", mapping={"a": b"1"}).no_such_command().execute()
+            except AttributeError:
+                pass
+            if client.hgetall("half"):
+                print("❌ FAIL: Failed SQLite transaction was partly committed")
+                return False
+            print("✓ A failed SQLite transaction is rolled back")
+        
+        print("✓ PASS: Session state store works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_message_window():
+    """Test the bounded message window spills to disk and pages back in"""
+    print("\nTesting bounded message window...")
+    
+    try:
+        import gc
+        import message_window
+        from message_window import MessageWindow
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        messages = [
+            {"role": "user" if n % 2 == 0 else "assistant", "content": f"Message {n}: " + "detail " * 100}
+            for n in range(60)
+        ]
+        messages[7]["metrics"] = {"latency_ms": 812}
+        window = MessageWindow(messages, max_bytes=8 * 1024)
+        
+        if window.spilled_count == 0 or window.memory_bytes() > 12 * 1024:
+            print(f"❌ FAIL: Window not bounded ({window.memory_bytes()} bytes in memory)")
+            return False
+        print(f"✓ {window.spilled_count} of {len(window)} messages spilled, "
+              f"{window.memory_bytes() / 1024:.1f} KB in memory")
+        
+        if (window != messages or window[7] != messages[7] or window[-1] != messages[-1]
+                or window[10:20] != messages[10:20] or window[:-1] != messages[:-1]):
+            print("❌ FAIL: Paged messages differ from the originals")
+            return False
+        print("✓ Indexing, slicing and iteration page spilled messages back in")
+        
+        window.append({"role": "user", "content": "One more"})
+        if len(window) != 61 or window[-1]["content"] != "One more":
+            print("❌ FAIL: Append after spilling failed")
+            return False
+        
+        stats = message_window.stats()
+        if stats["messages_spilled"] < window.spilled_count or stats["page_ins"] == 0:
+            print(f"❌ FAIL: Unexpected metrics {stats}")
+            return False
+        print(f"✓ Metrics: {stats['sessions']} sessions, {stats['memory_bytes']} bytes in memory")
+        
+        spill_file = window._spill_path
+        del window
+        gc.collect()
+        if os.path.exists(spill_file):
+            print("❌ FAIL: Spill file left behind after the session ended")
+            return False
+        print("✓ Spill file removed with the session")
+        
+        print("✓ PASS: Bounded message window works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_api_server():
+    """Test the HTTP API server (completions, SSE streaming, keep-alive, history)"""
+    print("\nTesting HTTP API server...")
+    
+    try:
+        import http.client
+        import core
+        import api_server
+        import history_store
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    previous_backend, previous_file = core.get_backend(), core.CHAT_HISTORY_FILE
+    server = None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            core.set_backend(core.MockBackend(latency_ms=0, token_delay_ms=0))
+            core.CHAT_HISTORY_FILE = os.path.join(tmp, "chat_history.json")
+            server = api_server.create_server("127.0.0.1", 0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            
+            # Every request below shares one keep-alive connection
+            conn = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+            headers = {"Authorization": f"Bearer {api_server.API_TOKEN}"} if api_server.API_TOKEN else {}
+            
+            def call(method, path, body=None):
+                conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+                response = conn.getresponse()
+                return response.status, response.read().decode("utf-8")
+            
+            status, data = call("GET", "/health")
+            if status != 200 or json.loads(data)["backend"] != "mock":
+                print(f"❌ FAIL: /health returned {status}")
+                return False
+            print("✓ Health endpoint")
+            
+            question = [{"role": "user", "content": "What is Python?"}]
+            status, data = call("POST", "/v1/chat/completions", {"messages": question, "user": "uid:api-test"})
+            reply = json.loads(data)
+            if status != 200 or "What is Python?" not in reply["message"]["content"]:
+                print(f"❌ FAIL: Completion returned {status}: {data[:100]}")
+                return False
+            print("✓ Chat completion")
+            
+            status, data = call("POST", "/v1/chat/completions", {"messages": question, "stream": True})
+            events = [line[len("data: "):] for line in data.split("\n") if line.startswith("data: ")]
+            text = "".join(json.loads(event).get("delta", "") for event in events[:-1])
+            if status != 200 or events[-1] != "[DONE]" or text != reply["message"]["content"]:
+                print("❌ FAIL: Streamed reply differs from the plain completion")
+                return False
+            print(f"✓ Server-sent event stream ({len(events)} events)")
+            
+            status, _ = call("POST", "/v1/chat/completions", {"messages": [], "mode": "Unknown Mode"})
+            if status != 400:
+                print(f"❌ FAIL: Invalid request returned {status}")
+                return False
+            
+            history_store.flush()
+            status, data = call("GET", "/v1/chats/" + reply["chat_id"] + "?user=uid:api-test")
+            if status != 200 or len(json.loads(data)["messages"]) != 2:
+                print("❌ FAIL: Completion was not saved to the user's history")
+                return False
+            print("✓ Exchange saved to the user's history")
+            
+            # Resending the chat with an edited, shorter conversation replaces it
+            longer = question + [reply["message"], {"role": "user", "content": "And Java?"}]
+            call("POST", "/v1/chat/completions", {"messages": longer, "user": "uid:api-test", "chat_id": reply["chat_id"]})
+            edited = [{"role": "user", "content": "What is Rust?"}]
+            call("POST", "/v1/chat/completions", {"messages": edited, "user": "uid:api-test", "chat_id": reply["chat_id"]})
+            history_store.flush()
+            status, data = call("GET", "/v1/chats/" + reply["chat_id"] + "?user=uid:api-test")
+            stored = json.loads(data)["messages"]
+            if len(stored) != 2 or stored[0]["content"] != "What is Rust?":
+                print(f"❌ FAIL: Edited conversation stored as {len(stored)} messages")
+                return False
+            print("✓ A resent, edited conversation replaces the stored chat")
+            
+            if server.requests != 8:
+                print(f"❌ FAIL: Expected 8 requests, server counted {server.requests}")
+                return False
+            print("✓ All requests served over one keep-alive connection")
+            conn.close()
+        
+        print("✓ PASS: HTTP API server works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        core.set_backend(previous_backend)
+        core.CHAT_HISTORY_FILE = previous_file
+
+
+def test_chat_repl():
+    """Test the terminal chat client (streaming, saving, resume, lazy SDK import)"""
+    print("\nTesting terminal chat client...")
+    
+    try:
+        import io
+        import contextlib
+        import sys
+        import subprocess
+        import core
+        import textiq
+        import history_store
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    previous_backend = core.get_backend()
+    try:
+        # Starting the client must not import the Gemini SDK
+        check = subprocess.run(
+            [sys.executable, "-c", "import sys, textiq; print('google.generativeai' in sys.modules)"],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if check.stdout.strip() != "False":
+            print(f"❌ FAIL: Gemini SDK imported at startup {check.stderr[-200:]}")
+            return False
+        print("✓ Gemini SDK not imported before the first request")
+        
+        core.set_backend(core.MockBackend(latency_ms=0, token_delay_ms=0))
+        with tempfile.TemporaryDirectory() as tmp:
+            history_file = os.path.join(tmp, "chat_history.json")
+            session = textiq.ChatSession(history_file)
+            out = io.StringIO()
+            textiq.chat(session, io.StringIO("What is Python?\n/mode Powerful\nAnd Java?\n"), out, quiet=True)
+            if "Mock reply from gemini-2.5-pro to: And Java?" not in out.getvalue():
+                print("❌ FAIL: Reply was not streamed to the output")
+                return False
+            print("✓ Replies streamed to stdout, /mode switches model")
+            
+            saved = history_store.load_chats(history_file)
+            if len(saved) != 1 or len(saved[0]["messages"]) != 4:
+                print("❌ FAIL: Conversation was not saved")
+                return False
+            
+            # Resume by id prefix and continue the same chat
+            resumed = textiq.ChatSession(history_file)
+            textiq.chat(resumed, io.StringIO(f"/resume {saved[0]['id'][:8]}\nOne more\n/exit\n"), io.StringIO(), quiet=True)
+            saved = history_store.load_chats(history_file)
+            if len(saved) != 1 or len(saved[0]["messages"]) != 6:
+                print("❌ FAIL: Resumed chat was not continued")
+                return False
+            print("✓ Chat saved after every reply and resumed by id")
+            
+            # With per-user history the shared file would hide CLI chats from the app
+            previous_sharding, history_store.HISTORY_SHARDING = history_store.HISTORY_SHARDING, "user"
+            try:
+                with contextlib.redirect_stderr(io.StringIO()):
+                    textiq.main(["chat"])
+                print("❌ FAIL: chat without --user ran against the shared file")
+                return False
+            except SystemExit as e:
+                if e.code != 2:
+                    raise
+            finally:
+                history_store.HISTORY_SHARDING = previous_sharding
+            print("✓ With per-user history, chat asks for --user")
+        
+        print("✓ PASS: Terminal chat client works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    finally:
+        core.set_backend(previous_backend)
+
+
+def test_lazy_imports():
+    """Test heavy SDKs are not imported when the app's modules load"""
+    print("\nTesting lazy imports...")
+    
+    try:
+        import sys
+        import subprocess
+        import core
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        code = (
+            "import sys, core, search_index, history_store, retention, session_store, message_window\n"
+            "print(','.join(name for name in ('google.generativeai', 'grpc', 'redis') if name in sys.modules))"
+        )
+        check = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+        if check.returncode != 0 or check.stdout.strip():
+            print(f"❌ FAIL: Imported at startup: {check.stdout.strip() or check.stderr[-200:]}")
+            return False
+        print("✓ Gemini SDK, gRPC and redis are not imported at startup")
+        
+        if core.GEMINI_AVAILABLE:
+            sdk = core.load_sdk()
+            if core.load_sdk() is not sdk or core.genai is not sdk:
+                print("❌ FAIL: Gemini SDK loaded twice")
+                return False
+            print("✓ Gemini SDK loaded on first use and kept")
+        
+        print("✓ PASS: Lazy imports work")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_benchmark_tools():
+    """Test the pure CSS/request builders and benchmark baseline comparison"""
+    print("\nTesting benchmark tools...")
+    
+    try:
+        import core
+        import theme
+        import benchmark
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        messages = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello!"},
+                    {"role": "user", "content": "Question"}]
+        history = core.build_history(messages, DEFAULT_SYSTEM_PROMPT)
+        if [entry["role"] for entry in history] != ["user", "model", "user", "model"]:
+            print("❌ FAIL: Request history has the wrong turns")
+            return False
+        if len(core.build_history(messages, "")) != 2:
+            print("❌ FAIL: Empty system prompt still added")
+            return False
+        print("✓ Request history built without the SDK")
+        
+        dark, light = theme.build_css(True), theme.build_css(False)
+        if "#0f0f0f" not in dark or "#0f0f0f" in light or theme.build_css(True) is not dark:
+            print("❌ FAIL: Theme CSS is wrong or rebuilt on every call")
+            return False
+        print("✓ Theme CSS built once per mode")
+        
+        benchmark.METRICS.clear()
+        benchmark.record("save", 10.0)
+        benchmark.record("load", 5.0)
+        benchmark.record("tiny", 0.02)
+        benchmark.record("small", 0.55)
+        regressions = benchmark.compare_to_baseline(
+            {"save": 5.0, "load": 5.0, "tiny": 0.01, "small": 0.40}, threshold=0.25)
+        benchmark.METRICS.clear()
+        if regressions != ["save"]:
+            print(f"❌ FAIL: Expected only 'save' to regress, got {regressions}")
+            return False
+        print("✓ Baseline comparison flags slowdowns over the threshold, not sub-ms noise")
+        
+        print("✓ PASS: Benchmark tools work")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_load_test():
+    """Test the concurrent-session load test harness on a small ramp"""
+    print("\nTesting load test harness...")
+    
+    try:
+        import streamlit  # noqa: F401
+        import load_test
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        results = load_test.run_ramp((1, 3), turns=2, latency_ms=0, report=None)
+        errors = [error for result in results for error in result["errors"]]
+        if errors:
+            print(f"❌ FAIL: Sessions failed: {errors[:3]}")
+            return False
+        print(f"✓ {sum(result['sessions'] for result in results)} simulated sessions chatted, "
+              "browsed history and toggled the theme")
+        
+        single, concurrent = results
+        if single["runs"] == 0 or concurrent["runs"] != 3 * single["runs"]:
+            print(f"❌ FAIL: Expected 3x the runs of one session, got {single['runs']} and {concurrent['runs']}")
+            return False
+        if not 0 < concurrent["run_p50_ms"] <= concurrent["run_p95_ms"] <= concurrent["run_p99_ms"]:
+            print("❌ FAIL: Percentiles out of order")
+            return False
+        if concurrent["rss_mb"] <= 0:
+            print("❌ FAIL: No memory reading")
+            return False
+        print(f"✓ Reported p50/p95/p99 {concurrent['run_p50_ms']:.0f}/{concurrent['run_p95_ms']:.0f}/"
+              f"{concurrent['run_p99_ms']:.0f} ms, {concurrent['runs_per_s']:.0f} runs/s, "
+              f"{concurrent['rss_mb']:.0f} MB")
+        
+        print("✓ PASS: Load test harness works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_cassettes():
+    """Test recording replies to a cassette and replaying them with scaled timing"""
+    print("\nTesting response cassettes...")
+    
+    try:
+        import core
+        import cassettes
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    previous_backend = core.get_backend()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cassette.json")
+            messages = [{"role": "user", "content": "What is a cassette?"}]
+            request = (messages, DEFAULT_SYSTEM_PROMPT, MODELS["Fast Mode"], 0.7)
+            
+            # A slow mock stands in for Gemini: 100 ms to the first token, 10 ms per token after
+            recorder = cassettes.RecordingBackend(core.MockBackend(latency_ms=100, token_delay_ms=10), path)
+            start = time.perf_counter()
+            recorded = "".join(recorder.stream(*request))
+            recorded_ms = (time.perf_counter() - start) * 1000
+            
+            class FailingBackend(core.MockBackend):
+                def generate(self, *args, **kwargs):
+                    raise RuntimeError("429 Resource has been exhausted (quota)")
+            
+            failing = cassettes.RecordingBackend(FailingBackend(), path)
+            try:
+                failing.generate([{"role": "user", "content": "Too many"}], "", MODELS["Fast Mode"], 0.7)
+            except RuntimeError:
+                pass
+            if len(cassettes.Cassette(path)) != 2:
+                print("❌ FAIL: Expected a reply and an error in the cassette")
+                return False
+            print(f"✓ Recorded a streamed reply ({recorded_ms:.0f} ms) and a failed request")
+            
+            replay = cassettes.ReplayBackend(path, time_scale=1.0)
+            start = time.perf_counter()
+            chunks = list(replay.stream(*request))
+            replayed_ms = (time.perf_counter() - start) * 1000
+            if "".join(chunks) != recorded or len(chunks) < 5:
+                print("❌ FAIL: Replayed reply differs from the recording")
+                return False
+            if not recorded_ms * 0.8 <= replayed_ms <= recorded_ms * 1.5:
+                print(f"❌ FAIL: Replay took {replayed_ms:.0f} ms, recording {recorded_ms:.0f} ms")
+                return False
+            print(f"✓ Replayed chunk by chunk with the original timing ({replayed_ms:.0f} ms)")
+            
+            fast = cassettes.ReplayBackend(path, time_scale=0)
+            start = time.perf_counter()
+            fast.generate(*request)
+            if (time.perf_counter() - start) * 1000 > 20:
+                print("❌ FAIL: time_scale=0 still waited")
+                return False
+            print("✓ time_scale=0 replays instantly")
+            
+            # End-to-end through the app's pipeline, fully offline
+            core.set_backend(cassettes.ReplayBackend(path, time_scale=0.5))
+            start = time.perf_counter()
+            reply = core.generate_response(*request)
+            turn_ms = (time.perf_counter() - start) * 1000
+            failure = core.generate_response([{"role": "user", "content": "Too many"}], "", MODELS["Fast Mode"], 0.7)
+            if reply != recorded or "Usage limit" not in failure:
+                print("❌ FAIL: Pipeline did not replay the reply and the recorded quota error")
+                return False
+            print(f"✓ Turn latency at half the recorded timing: {turn_ms:.0f} ms; recorded errors replay")
+            
+            try:
+                replay.generate([{"role": "user", "content": "Never recorded"}], "", MODELS["Fast Mode"], 0.7)
+                print("❌ FAIL: Unrecorded request did not raise")
+                return False
+            except cassettes.CassetteError:
+                print("✓ Unrecorded requests are reported")
+        
+        print("✓ PASS: Cassettes record and replay")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    finally:
+        core.set_backend(previous_backend)
+
+
+def test_turn_metrics():
+    """Test per-turn timing/token metrics and the per-model summary"""
+    print("\nTesting turn metrics...")
+    
+    try:
+        import core
+        import metrics
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    previous_backend = core.get_backend()
+    try:
+        metrics.reset()
+        core.set_backend(core.MockBackend(latency_ms=30, token_delay_ms=5))
+        model = MODELS["Fast Mode"]
+        messages = [{"role": "user", "content": "Explain metrics in one line"}]
+        
+        submitted = time.perf_counter()
+        time.sleep(0.02)  # Work done before the model is called counts as queue time
+        turn = metrics.Turn(model, submitted=submitted)
+        reply = "".join(core.stream_response(messages, DEFAULT_SYSTEM_PROMPT, model, 0.7, turn))
+        stats = turn.as_dict()
+        if not 15 <= stats["queue_ms"] < stats["ttft_ms"] < stats["latency_ms"]:
+            print(f"❌ FAIL: Timings out of order: {stats}")
+            return False
+        if stats["output_tokens"] != len(reply.split()) or not stats["input_tokens"] or stats["error"]:
+            print(f"❌ FAIL: Wrong token usage: {stats}")
+            return False
+        print(f"✓ Streamed turn: queue {stats['queue_ms']:.0f} ms, first token {stats['ttft_ms']:.0f} ms, "
+              f"total {stats['latency_ms']:.0f} ms, {stats['output_tokens']} tokens")
+        
+        for _ in range(3):
+            core.generate_response(messages, DEFAULT_SYSTEM_PROMPT, model, 0.7)
+        
+        class FailingBackend(core.MockBackend):
+            def generate(self, *args, **kwargs):
+                raise TimeoutError("deadline exceeded")
+        
+        core.set_backend(FailingBackend())
+        failed = metrics.Turn(MODELS["Powerful Mode"])
+        core.generate_response(messages, DEFAULT_SYSTEM_PROMPT, MODELS["Powerful Mode"], 0.7, failed)
+        if failed.as_dict()["error"] != "TimeoutError":
+            print("❌ FAIL: Error class not recorded")
+            return False
+        print("✓ Failed turn records its error class")
+        
+        summary = metrics.summary()
+        fast, powerful = summary[model], summary[MODELS["Powerful Mode"]]
+        if fast["turns"] != 4 or fast["errors"] or not 0 < fast["p50_ms"] <= fast["p95_ms"]:
+            print(f"❌ FAIL: Wrong summary for {model}: {fast}")
+            return False
+        if fast["tokens_per_s"] <= 0 or powerful["errors"] != 1:
+            print(f"❌ FAIL: Missing token rate or error count: {summary}")
+            return False
+        print(f"✓ Per-model summary: p50 {fast['p50_ms']:.0f} ms, p95 {fast['p95_ms']:.0f} ms, "
+              f"{fast['tokens_per_s']:.0f} tokens/s")
+        
+        print("✓ PASS: Turn metrics work")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    finally:
+        core.set_backend(previous_backend)
+        metrics.reset()
+
+
+def test_metrics_exporter():
+    """Test the Prometheus exporter and the cost of metric updates"""
+    print("\nTesting Prometheus metrics exporter...")
+    
+    try:
+        import socket
+        import urllib.request
+        import core
+        import metrics
+        import exporter
+        import history_store
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    previous_backend = core.get_backend()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            core.set_backend(core.MockBackend(latency_ms=0, token_delay_ms=0))
+            model = MODELS["Fast Mode"]
+            core.generate_response([{"role": "user", "content": "Count me"}], "", model, 0.7)
+            history_file = os.path.join(tmp, "chat_history.json")
+            history_store.upsert_chat(history_file, {"id": "m1", "title": "Metrics"}, 0,
+                                      [{"role": "user", "content": "Hello"}])
+            history_store.flush()
+            history_store.load_chats(history_file)
+            
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+            if exporter.start(port=port) is None:
+                print("❌ FAIL: Exporter did not start")
+                return False
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=10) as response:
+                content_type = response.headers["Content-Type"]
+                text = response.read().decode("utf-8")
+            exporter.stop()
+            
+            expected = [
+                f'textiq_model_requests_total{{model="{model}"}}',
+                f'textiq_model_request_seconds_bucket{{model="{model}",le="+Inf"}}',
+                "textiq_history_read_seconds_count",
+                "textiq_history_commit_seconds_count",
+                "textiq_history_file_bytes",
+                "textiq_active_sessions",
+                "textiq_session_memory_bytes",
+                "textiq_spilled_messages",
+                "# TYPE textiq_rerun_seconds histogram",
+            ]
+            missing = [name for name in expected if name not in text]
+            if missing or not content_type.startswith("text/plain"):
+                print(f"❌ FAIL: Missing from /metrics: {missing}")
+                return False
+            print(f"✓ /metrics served {len(text.splitlines())} lines from a side port")
+            
+            # A port held by another process is tried and reported once, not on every rerun
+            import contextlib
+            import io
+            with socket.socket() as taken:
+                taken.bind(("127.0.0.1", 0))
+                taken.listen()
+                busy = taken.getsockname()[1]
+                warnings = io.StringIO()
+                with contextlib.redirect_stderr(warnings):
+                    results = [exporter.start(port=busy) for _ in range(5)]
+            if any(results) or warnings.getvalue().count("not started") != 1:
+                print(f"❌ FAIL: Busy port retried on every call: {warnings.getvalue()!r}")
+                return False
+            print("✓ A busy metrics port is reported once per process")
+        
+        # Hot paths update these on every call; keep them cheap
+        histogram = metrics.Histogram("textiq_test_seconds", "Test histogram", ["model"], register=False)
+        updates = 100000
+        start = time.perf_counter()
+        for _ in range(updates):
+            histogram.observe(0.02, "m")
+        per_update_us = (time.perf_counter() - start) / updates * 1e6
+        if histogram.count("m") != updates or per_update_us > 20:
+            print(f"❌ FAIL: {histogram.count('m')} observations at {per_update_us:.2f} µs each")
+            return False
+        print(f"✓ Histogram update costs {per_update_us:.2f} µs")
+        
+        print("✓ PASS: Metrics exporter works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    finally:
+        core.set_backend(previous_backend)
+        exporter.stop()
+
+
+def test_tracing():
+    """Test span tracing of the chat turn pipeline and its cost when off"""
+    print("\nTesting span tracing...")
+    
+    try:
+        import core
+        import tracing
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    previous_backend = core.get_backend()
+    previous = (tracing.TRACE_ENABLED, tracing.TRACE_DIR)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            tracing.enable(tmp)
+            core.set_backend(core.MockBackend(latency_ms=0, token_delay_ms=0))
+            messages = [{"role": "user", "content": "Trace this turn"}]
+            with tracing.start_trace("chat_turn", mode="Fast Mode"):
+                core.generate_response(messages, "", MODELS["Fast Mode"], 0.7)
+            try:
+                with tracing.start_trace("failing_turn"):
+                    raise ValueError("model unavailable")
+            except ValueError:
+                pass
+            tracing.disable()
+            
+            files = sorted(os.listdir(tmp))
+            if len(files) != 2:
+                print(f"❌ FAIL: Expected 2 trace files, found {files}")
+                return False
+            turn_file = os.path.join(tmp, next(name for name in files if "chat_turn" in name))
+            with open(turn_file, encoding="utf-8") as f:
+                spans = json.load(f)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+            by_name = {span["name"]: span for span in spans}
+            root = by_name.get("chat_turn")
+            generate = by_name.get("model.generate")
+            if not root or not generate:
+                print(f"❌ FAIL: Missing spans, found {list(by_name)}")
+                return False
+            if generate["parentSpanId"] != root["spanId"] or {span["traceId"] for span in spans} != {root["traceId"]}:
+                print("❌ FAIL: Spans are not nested in one trace")
+                return False
+            attributes = {item["key"] for item in generate["attributes"]}
+            if "textiq.output_tokens" not in attributes:
+                print(f"❌ FAIL: model.generate attributes {sorted(attributes)}")
+                return False
+            for depth, name, ms in tracing.summarize(turn_file):
+                print(f"   {'  ' * depth}{name}: {ms:.2f} ms")
+            
+            failed_file = os.path.join(tmp, next(name for name in files if "failing_turn" in name))
+            with open(failed_file, encoding="utf-8") as f:
+                failed = json.load(f)["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+            if failed["status"]["code"] != tracing.STATUS_ERROR or failed["events"][0]["name"] != "exception":
+                print(f"❌ FAIL: Error not recorded: {failed['status']}")
+                return False
+            print("✓ Nested spans and errors exported as OTLP JSON")
+            
+            # Off (the default), spans must cost next to nothing
+            calls = 200000
+            start = time.perf_counter()
+            for _ in range(calls):
+                with tracing.span("noop", model="m"):
+                    pass
+            per_call_us = (time.perf_counter() - start) / calls * 1e6
+            if sorted(os.listdir(tmp)) != files:
+                print(f"❌ FAIL: Disabled spans wrote trace files: {sorted(set(os.listdir(tmp)) - set(files))}")
+                return False
+            if per_call_us > 5:
+                print(f"❌ FAIL: Disabled span costs {per_call_us:.2f} µs")
+                return False
+            print(f"✓ Disabled span costs {per_call_us:.2f} µs")
+            
+            # An app run that ends in st.stop() (no API key) still writes its trace
+            import load_test
+            tracing.enable(tmp)
+            core.set_backend(core.GeminiBackend(""))
+            load_test.SimulatedSession(0).app.run()
+            tracing.disable()
+            reruns = [name for name in os.listdir(tmp) if "-rerun-" in name]
+            if len(reruns) != 1:
+                print(f"❌ FAIL: A run stopped by st.stop() wrote {len(reruns)} rerun traces")
+                return False
+            print("✓ A run ended by st.stop() still exports its rerun trace")
+        
+        print("✓ PASS: Span tracing works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    finally:
+        core.set_backend(previous_backend)
+        tracing.TRACE_ENABLED, tracing.TRACE_DIR = previous
+
+
+def test_profiling():
+    """Test on-demand CPU profiles of chat turns"""
+    print("\nTesting on-demand profiling...")
+    
+    try:
+        import pstats
+        import core
+        import profiling
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    previous_backend = core.get_backend()
+    previous = (profiling.PROFILE_MODE, profiling.PROFILE_EVERY, profiling.PROFILE_QUERY, profiling.PROFILE_DIR)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            core.set_backend(core.MockBackend(latency_ms=0, token_delay_ms=0))
+            messages = [{"role": "user", "content": "Profile this turn"}]
+            profiling.PROFILE_DIR = tmp
+            profiling.PROFILE_MODE, profiling.PROFILE_EVERY = "turn", 2
+            profiling._counts.clear()
+            for number in range(4):
+                with profiling.profile("turn", session="s1", turn=number):
+                    core.generate_response(messages, "", MODELS["Fast Mode"], 0.7)
+                with profiling.profile("rerun", session="s1"):
+                    pass
+            files = sorted(os.listdir(tmp))
+            if len(files) != 4 or not all("-turn-s1-t" in name for name in files):
+                print(f"❌ FAIL: Expected 1 in 2 turns profiled, found {files}")
+                return False
+            print("✓ 1 in 2 turns profiled, tagged with session and turn")
+            
+            stats_file = os.path.join(tmp, files[1])
+            stats = pstats.Stats(stats_file)
+            if not any(name == "generate_reply" for _, _, name in stats.stats):
+                print("❌ FAIL: generate_reply missing from the pstats file")
+                return False
+            with open(os.path.join(tmp, files[0]), encoding="utf-8") as f:
+                stacks = [line.rsplit(" ", 1) for line in f.read().splitlines()]
+            if not stacks or not all(count.isdigit() for _, count in stacks) or \
+                    not any("generate_response" in stack and "generate_reply" in stack for stack, _ in stacks):
+                print("❌ FAIL: Collapsed stacks missing or malformed")
+                return False
+            print(f"✓ pstats and {len(stacks)} collapsed stacks written")
+            
+            # Asked for from the URL; a nested request is covered by the outer profile
+            profiling.PROFILE_MODE, profiling.PROFILE_QUERY = "off", True
+            with profiling.profile("turn", requested="turn", session="s2", turn=1) as outer:
+                nested = profiling.profile("turn", requested="turn")
+                end = time.perf_counter() + 0.05
+                while time.perf_counter() < end:
+                    core.generate_response(messages, "", MODELS["Fast Mode"], 0.7)
+            if nested is not profiling.NOOP_PROFILE or len(outer.paths) != 2:
+                print("❌ FAIL: Query-param profile not written, or a nested profile started")
+                return False
+            
+            sampled = profiling.Profile("turn", profiler="sample", session="s3", turn=1)
+            end = time.perf_counter() + 0.1
+            while time.perf_counter() < end:
+                core.generate_response(messages, "", MODELS["Fast Mode"], 0.7)
+            sampled.stop()
+            with open(sampled.paths[1], encoding="utf-8") as f:
+                sampled_stacks = f.read()
+            if "generate_response" not in sampled_stacks or not pstats.Stats(sampled.paths[0]).total_tt:
+                print("❌ FAIL: Sampling profiler recorded nothing")
+                return False
+            print("✓ ?profile=turn and the sampling profiler work")
+            
+            if profiling.profile("turn", requested="rerun") is not profiling.NOOP_PROFILE:
+                print("❌ FAIL: ?profile=rerun profiled a turn")
+                return False
+            
+            # A run that ended without stopping its profile doesn't block the next run
+            leftover = profiling.start("rerun", requested="rerun", session="s4")
+            written = len(os.listdir(tmp))
+            fresh = profiling.start("rerun", requested="rerun", session="s4")
+            fresh.stop()
+            if fresh is profiling.NOOP_PROFILE or leftover.paths or len(os.listdir(tmp)) != written + 2:
+                print("❌ FAIL: A profile left running blocked the next rerun's profile")
+                return False
+            print("✓ A profile left running by an interrupted run is discarded by the next run")
+        
+        print("✓ PASS: On-demand profiling works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    finally:
+        core.set_backend(previous_backend)
+        profiling.PROFILE_MODE, profiling.PROFILE_EVERY, profiling.PROFILE_QUERY, profiling.PROFILE_DIR = previous
+
+
+def test_memory_accounting():
+    """Test per-session memory accounting and leak detection"""
+    print("\nTesting memory accounting...")
+    
+    try:
+        import memory
+        from message_window import MessageWindow
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    try:
+        state = {
+            "messages": MessageWindow([{"role": "user", "content": "x" * 50000}]),
+            "history": [{"id": str(i), "title": "t" * 100} for i in range(1000)],
+            "dark_mode": False,
+        }
+        memory.record_session("test-session", state, force=True)
+        usage = next(session for session in memory.session_usage(memory.MAX_SESSIONS)
+                     if session["session"] == "test-session")
+        keys = dict(usage["keys"])
+        if usage["keys"][0][0] != "history" or not 50000 <= keys["messages"] < 60000 or keys["dark_mode"] > 100:
+            print(f"❌ FAIL: Session keys measured as {keys}")
+            return False
+        print(f"✓ Session state attributed per key: {usage['bytes'] / 1024:.0f} KB in {len(keys)} keys")
+        
+        caches = [cache["cache"] for cache in memory.cache_usage()]
+        if not any(name.startswith("search_index") for name in caches):
+            print(f"❌ FAIL: Caches measured: {caches}")
+            return False
+        print(f"✓ {len(caches)} module caches measured")
+        
+        # A list that grows between every snapshot is reported as a leak
+        memory.start(interval=3600, force=True)
+        leaked = []
+        for _ in range(3):
+            leaked.extend(bytearray(1024) for _ in range(200))
+            memory.take_snapshot()
+        suspects = memory.leak_suspects(min_growth=100 * 1024)
+        growth = memory.diff(limit=5)
+        if not any(suspect["location"].startswith("testing.py:") for suspect in suspects) or \
+                not growth[0]["location"].startswith("testing.py:"):
+            print(f"❌ FAIL: Leak not found: {suspects}")
+            return False
+        print(f"✓ Leak found at {suspects[0]['location']} (+{suspects[0]['growth'] / 1024:.0f} KB "
+              f"over {len(memory.snapshots())} snapshots)")
+        del leaked
+        
+        # No resource module on Windows: psutil if installed, else tracemalloc totals
+        saved = memory.resource, memory.psutil
+        memory.resource = memory.psutil = None
+        try:
+            fallback = memory.process_memory()
+        finally:
+            memory.resource, memory.psutil = saved
+        if set(fallback) != {"traced_bytes", "peak_traced_bytes"} or not fallback["traced_bytes"]:
+            print(f"❌ FAIL: Unexpected memory numbers without resource or psutil: {fallback}")
+            return False
+        print("✓ Falls back to tracemalloc totals without the resource module")
+        
+        print("✓ PASS: Memory accounting works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    finally:
+        memory.stop()
+
+
+def test_model_catalog():
+    """Test the cached model list and concurrent model probes"""
+    print("\nTesting model catalog...")
+    
+    try:
+        import model_catalog
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    class FakeBackend:
+        """Lists some models; each replies after its own delay or fails"""
+        name = "fake"
+        delays = {"fast": 0.2, "slow": 0.3, "broken": 0.1, "hung": 5}
+        
+        def __init__(self):
+            self.listed = 0
+            self.probed = []
+        
+        def list_models(self):
+            self.listed += 1
+            return ["fast", "slow", "broken", "hung"]
+        
+        def generate(self, messages, system_prompt, model_name, temperature, usage=None):
+            self.probed.append(model_name)
+            time.sleep(self.delays.get(model_name, 0))
+            if model_name == "broken":
+                raise RuntimeError("404 model not found")
+            return "Hello"
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_file = os.path.join(tmp, "models.json")
+            backend = FakeBackend()
+            models = ["fast", "slow", "broken", "hung", "retired"]
+            
+            # Off by default: only the model list is checked, no quota spent
+            listed_only = model_catalog.ModelCatalog(backend, cache_file=None).refresh(models=models)
+            found = {model: status["status"] for model, status in listed_only.items()}
+            if backend.probed or found != {**dict.fromkeys(models, "ok"), "retired": "missing"}:
+                print(f"❌ FAIL: Models probed without TEXTIQ_MODEL_PROBE ({found})")
+                return False
+            print("✓ Only the model list is checked unless probing is turned on")
+            
+            backend.listed = 0
+            catalog = model_catalog.ModelCatalog(backend, probe_timeout=1, cache_file=cache_file, probe_models=True)
+            
+            start = time.perf_counter()
+            statuses = catalog.refresh(models=models)
+            elapsed = time.perf_counter() - start
+            found = {model: status["status"] for model, status in statuses.items()}
+            expected = {"fast": "ok", "slow": "ok", "broken": "error", "hung": "timeout", "retired": "missing"}
+            if found != expected or "retired" in backend.probed:
+                print(f"❌ FAIL: Statuses {found}")
+                return False
+            if elapsed > 1.5:
+                print(f"❌ FAIL: Probes took {elapsed:.2f} s; the timeout is 1 s")
+                return False
+            print(f"✓ 5 models checked in {elapsed:.2f} s (a hung one timed out, one missing was not probed)")
+            
+            start = time.perf_counter()
+            catalog.probe(["fast", "slow", "broken"])
+            elapsed = time.perf_counter() - start
+            if not 0.3 <= elapsed < 0.5:
+                print(f"❌ FAIL: Probes took {elapsed:.2f} s, not the slowest model's 0.3 s")
+                return False
+            print(f"✓ Concurrent probes took {elapsed:.2f} s (0.6 s one at a time)")
+            
+            # Cached in memory and on disk until the TTL runs out
+            backend.probed.clear()
+            catalog.refresh(models=models)
+            model_catalog.ModelCatalog(backend, cache_file=cache_file, probe_models=True).refresh(models=models)
+            if backend.listed != 1 or backend.probed:
+                print(f"❌ FAIL: Cached results not reused ({backend.listed} listings)")
+                return False
+            model_catalog.ModelCatalog(backend, ttl=0, probe_timeout=1, cache_file=cache_file).list_models()
+            if backend.listed != 2:
+                print("❌ FAIL: Expired model list not fetched again")
+                return False
+            print("✓ Model list and probes cached across instances; refreshed after the TTL")
+            
+            modes = {"Hung Mode": "hung", "Fast Mode": "fast", "Broken Mode": "broken", "Retired Mode": "retired"}
+            order = catalog.ordered_modes(modes)
+            labels = [catalog.mode_label(mode, modes) for mode in order]
+            if order != ["Fast Mode", "Hung Mode", "Broken Mode", "Retired Mode"] or \
+                    labels[1:] != ["Hung Mode (not responding)", "Broken Mode (unavailable)",
+                                   "Retired Mode (unavailable)"] or catalog.default_mode(modes) != "Fast Mode":
+                print(f"❌ FAIL: Modes ordered as {labels}")
+                return False
+            unavailable = {"Broken Mode": "broken", "Retired Mode": "retired"}
+            if catalog.ordered_modes(unavailable) != list(unavailable) or \
+                    catalog.mode_label("Broken Mode", unavailable) != "Broken Mode":
+                print("❌ FAIL: With no model available, modes should be left as configured")
+                return False
+            print(f"✓ Modes ordered for the app: {', '.join(labels)}")
+        
+        print("✓ PASS: Model catalog works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
+def test_key_pool():
+    """Test spreading model requests over several API keys"""
+    print("\nTesting API key pool...")
+    
+    try:
+        import core
+        import metrics
+        import key_pool
+    except ImportError as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+    
+    now = [1000.0]
+    
+    def sleep(seconds):
+        now[0] += seconds
+    
+    def make_pool(keys, **limits):
+        return key_pool.KeyPool(keys, clock=lambda: now[0], sleep=sleep, **limits)
+    
+    class FakeServer:
+        """Answers until a key has used its quota, then raises a 429 like the Gemini API"""
+        
+        def __init__(self, quota):
+            self.quota = dict(quota)
+            self.used = []
+        
+        def request(self, key):
+            self.used.append(key)
+            if self.quota.get(key, 0) <= 0:
+                raise RuntimeError("429 Resource has been exhausted (e.g. check quota). Please retry in 7.5s.")
+            self.quota[key] -= 1
+            return f"reply via {key}"
+        
+        def stream(self, key, fail_after=None):
+            self.request(key)
+            for i, chunk in enumerate(["Hel", "lo"]):
+                if i == fail_after:
+                    raise RuntimeError("429 quota exceeded")
+                yield chunk
+    
+    keys = ["key-aaaa1111", "key-bbbb2222", "key-cccc3333"]
+    try:
+        # No local limits unless TEXTIQ_KEY_RPM/RPD are set: paid tiers and
+        # replicas would otherwise be refused by a per-process counter
+        if not os.getenv("TEXTIQ_KEY_RPM") and not os.getenv("TEXTIQ_KEY_RPD"):
+            unlimited = make_pool(keys[:1], wait=0)
+            for _ in range(2000):
+                unlimited.call(lambda key: key)
+            print("✓ No local key limits by default (2000 requests from one key)")
+        
+        # Local limits: each request goes to the key with the most headroom
+        pool = make_pool(keys, rpm=2, rpd=5, wait=0)
+        used = [pool.acquire().key for _ in range(6)]
+        if sorted(used) != sorted(keys * 2) or used[:3] != keys:
+            print(f"❌ FAIL: Requests not spread over the keys: {used}")
+            return False
+        try:
+            pool.acquire()
+            print("❌ FAIL: A 7th request within the minute should find no key")
+            return False
+        except key_pool.KeyPoolExhausted:
+            pass
+        waiting = make_pool(keys[:1], rpm=1, rpd=0, wait=90)
+        waiting.acquire()
+        start = now[0]
+        waiting.acquire()
+        if not 59 <= now[0] - start <= 61:
+            print(f"❌ FAIL: Waited {now[0] - start:.0f} s for the next token, not 60 s")
+            return False
+        now[0] += 3600
+        day = make_pool(keys[:1], rpm=0, rpd=2, wait=0)
+        day.acquire(), day.acquire()
+        try:
+            day.acquire()
+            print("❌ FAIL: Daily quota not enforced")
+            return False
+        except key_pool.KeyPoolExhausted:
+            pass
+        print("✓ Requests go to the key with the most headroom; per-minute and daily limits hold")
+        
+        # A 429 rests the key and the request is retried on another one
+        pool = make_pool(keys, rpm=0, rpd=0, cooldown=60, retries=2)
+        server = FakeServer({keys[0]: 0, keys[1]: 1, keys[2]: 1})
+        usage = {}
+        reply = pool.call(server.request, usage)
+        stats = {key["key"]: key for key in pool.stats()}
+        if reply != f"reply via {keys[1]}" or usage.get("retries") != 1:
+            print(f"❌ FAIL: Got {reply!r} after {usage.get('retries')} retries")
+            return False
+        if stats["…1111"]["rate_limited"] != 1 or stats["…1111"]["cooldown_s"] != 7.5:
+            print(f"❌ FAIL: Rate-limited key not resting for the delay the server asked: {stats['…1111']}")
+            return False
+        server.used.clear()
+        pool.call(server.request)
+        if server.used != [keys[2]]:
+            print(f"❌ FAIL: A resting key was used: {server.used}")
+            return False
+        try:
+            pool.call(server.request)
+            print("❌ FAIL: Expected a 429 once every key is out of quota")
+            return False
+        except Exception as e:
+            if not key_pool.is_rate_limited(e):
+                raise
+        print("✓ A 429 rests the key and the request is retried on another; fails once all are spent")
+        
+        # Streams retry only before the first chunk
+        pool = make_pool(keys[:2], rpm=0, rpd=0)
+        server = FakeServer({keys[0]: 0, keys[1]: 5})
+        usage = {}
+        chunks = list(pool.stream(server.stream, usage))
+        if chunks != ["Hel", "lo"] or usage.get("retries") != 1:
+            print(f"❌ FAIL: Stream gave {chunks} after {usage.get('retries')} retries")
+            return False
+        pool = make_pool(keys[:2], rpm=0, rpd=0)
+        chunks = []
+        try:
+            for chunk in pool.stream(lambda key: server.stream(key, fail_after=1)):
+                chunks.append(chunk)
+            print("❌ FAIL: A stream failing midway should not be retried")
+            return False
+        except RuntimeError:
+            if chunks != ["Hel"]:
+                print(f"❌ FAIL: Stream replayed chunks: {chunks}")
+                return False
+        print("✓ Streams move to another key only before the first chunk")
+        
+        # Retries reach the turn metrics; the backend keeps every key
+        turn = metrics.Turn("test-model")
+        turn.usage["retries"] = 2
+        turn.finish()
+        metrics.reset()
+        if turn.as_dict()["retries"] != 2:
+            print("❌ FAIL: Retries not recorded on the turn")
+            return False
+        backend = core.GeminiBackend(keys[0], f"{keys[1]}, {keys[2]}")
+        backend.api_key = "key-dddd4444"
+        if backend.pool.keys != ["key-dddd4444", keys[1], keys[2]] or key_pool.mask(keys[0]) != "…1111":
+            print(f"❌ FAIL: Backend keys {backend.pool.keys}")
+            return False
+        print("✓ Retries recorded per turn; the backend rotates through every configured key")
+        
+        print("✓ PASS: API key pool works")
+        return True
+    
+    except Exception as e:
+        print(f"❌ FAIL: {str(e)}")
+        return False
+
+
 # ============================================================================
 # QUICK CHECK
 # ============================================================================
@@ -454,7 +2358,31 @@ def run_all_tests():
         "Temperature Configuration": test_temperature_range(),
         "File Structure": test_file_structure(),
         "Dark Mode Feature": test_dark_mode_feature(),
-        "System Prompt": test_system_prompt()
+        "System Prompt": test_system_prompt(),
+        "Chat History Search": test_search_index(),
+        "History Store": test_history_store(),
+        "Multi-Process History Writes": test_history_stress(),
+        "History Compression": test_history_compression(),
+        "Serialization Codecs": test_serialization_codecs(),
+        "Message Deduplication": test_blob_dedup(),
+        "History Export/Import": test_export_import(),
+        "History Retention": test_retention(),
+        "Per-User History Shards": test_history_shards(),
+        "Session State Store": test_session_store(),
+        "Bounded Message Window": test_message_window(),
+        "HTTP API Server": test_api_server(),
+        "Terminal Chat Client": test_chat_repl(),
+        "Lazy Imports": test_lazy_imports(),
+        "Benchmark Tools": test_benchmark_tools(),
+        "Load Test Harness": test_load_test(),
+        "Response Cassettes": test_cassettes(),
+        "Turn Metrics": test_turn_metrics(),
+        "Metrics Exporter": test_metrics_exporter(),
+        "Span Tracing": test_tracing(),
+        "On-Demand Profiling": test_profiling(),
+        "Memory Accounting": test_memory_accounting(),
+        "Model Catalog": test_model_catalog(),
+        "API Key Pool": test_key_pool()
     }
     
     print("\n" + "=" * 60)
@@ -517,7 +2445,31 @@ def run_specific_test(test_name):
         "temp": ("Temperature", test_temperature_range),
         "files": ("File Structure", test_file_structure),
         "darkmode": ("Dark Mode", test_dark_mode_feature),
-        "prompt": ("System Prompt", test_system_prompt)
+        "prompt": ("System Prompt", test_system_prompt),
+        "search": ("Chat History Search", test_search_index),
+        "store": ("History Store", test_history_store),
+        "stress": ("Multi-Process History Writes", test_history_stress),
+        "compression": ("History Compression", test_history_compression),
+        "codecs": ("Serialization Codecs", test_serialization_codecs),
+        "dedup": ("Message Deduplication", test_blob_dedup),
+        "export": ("History Export/Import", test_export_import),
+        "retention": ("History Retention", test_retention),
+        "shards": ("Per-User History Shards", test_history_shards),
+        "sessions": ("Session State Store", test_session_store),
+        "window": ("Bounded Message Window", test_message_window),
+        "apiserver": ("HTTP API Server", test_api_server),
+        "repl": ("Terminal Chat Client", test_chat_repl),
+        "lazy": ("Lazy Imports", test_lazy_imports),
+        "bench": ("Benchmark Tools", test_benchmark_tools),
+        "loadtest": ("Load Test Harness", test_load_test),
+        "cassettes": ("Response Cassettes", test_cassettes),
+        "metrics": ("Turn Metrics", test_turn_metrics),
+        "exporter": ("Metrics Exporter", test_metrics_exporter),
+        "tracing": ("Span Tracing", test_tracing),
+        "profile": ("On-Demand Profiling", test_profiling),
+        "memory": ("Memory Accounting", test_memory_accounting),
+        "catalog": ("Model Catalog", test_model_catalog),
+        "keys": ("API Key Pool", test_key_pool)
     }
     
     if test_name.lower() in tests:
@@ -545,7 +2497,13 @@ if __name__ == "__main__":
         if command == "quick":
             quick_check()
         elif command in ["env", "imports", "api", "history", "session", 
-                        "models", "temp", "files", "darkmode", "prompt"]:
+                        "models", "temp", "files", "darkmode", "prompt",
+                        "search", "store", "stress", "compression", "codecs",
+                        "dedup", "export", "retention", "shards", "sessions",
+                        "window", "apiserver", "repl", "lazy", "bench",
+                        "loadtest", "cassettes", "metrics", "exporter",
+                        "tracing", "profile", "memory", "catalog",
+                        "keys"]:
             run_specific_test(command)
         elif command == "help":
             print("TextIQ Testing Suite")
@@ -562,6 +2520,30 @@ if __name__ == "__main__":
             print("  python testing.py files        - Test file structure")
             print("  python testing.py darkmode     - Test dark mode feature")
             print("  python testing.py prompt       - Test system prompt")
+            print("  python testing.py search       - Test chat history search")
+            print("  python testing.py store        - Test write-behind history store")
+            print("  python testing.py stress       - Stress test concurrent writer processes")
+            print("  python testing.py compression  - Test compressed history payloads")
+            print("  python testing.py codecs       - Test serialization codecs")
+            print("  python testing.py dedup        - Test message deduplication")
+            print("  python testing.py export       - Test history export/import")
+            print("  python testing.py retention    - Test history retention and archiving")
+            print("  python testing.py shards       - Test per-user history shards")
+            print("  python testing.py sessions     - Test session state store")
+            print("  python testing.py window       - Test bounded message window")
+            print("  python testing.py apiserver    - Test HTTP API server")
+            print("  python testing.py repl         - Test terminal chat client")
+            print("  python testing.py lazy         - Test heavy SDKs load on first use")
+            print("  python testing.py bench        - Test benchmark tools and baseline comparison")
+            print("  python testing.py loadtest     - Test concurrent-session load test harness")
+            print("  python testing.py cassettes    - Test recorded/replayed model responses")
+            print("  python testing.py metrics      - Test per-turn latency and token metrics")
+            print("  python testing.py exporter     - Test Prometheus metrics exporter")
+            print("  python testing.py tracing      - Test span tracing of chat turns")
+            print("  python testing.py profile      - Test on-demand CPU profiling")
+            print("  python testing.py memory       - Test per-session memory accounting")
+            print("  python testing.py catalog      - Test cached model list and parallel probes")
+            print("  python testing.py keys         - Test API key pool and rate-limit retries")
         else:
             print(f"Unknown command: {command}")
             print("Run 'python testing.py help' for usage")
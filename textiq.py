@@ -0,0 +1,410 @@
+"""
+TextIQ - Command Line Tools
+Terminal chat, and bulk export and import of chat history as JSONL
+"""
+
+import sys
+import time
+
+STARTED = time.perf_counter()
+
+import gzip
+import json
+import uuid
+import argparse
+from datetime import datetime
+from typing import List, Dict, Iterator, Optional, TextIO
+
+import core
+import metrics
+import tracing
+import history_store
+import retention
+import search_index
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Same history file the app uses
+CHAT_HISTORY_FILE = core.CHAT_HISTORY_FILE
+
+# Chats per import transaction
+IMPORT_BATCH_SIZE = 1000
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 1.0
+
+# How long `chat` waits for its last save on exit
+FLUSH_TIMEOUT = 10.0
+
+CHAT_PROMPT = "You: "
+CHAT_HELP = """Commands:
+  /new              start a new chat
+  /chats [n]        list the n most recent chats (default 10)
+  /resume <id>      continue a saved chat (an id prefix is enough)
+  /mode <name>      switch mode (Fast, Powerful, Balanced)
+  /exit             save and quit (also Ctrl-D)"""
+
+# ============================================================================
+# PROGRESS REPORTING
+# ============================================================================
+
+class Progress:
+    """Throttled chats-per-second progress lines on stderr"""
+
+    def __init__(self, verb: str, quiet: bool = False):
+        self.verb = verb
+        self.quiet = quiet
+        self.count = 0
+        self.started = time.perf_counter()
+        self.last_report = self.started
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def update(self, count: int = 1):
+        self.count += count
+        now = time.perf_counter()
+        if not self.quiet and now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            print(f"   {self.verb} {self.count:,} chats ({self.rate():,.0f} chats/s)", file=sys.stderr)
+
+    def done(self):
+        elapsed = time.perf_counter() - self.started
+        if not self.quiet:
+            print(f"✅ {self.verb} {self.count:,} chats in {elapsed:.1f}s "
+                  f"({self.rate():,.0f} chats/s)", file=sys.stderr)
+
+# ============================================================================
+# EXPORT / IMPORT
+# ============================================================================
+
+def export_chats(history_file: str, out: TextIO, quiet: bool = False) -> int:
+    """Stream every chat to out as one JSON object per line"""
+    progress = Progress("Exported", quiet)
+    for chat in history_store.iter_history_file(history_file):
+        out.write(json.dumps(chat, ensure_ascii=False))
+        out.write("\n")
+        progress.update()
+    out.flush()
+    progress.done()
+    return progress.count
+
+def read_jsonl(source: TextIO) -> Iterator[Dict]:
+    """Parse chats from JSONL, filling in fields older exports may lack"""
+    for line_number, line in enumerate(source, 1):
+        if not line.strip():
+            continue
+        try:
+            chat = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"line {line_number}: invalid JSON ({e})")
+        if not isinstance(chat, dict) or not isinstance(chat.get("messages"), list):
+            raise ValueError(f"line {line_number}: expected a chat object with a messages list")
+        if not chat["messages"]:
+            continue
+        chat.setdefault("id", uuid.uuid4().hex)
+        chat.setdefault("timestamp", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        chat.setdefault("updated", chat["timestamp"])
+        chat.setdefault("title", chat["messages"][0].get("content", "")[:50] + "...")
+        yield chat
+
+def import_chats(history_file: str, source: TextIO, batch_size: int = IMPORT_BATCH_SIZE, quiet: bool = False) -> int:
+    """Write chats from JSONL through the history store, one commit per batch"""
+    progress = Progress("Imported", quiet)
+    batch = []
+
+    def commit():
+        history_store.upsert_chats(history_file, batch)
+        # Failed commits are retried in the background; give up instead of waiting
+        while not history_store.flush(timeout=PROGRESS_INTERVAL):
+            error = history_store.last_error()
+            if error:
+                raise RuntimeError(f"Commit failed: {error}")
+        progress.update(len(batch))
+        batch.clear()
+
+    try:
+        for chat in read_jsonl(source):
+            batch.append(chat)
+            if len(batch) >= batch_size:
+                commit()
+        if batch:
+            commit()
+    finally:
+        # The app rebuilds the search index from the imported history on next use
+        search_index.invalidate(history_file)
+    progress.done()
+    return progress.count
+
+# ============================================================================
+# TERMINAL CHAT
+# ============================================================================
+
+def find_chat(history_file: str, chat_id: str) -> Optional[Dict]:
+    """Saved chat by id or unique id prefix"""
+    matches = [chat for chat in history_store.load_chats(history_file) if chat["id"].startswith(chat_id)]
+    exact = [chat for chat in matches if chat["id"] == chat_id]
+    if exact or len(matches) == 1:
+        return (exact or matches)[0]
+    if matches:
+        raise ValueError(f"'{chat_id}' matches {len(matches)} chats; use more of the id")
+    return None
+
+def resolve_mode(name: str) -> str:
+    """Mode name from a full or short name ("Fast" for "Fast Mode")"""
+    for mode in core.MODELS:
+        if name.lower() in (mode.lower(), mode.split()[0].lower()):
+            return mode
+    raise ValueError(f"Unknown mode '{name}' (use one of: {', '.join(core.MODELS)})")
+
+class ChatSession:
+    """A terminal conversation, saved to history after every reply like an app session"""
+
+    def __init__(self, history_file: str, mode: str = core.DEFAULT_MODE,
+                 system_prompt: str = core.DEFAULT_SYSTEM_PROMPT,
+                 temperature: float = core.DEFAULT_TEMPERATURE, save: bool = True):
+        self.history_file = history_file
+        self.mode = mode
+        self.system_prompt = system_prompt
+        self.temperature = temperature
+        self.save_enabled = save
+        self.new()
+
+    def new(self):
+        self.messages: List[Dict] = []
+        self.chat_id = uuid.uuid4().hex
+        self.saved_count = 0
+
+    def resume(self, chat: Dict):
+        self.messages = list(chat["messages"])
+        self.chat_id = chat["id"]
+        self.saved_count = len(self.messages)
+
+    def ask(self, prompt: str, out: TextIO) -> str:
+        """Stream the reply to prompt to out as it arrives"""
+        self.messages.append({"role": "user", "content": prompt})
+        turn = metrics.Turn(core.MODELS[self.mode])
+        span = tracing.start_trace("chat_turn", mode=self.mode)
+        parts = []
+        try:
+            for text in core.stream_response(self.messages, self.system_prompt,
+                                             core.MODELS[self.mode], self.temperature, turn):
+                parts.append(text)
+                out.write(text)
+                out.flush()
+        except KeyboardInterrupt:
+            # Drop the unfinished turn rather than saving half a reply
+            self.messages.pop()
+            out.write(" [interrupted]\n")
+            span.set_attribute("interrupted", True)
+            span.end()
+            return ""
+        out.write("\n")
+        response = "".join(parts)
+        self.messages.append({"role": "assistant", "content": response, "metrics": turn.as_dict()})
+        self.save()
+        span.end()
+        return response
+
+    def save(self):
+        """Queue the messages added since the last save (upsert by chat id)"""
+        if not self.save_enabled or len(self.messages) == self.saved_count:
+            return
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        chat_entry = {
+            "id": self.chat_id,
+            "timestamp": now,
+            "updated": now,
+            "title": self.messages[0]["content"][:50] + "..."
+        }
+        history_store.upsert_chat(self.history_file, chat_entry, self.saved_count,
+                                  self.messages[self.saved_count:])
+        self.saved_count = len(self.messages)
+
+def read_prompt(source: TextIO, out: TextIO) -> str:
+    """Next line typed by the user (EOFError at end of input)"""
+    if source is sys.stdin and out is sys.stdout and source.isatty():
+        return input(CHAT_PROMPT)  # Line editing and history
+    out.write(CHAT_PROMPT)
+    out.flush()
+    line = source.readline()
+    if not line:
+        raise EOFError
+    return line.rstrip("\n")
+
+def run_command(session: ChatSession, line: str, out: TextIO) -> bool:
+    """Handle a /command; False when the user asked to quit"""
+    command, _, argument = line[1:].partition(" ")
+    argument = argument.strip()
+    if command in ("exit", "quit"):
+        return False
+    if command == "new":
+        session.save()
+        session.new()
+        out.write("Started a new chat\n")
+    elif command == "chats":
+        chats = history_store.load_chats(session.history_file)
+        chats.sort(key=lambda chat: chat.get("updated") or chat.get("timestamp") or "", reverse=True)
+        for chat in chats[:int(argument or 10)]:
+            out.write(f"  {chat['id'][:8]}  {chat.get('updated', '')}  {chat.get('title', '')}\n")
+        if not chats:
+            out.write("No saved chats\n")
+    elif command == "resume":
+        chat = find_chat(session.history_file, argument) if argument else None
+        if chat is None:
+            raise ValueError(f"No saved chat '{argument}'")
+        session.save()
+        session.resume(chat)
+        out.write(f"Resumed '{chat.get('title', '')}' ({len(chat['messages'])} messages)\n")
+        for message in chat["messages"][-2:]:
+            speaker = "You" if message["role"] == "user" else "TextIQ"
+            out.write(f"{speaker}: {message['content']}\n")
+    elif command == "mode":
+        session.mode = resolve_mode(argument)
+        out.write(f"Using {session.mode} ({core.MODELS[session.mode]})\n")
+    else:
+        out.write(CHAT_HELP + "\n")
+    return True
+
+def chat(session: ChatSession, source: TextIO = sys.stdin, out: TextIO = sys.stdout, quiet: bool = False):
+    """Read prompts from source until /exit or end of input"""
+    if not quiet:
+        ready_ms = (time.perf_counter() - STARTED) * 1000
+        print(f"TextIQ chat - {session.mode}, {core.get_backend().name} backend "
+              f"(ready in {ready_ms:.0f} ms). /help for commands", file=sys.stderr)
+    try:
+        while True:
+            try:
+                line = read_prompt(source, out).strip()
+            except (EOFError, KeyboardInterrupt):
+                out.write("\n")
+                break
+            if not line:
+                continue
+            if line.startswith("/"):
+                try:
+                    if not run_command(session, line, out):
+                        break
+                except ValueError as e:
+                    out.write(f"❌ {e}\n")
+                continue
+            out.write("TextIQ: ")
+            session.ask(line, out)
+    finally:
+        session.save()
+        history_store.flush(FLUSH_TIMEOUT)
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="textiq", description="TextIQ command line tools")
+    parser.add_argument("--history", help=f"history file (default: {CHAT_HISTORY_FILE})")
+    parser.add_argument("--user", help="user shard to use, as the app names it (email:<address> or "
+                        "uid:<id>); default: the shared file. Required by chat when "
+                        "TEXTIQ_HISTORY_SHARDING=user, to see the same history as the app")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no progress output")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="stream chat history to JSONL")
+    export.add_argument("output", nargs="?", default="-", help="output file (default: stdout)")
+
+    load = commands.add_parser("import", help="add chats from a JSONL file")
+    load.add_argument("input", nargs="?", default="-", help="input file (default: stdin)")
+    load.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+                      help="chats per commit (default: %(default)s)")
+
+    talk = commands.add_parser("chat", help="chat in the terminal, with replies streamed as they arrive")
+    talk.add_argument("--resume", metavar="ID", help="continue a saved chat (an id prefix is enough)")
+    talk.add_argument("--mode", default=core.DEFAULT_MODE, help="%(default)s (default), Powerful Mode or Balanced Mode")
+    talk.add_argument("--temperature", type=float, default=core.DEFAULT_TEMPERATURE, help="0.0 - 1.5 (default: %(default)s)")
+    talk.add_argument("--system-prompt", default=core.DEFAULT_SYSTEM_PROMPT, help="default: the app's")
+    talk.add_argument("--backend", choices=core.BACKEND_NAMES, help="response backend (default: TEXTIQ_LLM_BACKEND)")
+    talk.add_argument("--no-save", action="store_true", help="don't save the conversation to history")
+
+    prune = commands.add_parser("prune", help="evict chats over the retention limits now")
+    prune.add_argument("--max-chats", type=int, default=retention.MAX_CHATS, help="0 = unlimited")
+    prune.add_argument("--max-mb", type=float, default=retention.MAX_MB, help="0 = unlimited")
+    prune.add_argument("--max-age-days", type=float, default=retention.MAX_AGE_DAYS, help="0 = unlimited")
+    prune.add_argument("--order", choices=["lru", "oldest"], default=retention.ORDER)
+    prune.add_argument("--archive", action="store_true", default=retention.ARCHIVE,
+                       help="move evicted chats to the compressed archive file")
+    return parser
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "chat" and not (args.user or args.history) and history_store.HISTORY_SHARDING != "none":
+        # The app keeps each user's chats in their own shard; the shared file
+        # would hold chats no app session shows
+        parser.error("the app keeps per-user history (TEXTIQ_HISTORY_SHARDING=user): pass --user "
+                     "email:<address> or uid:<id>, as in the app's URL")
+    args.history = args.history or CHAT_HISTORY_FILE
+    if args.user:
+        args.history = history_store.shard_path(args.history, args.user)
+
+    if args.command == "export":
+        if args.output == "-":
+            export_chats(args.history, sys.stdout, args.quiet)
+        else:
+            with open(args.output, 'w', encoding='utf-8') as out:
+                export_chats(args.history, out, args.quiet)
+        return 0
+
+    if args.command == "import":
+        try:
+            if args.input == "-":
+                import_chats(args.history, sys.stdin, args.batch_size, args.quiet)
+            else:
+                # Also reads the retention archive (.jsonl.gz) directly
+                opener = gzip.open if args.input.endswith(".gz") else open
+                with opener(args.input, 'rt', encoding='utf-8') as source:
+                    import_chats(args.history, source, args.batch_size, args.quiet)
+        except (ValueError, RuntimeError) as e:
+            print(f"❌ Import failed: {e}", file=sys.stderr)
+            return 1
+        return 0
+
+    if args.command == "chat":
+        if args.backend:
+            core.set_backend(core.create_backend(args.backend))
+        try:
+            session = ChatSession(args.history, resolve_mode(args.mode), args.system_prompt,
+                                  args.temperature, save=not args.no_save)
+            chat_to_resume = find_chat(args.history, args.resume) if args.resume else None
+        except ValueError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            return 1
+        if args.resume:
+            if chat_to_resume is None:
+                print(f"❌ No saved chat '{args.resume}'", file=sys.stderr)
+                return 1
+            session.resume(chat_to_resume)
+            if not args.quiet:
+                print(f"Resumed '{chat_to_resume.get('title', '')}' "
+                      f"({len(chat_to_resume['messages'])} messages)", file=sys.stderr)
+        chat(session, quiet=args.quiet)
+        return 0
+
+    if args.command == "prune":
+        policy = retention.RetentionPolicy(
+            args.max_chats, int(args.max_mb * 1024 * 1024), args.max_age_days, args.order, args.archive
+        )
+        if not policy.enabled:
+            print("❌ No retention limit set (see --help)", file=sys.stderr)
+            return 1
+        evicted = retention.enforce(args.history, policy)
+        stats = retention.stats()
+        action = "Archived" if policy.archive else "Deleted"
+        print(f"✅ {action} {len(evicted):,} chats; {stats['store_chats']:,} chats "
+              f"({stats['store_bytes'] / 1024 / 1024:.1f} MB) remain", file=sys.stderr)
+        return 0
+
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
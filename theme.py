@@ -0,0 +1,351 @@
+"""
+TextIQ - Theme
+Modern CSS with dark/light mode support
+"""
+
+from functools import lru_cache
+
+# ============================================================================
+# MODERN CSS WITH DARK/LIGHT MODE
+# ============================================================================
+
+@lru_cache(maxsize=None)
+def build_css(dark_mode: bool = False) -> str:
+    """CSS for the app in dark or light mode (built once per mode)"""
+    
+    if dark_mode:
+        # DARK MODE COLORS
+        bg_color = "#0f0f0f"
+        card_bg = "#1a1a1a"
+        text_color = "#ffffff"
+        text_secondary = "#b0b0b0"
+        border_color = "#333333"
+        user_msg_bg = "#000000"
+        user_msg_text = "#ffffff"
+        ai_msg_bg = "#2a2a2a"  # Light gray for AI messages
+        ai_msg_border = "#3a3a3a"
+        sidebar_bg = "#1a1a1a"
+        button_bg = "#ffffff"
+        button_text = "#000000"
+        button_hover_bg = "#e0e0e0"
+        input_bg = "#1a1a1a"
+        input_border = "#333333"
+    else:
+        # LIGHT MODE COLORS
+        bg_color = "#ffffff"
+        card_bg = "#ffffff"
+        text_color = "#000000"
+        text_secondary = "#6b7280"
+        border_color = "#e5e7eb"
+        user_msg_bg = "#000000"  # Black for user
+        user_msg_text = "#ffffff"
+        ai_msg_bg = "#e5e7eb"  # Light gray for AI
+        ai_msg_border = "#d1d5db"
+        sidebar_bg = "#f9fafb"
+        button_bg = "#000000"
+        button_text = "#ffffff"
+        button_hover_bg = "#1f2937"
+        input_bg = "#ffffff"
+        input_border = "#e5e7eb"
+    
+    return f"""
+        <style>
+        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap');
+        
+        * {{
+            font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
+        }}
+        
+        /* Main background */
+        .stApp {{
+            background: {bg_color};
+            transition: background 0.3s ease;
+        }}
+        
+        /* Hide Streamlit branding */
+        #MainMenu {{visibility: hidden;}}
+        footer {{visibility: hidden;}}
+        header {{visibility: hidden;}}
+        
+        /* Main title */
+        h1 {{
+            font-size: 3rem !important;
+            font-weight: 800 !important;
+            color: {text_color};
+            text-align: center;
+            margin-bottom: 0.5rem !important;
+            letter-spacing: -0.02em;
+        }}
+        
+        /* Chat message container */
+        .stChatMessage {{
+            border-radius: 18px !important;
+            padding: 1rem 1.2rem !important;
+            margin: 0.5rem 0 !important;
+            max-width: 70% !important;
+            animation: slideUp 0.3s ease-out;
+            box-shadow: 0 1px 2px rgba(0, 0, 0, 0.1);
+            width: fit-content !important;
+        }}
+        
+        @keyframes slideUp {{
+            from {{
+                opacity: 0;
+                transform: translateY(10px);
+            }}
+            to {{
+                opacity: 1;
+                transform: translateY(0);
+            }}
+        }}
+        
+        /* Force user messages to RIGHT */
+        div[data-testid="stChatMessageContainer"]:has([data-testid*="user"]) {{
+            display: flex !important;
+            justify-content: flex-end !important;
+        }}
+        
+        /* Force AI messages to LEFT */
+        div[data-testid="stChatMessageContainer"]:has([data-testid*="assistant"]) {{
+            display: flex !important;
+            justify-content: flex-start !important;
+        }}
+        
+        /* User messages - RIGHT side, BLACK like iMessage */
+        .stChatMessage[data-testid*="user"] {{
+            background: #000000 !important;
+            color: #ffffff !important;
+            border: none !important;
+            border-radius: 18px 18px 4px 18px !important;
+            float: right !important;
+            clear: both !important;
+        }}
+        
+        .stChatMessage[data-testid*="user"] p {{
+            color: #ffffff !important;
+            margin: 0 !important;
+        }}
+        
+        .stChatMessage[data-testid*="user"] .stMarkdown {{
+            color: #ffffff !important;
+        }}
+        
+        .stChatMessage[data-testid*="user"] div {{
+            color: #ffffff !important;
+        }}
+        
+        /* AI messages - LEFT side, LIGHT GRAY like WhatsApp */
+        .stChatMessage[data-testid*="assistant"] {{
+            background: {ai_msg_bg} !important;
+            border: 1px solid {ai_msg_border} !important;
+            color: {text_color} !important;
+            border-radius: 18px 18px 18px 4px !important;
+            float: left !important;
+            clear: both !important;
+        }}
+        
+        .stChatMessage[data-testid*="assistant"] p {{
+            color: {text_color} !important;
+            margin: 0 !important;
+        }}
+        
+        .stChatMessage[data-testid*="assistant"] div {{
+            color: {text_color} !important;
+        }}
+        
+        /* Chat message content wrapper */
+        .stChatMessage > div {{
+            max-width: 100% !important;
+        }}
+        
+        /* Clear floats after each message */
+        .stChatMessage::after {{
+            content: "";
+            display: table;
+            clear: both;
+        }}
+        
+        /* Main chat container */
+        section[data-testid="stVerticalBlock"] > div {{
+            display: block !important;
+        }}
+        
+        /* Override Streamlit's flex container */
+        .element-container {{
+            width: 100% !important;
+        }}
+        
+        /* Sidebar */
+        section[data-testid="stSidebar"] {{
+            background: {sidebar_bg} !important;
+            border-right: 1px solid {border_color};
+        }}
+        
+        section[data-testid="stSidebar"] > div {{
+            padding-top: 1rem;
+        }}
+        
+        /* Make sidebar toggle button more visible */
+        button[kind="header"] {{
+            background: {button_bg} !important;
+            color: {button_text} !important;
+            border-radius: 8px !important;
+            padding: 0.5rem !important;
+        }}
+        
+        /* Sidebar collapse button styling */
+        section[data-testid="stSidebar"] button[kind="header"] {{
+            display: block !important;
+            visibility: visible !important;
+        }}
+        
+        /* Buttons */
+        .stButton > button {{
+            background: {button_bg};
+            color: {button_text};
+            border: 2px solid {button_bg};
+            border-radius: 12px;
+            padding: 0.75rem 1.5rem;
+            font-weight: 600;
+            font-size: 0.95rem;
+            transition: all 0.2s ease;
+            width: 100%;
+        }}
+        
+        .stButton > button:hover {{
+            background: {button_hover_bg};
+            border-color: {button_hover_bg};
+            transform: translateY(-1px);
+        }}
+        
+        /* Small buttons */
+        .small-button {{
+            background: {button_bg};
+            color: {button_text};
+            border: 1px solid {button_bg};
+            border-radius: 8px;
+            padding: 0.5rem 1rem;
+            font-weight: 600;
+            font-size: 0.85rem;
+            cursor: pointer;
+            transition: all 0.2s ease;
+            display: inline-block;
+        }}
+        
+        .small-button:hover {{
+            transform: translateY(-1px);
+        }}
+        
+        /* Chat input */
+        .stChatInputContainer {{
+            background: {input_bg} !important;
+            border: 2px solid {input_border} !important;
+            border-radius: 16px !important;
+            padding: 0.5rem !important;
+        }}
+        
+        /* Text area */
+        .stTextArea textarea {{
+            background: {input_bg} !important;
+            border: 2px solid {input_border} !important;
+            border-radius: 12px;
+            padding: 0.75rem;
+            font-size: 0.95rem;
+            color: {text_color};
+        }}
+        
+        /* Select box */
+        .stSelectbox > div > div {{
+            background: {input_bg} !important;
+            border: 2px solid {input_border} !important;
+            border-radius: 12px;
+            color: {text_color};
+        }}
+        
+        /* Slider */
+        .stSlider > div > div > div {{
+            background: {button_bg};
+        }}
+        
+        /* Labels */
+        label {{
+            color: {text_color} !important;
+            font-weight: 600 !important;
+            font-size: 0.9rem !important;
+        }}
+        
+        /* Captions */
+        .stCaption {{
+            color: {text_secondary} !important;
+        }}
+        
+        /* Expander */
+        .streamlit-expanderHeader {{
+            background: {card_bg} !important;
+            border: 2px solid {border_color} !important;
+            border-radius: 12px;
+            color: {text_color} !important;
+            font-weight: 600 !important;
+        }}
+        
+        /* Chat history item */
+        .chat-history-item {{
+            background: {card_bg};
+            border: 2px solid {border_color};
+            border-radius: 12px;
+            padding: 0.75rem;
+            margin-bottom: 0.5rem;
+            cursor: pointer;
+            transition: all 0.2s ease;
+        }}
+        
+        .chat-history-item:hover {{
+            border-color: {button_bg};
+            transform: translateX(4px);
+        }}
+        
+        .chat-history-title {{
+            color: {text_color};
+            font-weight: 600;
+            font-size: 0.9rem;
+            margin-bottom: 0.25rem;
+        }}
+        
+        .chat-history-time {{
+            color: {text_secondary};
+            font-size: 0.75rem;
+        }}
+        
+        /* Divider */
+        hr {{
+            border: none;
+            height: 1px;
+            background: {border_color};
+            margin: 1rem 0;
+        }}
+        
+        /* Scrollbar */
+        ::-webkit-scrollbar {{
+            width: 10px;
+        }}
+        
+        ::-webkit-scrollbar-track {{
+            background: {sidebar_bg};
+        }}
+        
+        ::-webkit-scrollbar-thumb {{
+            background: {border_color};
+            border-radius: 5px;
+        }}
+        
+        /* Input text */
+        input {{
+            color: {text_color} !important;
+        }}
+        
+        /* Markdown */
+        .stMarkdown {{
+            color: {text_color};
+        }}
+        </style>
+    """
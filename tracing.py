@@ -0,0 +1,230 @@
+"""
+TextIQ - Tracing
+Spans around the stages of a rerun or chat turn, written as OpenTelemetry
+(OTLP JSON) trace files; no collector needed
+"""
+
+import os
+import json
+import time
+import secrets
+import threading
+import contextvars
+from functools import wraps
+from typing import List, Dict, Optional
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# "1" turns tracing on; off, span() returns a shared no-op span
+TRACE_ENABLED = os.getenv("TEXTIQ_TRACE", "0").lower() in ("1", "true", "yes")
+
+# One JSON file per finished trace is written here
+TRACE_DIR = os.getenv("TEXTIQ_TRACE_DIR", "traces")
+
+SERVICE_NAME = "textiq"
+
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# ============================================================================
+# SPANS
+# ============================================================================
+
+_current: contextvars.ContextVar = contextvars.ContextVar("textiq_span", default=None)
+
+class Span:
+    """One timed operation; children share the root's trace id and span list"""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[Dict] = None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.attributes: Dict = dict(attributes or {})
+        self.events: List[Dict] = []
+        self.status = STATUS_OK
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.finished: List["Span"] = parent.finished if parent else []  # Every span of this trace
+        self._token = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_exception(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = str(error)[:200]
+        self.events.append({"name": "exception", "time_ns": time.time_ns(), "attributes": {
+            "exception.type": type(error).__name__,
+            "exception.message": str(error)[:200],
+        }})
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        self.finished.append(self)
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:
+                _current.set(self.parent)  # Ended in another context (e.g. a generator)
+            self._token = None
+        if self.parent is None:
+            export(self.finished)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # BaseExceptions (st.rerun()/st.stop(), a closed generator) are control flow, not errors
+        if isinstance(exc, Exception):
+            self.record_exception(exc)
+        self.end()
+        return False
+
+
+class _NoopSpan:
+    """Stand-in returned while tracing is off"""
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def record_exception(self, error: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = _NoopSpan()
+
+def start_span(name: str, **attributes):
+    """Start a span under the current one (a new trace if there is none); end() it"""
+    if not TRACE_ENABLED:
+        return NOOP_SPAN
+    span = Span(name, _current.get(), attributes)
+    span._token = _current.set(span)
+    return span
+
+def start_trace(name: str, **attributes):
+    """Start a new trace, ignoring any span left open by an interrupted run"""
+    if not TRACE_ENABLED:
+        return NOOP_SPAN
+    span = Span(name, None, attributes)
+    span._token = _current.set(span)
+    return span
+
+def span(name: str, **attributes):
+    """Context manager timing a block: `with tracing.span("load_all_chats"):`"""
+    return start_span(name, **attributes)
+
+def traced(name: Optional[str] = None):
+    """Decorator that runs the function inside a span"""
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACE_ENABLED:
+                return func(*args, **kwargs)
+            with start_span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def current_span():
+    """Innermost open span (the no-op span if none or tracing is off)"""
+    return (_current.get() if TRACE_ENABLED else None) or NOOP_SPAN
+
+def enable(trace_dir: Optional[str] = None):
+    """Turn tracing on (optionally writing to another directory)"""
+    global TRACE_ENABLED, TRACE_DIR
+    TRACE_DIR = trace_dir or TRACE_DIR
+    TRACE_ENABLED = True
+
+def disable():
+    global TRACE_ENABLED
+    TRACE_ENABLED = False
+
+# ============================================================================
+# OTLP JSON EXPORT
+# ============================================================================
+
+_export_lock = threading.Lock()
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_attributes(attributes: Dict) -> List[Dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+def to_otlp(spans: List[Span]) -> Dict:
+    """Spans as an OTLP/JSON ExportTraceServiceRequest"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME, "process.pid": os.getpid()})},
+        "scopeSpans": [{
+            "scope": {"name": "textiq.tracing"},
+            "spans": [{
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent.span_id if span.parent else "",
+                "name": span.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": _otlp_attributes(span.attributes),
+                "events": [{
+                    "name": event["name"],
+                    "timeUnixNano": str(event["time_ns"]),
+                    "attributes": _otlp_attributes(event["attributes"]),
+                } for event in span.events],
+                "status": {"code": span.status, "message": span.status_message},
+            } for span in sorted(spans, key=lambda span: span.start_ns)],
+        }],
+    }]}
+
+def export(spans: List[Span]) -> Optional[str]:
+    """Write a finished trace to TRACE_DIR; returns the file path"""
+    root = next((span for span in spans if span.parent is None), spans[-1])
+    path = os.path.join(TRACE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{root.name.replace(' ', '_').replace('/', '_')}"
+                                   f"-{root.trace_id[:12]}.json")
+    try:
+        with _export_lock:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(to_otlp(spans), f)
+    except OSError:
+        return None  # Tracing must never break the request it traces
+    return path
+
+def summarize(path: str) -> List[tuple]:
+    """(depth, name, duration ms) for each span in a trace file, in start order"""
+    with open(path, encoding="utf-8") as f:
+        spans = json.load(f)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    parents = {span["spanId"]: span["parentSpanId"] for span in spans}
+
+    def depth(span_id: str) -> int:
+        level = 0
+        while parents.get(span_id):
+            span_id = parents[span_id]
+            level += 1
+        return level
+
+    return [(depth(span["spanId"]), span["name"],
+             (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6) for span in spans]